@@ -0,0 +1,226 @@
+# Event loop equivalents of anansi.comms built on trollius, the
+# asyncio port for Python 2. trollius is an optional dependency
+# (pip install trollius) only needed by this module and
+# anansi.tcc.aio_servers.
+import logging
+import trollius as asyncio
+from trollius import From,Return
+from anansi.comms import SocketError,MAX_PACKET_SIZE
+from anansi import codec
+from anansi import exit_funcs
+logger = logging.getLogger('anansi')
+
+
+class AsyncTCPClient(object):
+    """Stream client with timeouts and automatic reconnection.
+
+    Notes: Failed sends and receives drop the connection. With
+    reconnect enabled the next call re-opens it, waiting
+    reconnect_wait seconds between up to retries attempts.
+
+    Args:
+    ip -- server address
+    port -- server port
+    timeout -- timeout in seconds applied to connects and reads
+    reconnect -- re-open dropped connections on the next call
+    retries -- connection attempts per call
+    reconnect_wait -- seconds between connection attempts
+    loop -- event loop (defaults to the current event loop)
+    """
+    def __init__(self,ip,port,timeout=2,reconnect=True,retries=3,
+                 reconnect_wait=1.0,loop=None):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.reconnect = reconnect
+        self.retries = retries
+        self.reconnect_wait = reconnect_wait
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self._reader = None
+        self._writer = None
+
+    def connected(self):
+        return self._writer is not None
+
+    @asyncio.coroutine
+    def connect(self):
+        attempts = self.retries if self.reconnect else 1
+        for attempt in range(attempts):
+            if attempt:
+                yield From(asyncio.sleep(self.reconnect_wait,loop=self.loop))
+            try:
+                self._reader,self._writer = yield From(asyncio.wait_for(
+                        asyncio.open_connection(self.ip,self.port,loop=self.loop),
+                        self.timeout,loop=self.loop))
+            except (asyncio.TimeoutError,EnvironmentError) as error:
+                logger.warning("Connection attempt %d to %s:%d failed: %s"%(
+                        attempt+1,self.ip,self.port,error))
+                last_error = error
+            else:
+                return
+        raise SocketError(self,last_error)
+
+    @asyncio.coroutine
+    def _ensure_connected(self):
+        if not self.connected():
+            yield From(self.connect())
+
+    @asyncio.coroutine
+    def send(self,msg):
+        yield From(self._ensure_connected())
+        try:
+            self._writer.write(msg)
+            yield From(self._writer.drain())
+        except EnvironmentError as error:
+            self.close()
+            raise SocketError(self,error)
+
+    @asyncio.coroutine
+    def _read(self,read_coroutine):
+        yield From(self._ensure_connected())
+        try:
+            data = yield From(asyncio.wait_for(read_coroutine(),self.timeout,loop=self.loop))
+        except asyncio.TimeoutError:
+            self.close()
+            raise SocketError(self,"Timed out after %.1f seconds"%self.timeout)
+        except (EnvironmentError,asyncio.IncompleteReadError) as error:
+            self.close()
+            raise SocketError(self,error)
+        raise Return(data)
+
+    @asyncio.coroutine
+    def receive(self,n=MAX_PACKET_SIZE):
+        data = yield From(self._read(lambda: self._reader.read(n)))
+        if not data:
+            self.close()
+            raise SocketError(self,"Connection closed")
+        raise Return(data)
+
+    @asyncio.coroutine
+    def receive_exactly(self,n):
+        data = yield From(self._read(lambda: self._reader.readexactly(n)))
+        raise Return(data)
+
+    def close(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+        self._reader = None
+        self._writer = None
+
+
+class AsyncFrameClient(AsyncTCPClient):
+    """Stream client for the eZ80 frame protocol.
+
+    Args:
+    control_node -- the node name used in the frame header
+    (remaining arguments as for AsyncTCPClient)
+    """
+    def __init__(self,control_node,ip,port,**kwargs):
+        super(AsyncFrameClient,self).__init__(ip,port,**kwargs)
+        self._codec = codec.FrameCodec(control_node)
+        self._buffer = codec.FrameBuffer(self._codec)
+        self._frames = []
+
+    @asyncio.coroutine
+    def send_command(self,code,data=None):
+        header,data = self._codec.encode(code,data)
+        yield From(self.send(header+data))
+
+    @asyncio.coroutine
+    def receive_frame(self):
+        while not self._frames:
+            chunk = yield From(self.receive())
+            self._buffer.feed(chunk)
+            self._frames.extend(self._buffer.frames())
+        raise Return(self._frames.pop(0))
+
+    def close(self):
+        super(AsyncFrameClient,self).close()
+        self._buffer.clear()
+        self._frames = []
+
+
+class AsyncTCPServer(object):
+    """Event loop server base class.
+
+    Notes: Each connection reads one request message (unless
+    request_expected is False), passes it to respond() in the loop's
+    executor so that blocking controller calls do not stall the loop,
+    and writes back the returned string. Subclasses override respond()
+    and, for multi-read messages, message_complete().
+
+    Args:
+    ip -- address to bind to
+    port -- port to bind to
+    timeout -- seconds allowed for a client to send its request
+    loop -- event loop (defaults to the current event loop)
+    """
+    request_expected = True
+
+    def __init__(self,ip,port,timeout=10.0,loop=None):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.server = None
+
+    @asyncio.coroutine
+    def start(self):
+        self.server = yield From(asyncio.start_server(
+                self._handle_client,self.ip,self.port,
+                loop=self.loop,reuse_address=True))
+        # pick up the bound port when serving on port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+        exit_funcs.register(self.shutdown)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        exit_funcs.deregister(self.shutdown)
+
+    def message_complete(self,msg):
+        """Return True once msg holds a full request."""
+        return True
+
+    def respond(self,msg):
+        """Return the response string for a request (runs in the executor)."""
+        raise NotImplementedError
+
+    @asyncio.coroutine
+    def read_request(self,reader):
+        chunks = []
+        deadline = self.loop.time() + self.timeout
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            chunk = yield From(asyncio.wait_for(reader.read(8192),remaining,loop=self.loop))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if self.message_complete("".join(chunks)):
+                break
+        raise Return("".join(chunks))
+
+    @asyncio.coroutine
+    def handle(self,reader,writer):
+        msg = None
+        if self.request_expected:
+            msg = yield From(self.read_request(reader))
+        response = yield From(self.loop.run_in_executor(None,self.respond,msg))
+        writer.write(response)
+        yield From(writer.drain())
+
+    @asyncio.coroutine
+    def _handle_client(self,reader,writer):
+        try:
+            yield From(self.handle(reader,writer))
+        except Exception:
+            logger.error("Exception while handling client on %s:%d"%(self.ip,self.port),
+                         exc_info=True)
+        finally:
+            writer.close()
@@ -1,8 +1,24 @@
 from datetime import datetime
 from threading import _Timer,Thread,Event
-import ctypes as C
-from struct import unpack,pack
- 
+from struct import unpack,pack,Struct
+import numpy as np
+
+# Status byte and "U" payload (status byte and 24-bit little-endian
+# count for each arm). Each count is split into a 16-bit low word and
+# an 8-bit high byte so that a full payload unpacks in a single call.
+STATUS_STRUCT = Struct("<B")
+POSITION_STRUCT = Struct("<BHBBHB")
+
+# big-endian IEEE754 single precision float
+FLOAT_STRUCT = Struct(">f")
+
+# record layout of decoded "U" payload arrays
+POSITION_DTYPE = np.dtype([
+    ("east_status",np.uint8),
+    ("east_count",np.uint32),
+    ("west_status",np.uint8),
+    ("west_count",np.uint32)])
+
 def gen_header_decoder(control_node):
     header_decoder = [
         ("Control node"  ,lambda x:x,len(control_node)),
@@ -31,78 +47,187 @@ def simple_encoder(node,command,data=None):
     return header,data
 
 
+def decode_status(data):
+    """Decode a single status byte payload."""
+    return STATUS_STRUCT.unpack_from(data)[0]
+
+def decode_position(data):
+    """Decode a "U" payload into a position dictionary."""
+    es,elo,ehi,ws,wlo,whi = POSITION_STRUCT.unpack_from(data)
+    return {
+        "east_status":es,
+        "east_count":elo|(ehi<<16),
+        "west_status":ws,
+        "west_count":wlo|(whi<<16)
+        }
+
+def encode_position(east_status,east_count,west_status,west_count):
+    """Encode arm statuses and counts as a "U" payload."""
+    return POSITION_STRUCT.pack(east_status,east_count&0xffff,(east_count>>16)&0xff,
+                                west_status,west_count&0xffff,(west_count>>16)&0xff)
+
+
+class FrameCodec(object):
+    """Precompiled codec for eZ80 frames.
+
+    A frame is a header (control node, HOB, LOB, command option)
+    followed by HOB*256+LOB bytes of data. The header layout for
+    a given control node is compiled once into a struct.Struct.
+
+    Args:
+    control_node -- the node name used in the frame header
+    """
+    def __init__(self,control_node):
+        self.control_node = control_node
+        self.header = Struct("<%dsBBc"%len(control_node))
+        self.header_size = self.header.size
+
+    def decode_header(self,msg,offset=0):
+        """Decode a header into the dictionary format of simple_decoder."""
+        node,hob,lob,code = self.header.unpack_from(msg,offset)
+        return {
+            "Control node":node,
+            "HOB":hob,
+            "LOB":lob,
+            "Command option":code
+            }
+
+    def encode(self,command,data=None):
+        """Encode a command as (header,data) strings."""
+        if data is None:
+            data = ""
+        size = len(data)
+        return self.header.pack(self.control_node,size/256,size%256,command),data
+
+    def split_frames(self,buf,offset=0,end=None):
+        """Split a run of complete frames out of a byte buffer.
+
+        Notes: A trailing partial frame is left in place, the returned
+        offset points at its first byte. Payloads are copied out, as
+        frames may be queued while buf is reused for later reads.
+
+        Returns: list of (header,data) tuples, offset of first unconsumed byte
+        """
+        if end is None:
+            end = len(buf)
+        unpack_header = self.header.unpack_from
+        header_size = self.header_size
+        view = memoryview(buf)
+        frames = []
+        while end - offset >= header_size:
+            node,hob,lob,code = unpack_header(buf,offset)
+            start = offset + header_size
+            stop = start + hob*256 + lob
+            if stop > end:
+                break
+            header = {
+                "Control node":node,
+                "HOB":hob,
+                "LOB":lob,
+                "Command option":code
+                }
+            data = view[start:stop].tobytes() if stop > start else None
+            frames.append((header,data))
+            offset = stop
+        return frames,offset
+
+
+class FrameBuffer(object):
+    """Reusable buffer that reassembles eZ80 frames from a byte stream.
+
+    Notes: Bytes are fed in as they arrive from the socket, in
+    whatever chunk sizes the reads return. Complete frames are
+    split out and any partial frame is kept for the next feed.
+
+    Args:
+    frame_codec -- FrameCodec for the drive's control node
+    size -- initial buffer size in bytes (grown as required)
+    """
+    def __init__(self,frame_codec,size=4096):
+        self.codec = frame_codec
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def _reserve(self,nbytes):
+        if self._end + nbytes <= len(self._buffer):
+            return
+        pending = self._end - self._start
+        if pending + nbytes > len(self._buffer):
+            self._buffer.extend(bytearray(pending + nbytes - len(self._buffer)))
+        self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def writable(self,nbytes):
+        """Return a memoryview of at least nbytes free space for direct reads.
+
+        Notes: Call commit() with the number of bytes actually written.
+        """
+        self._reserve(nbytes)
+        return memoryview(self._buffer)[self._end:]
+
+    def commit(self,nbytes):
+        """Mark nbytes written through writable() as received."""
+        self._end += nbytes
+
+    def feed(self,chunk):
+        """Append received bytes to the buffer."""
+        nbytes = len(chunk)
+        self._reserve(nbytes)
+        self._buffer[self._end:self._end+nbytes] = chunk
+        self._end += nbytes
+
+    def frames(self):
+        """Remove and return all complete (header,data) frames."""
+        frames,self._start = self.codec.split_frames(self._buffer,self._start,self._end)
+        if self._start == self._end:
+            self.clear()
+        return frames
+
+
 def ft_unpack(data):
     """IEEE754 float data unpacker
 
-    :param data: a byte string of length 4
+    :param data: a big-endian byte string of length 4
     :return: floating point representation of data
     """
-    bits = 32
-    expbits = 8
-    shift = C.c_longlong()
-    result = C.c_longdouble()
-    data = unpack("BBBB",data)
-    buf = (C.c_ubyte*4)(*data)
-    i = buf[0]<<24 | buf[1]<<16 | buf[2]<<8 | buf[3]<<0
-    significandbits = bits - expbits - 1
-    if (i==0):
-        return 0.0;
-    result.value = (i&((1<<significandbits)-1)) 
-    result.value /= (1<<significandbits) 
-    result.value += 1.0 
-    bias = (1<<(expbits-1)) - 1
-    shift.value = ((i>>significandbits)&((1<<expbits)-1)) - bias;
-    while(shift.value > 0):
-        result.value *= 2.0
-        shift.value-=1
-    while(shift.value < 0):
-        result.value /= 2.0
-        shift.value+=1
-    result.value *= -1.0 if (i>>(bits-1))&1 else 1.0
-    return result.value
-
+    return FLOAT_STRUCT.unpack_from(data)[0]
 
 def ft_pack(value):
     """IEEE754 float data packer
 
     :param value: a floating point number
-    :return: an 4 bytes string 
+    :return: a big-endian 4 byte string
+    :raises OverflowError: if |value| exceeds the single precision
+                           maximum (FLT_MAX); infinities and NaN pack
+                           as their IEEE754 patterns
+    """
+    return FLOAT_STRUCT.pack(value)
+
+def ft_unpack_array(data):
+    """Unpack a buffer of big-endian IEEE754 floats.
+
+    :param data: a byte string or buffer with length divisible by 4
+    :return: float64 array
+    """
+    return np.frombuffer(data,dtype=">f4").astype(np.float64)
+
+def ft_pack_array(values):
+    """Pack an array of floating point numbers as big-endian IEEE754 floats.
+
+    :param values: array-like of floating point numbers
+    :return: a byte string of length 4*len(values)
     """
-    bits = 32
-    expbits = 8
-    significandbits = C.c_uint(bits - expbits - 1)
-    value = C.c_longdouble(value)
-    shift = C.c_int()
-    output = (C.c_ubyte*4)(0,0,0,0)
-
-    if (value.value == 0.0):
-        return output
-
-    if (value.value < 0):
-        sign = 1
-        fnorm = -value.value
-    else:
-        sign = 0
-        fnorm = value.value
-
-    shift.value = 0
-    while (fnorm >= 2.0):
-        fnorm/=2.0
-        shift.value+=1
-    while (fnorm < 1.0):
-        fnorm *= 2.0
-        shift.value -= 1
-    fnorm = fnorm - 1.0
-    
-    significand = C.c_longlong(long(fnorm * ((1<<significandbits.value) + 0.5)))
-    exp = shift.value + ((1<<(expbits-1)) - 1)
-    result = C.c_ulonglong((sign<<(bits-1)) | (exp<<(bits-expbits-1)) | significand.value)
-    output[0] = result.value >> 24
-    output[1] = result.value >> 16
-    output[2] = result.value >> 8
-    output[3] = result.value >> 0
-    return output
-    
+    return np.asarray(values,dtype=">f4").tobytes()
+
 def it_pack(val):
     to_pack = []
     to_pack.append(val&255)
@@ -114,4 +239,53 @@ def it_unpack(val):
     x = unpack("BBB",val)
     val = x[0] + x[1]*256 + x[2]*256**2
     return val
-    
+
+def it_pack_array(values):
+    """Pack an array of encoder counts as 24-bit little-endian integers.
+
+    :param values: array-like of integer counts
+    :return: a byte string of length 3*len(values)
+    """
+    values = np.asarray(values).astype("<u4").ravel()
+    return values.view(np.uint8).reshape(-1,4)[:,:3].tobytes()
+
+def it_unpack_array(data):
+    """Unpack a buffer of 24-bit little-endian encoder counts.
+
+    :param data: a byte string or buffer with length divisible by 3
+    :return: uint32 array of counts
+    """
+    raw = np.frombuffer(data,dtype=np.uint8)
+    if raw.size % 3:
+        raise ValueError("Buffer length %d is not a multiple of 3"%raw.size)
+    padded = np.zeros((raw.size/3,4),dtype=np.uint8)
+    padded[:,:3] = raw.reshape(-1,3)
+    return padded.view("<u4").ravel()
+
+def decode_position_array(data):
+    """Decode a buffer of concatenated "U" payloads.
+
+    :param data: a byte string or buffer with length divisible by 8
+    :return: record array with POSITION_DTYPE fields
+    """
+    raw = np.frombuffer(data,dtype=np.uint8)
+    if raw.size % POSITION_STRUCT.size:
+        raise ValueError("Buffer length %d is not a multiple of %d"%(
+                raw.size,POSITION_STRUCT.size))
+    raw = raw.reshape(-1,POSITION_STRUCT.size)
+    decoded = np.recarray(raw.shape[0],dtype=POSITION_DTYPE)
+    decoded.east_status = raw[:,0]
+    decoded.east_count = it_unpack_array(raw[:,1:4].tobytes())
+    decoded.west_status = raw[:,4]
+    decoded.west_count = it_unpack_array(raw[:,5:8].tobytes())
+    return decoded
+
+def encode_position_array(east_status,east_count,west_status,west_count):
+    """Encode arrays of arm statuses and counts as concatenated "U" payloads."""
+    east_count = np.asarray(east_count)
+    raw = np.empty((east_count.size,POSITION_STRUCT.size),dtype=np.uint8)
+    raw[:,0] = east_status
+    raw[:,1:4] = np.frombuffer(it_pack_array(east_count),dtype=np.uint8).reshape(-1,3)
+    raw[:,4] = west_status
+    raw[:,5:8] = np.frombuffer(it_pack_array(west_count),dtype=np.uint8).reshape(-1,3)
+    return raw.tobytes()
@@ -1,9 +1,10 @@
 import socket
 import SocketServer
 import sys
-from time import sleep
+from select import select
+from time import sleep,time
 from multiprocessing import RawArray,RawValue
-from threading import Thread,Event
+from threading import Thread,Event,Lock,Semaphore
 from Queue import Queue
 import ctypes as C
 from struct import unpack
@@ -12,6 +13,7 @@ from anansi import decorators
 from anansi import exit_funcs
 from anansi import log
 MAX_PACKET_SIZE = 64000 #bytes
+RECV_TIMEOUT = 10.0 #seconds
 logger = logging.getLogger('anansi')
 
 class SocketError(Exception):
@@ -59,6 +61,26 @@ class BaseConnection(object):
             self.sock = None
 
 
+def xml_message_complete(root_tag):
+    """Return a test for a message that has closed its root element."""
+    closing_tags = ("</%s>"%root_tag,"<%s/>"%root_tag)
+    def complete(msg):
+        tail = msg.rstrip()
+        return tail.endswith(closing_tags[0]) or tail.endswith(closing_tags[1])
+    return complete
+
+def length_prefix_complete(prefix):
+    """Return a test for a message that starts with a struct packed length.
+
+    :param prefix: struct.Struct with a single integer field
+    """
+    def complete(msg):
+        if len(msg) < prefix.size:
+            return False
+        return len(msg) >= prefix.size + prefix.unpack_from(msg)[0]
+    return complete
+
+
 class BaseHandler(SocketServer.BaseRequestHandler):
     def __init__(self, request, client_address, server):
         self.server = server
@@ -66,22 +88,104 @@ class BaseHandler(SocketServer.BaseRequestHandler):
         SocketServer.BaseRequestHandler.__init__(self,request,
                                                  client_address, server)
 
-    def recvall(self):
+    def recvall(self,complete=None,timeout=None):
+        """Receive a full message from the client.
+
+        Notes: Waits on the socket with select rather than polling.
+        Without a completion test the message is taken to be all data
+        available once the first bytes arrive. The message also ends
+        when the client closes its side of the connection.
+
+        Args:
+        complete -- callable returning True once a message is complete
+        timeout -- deadline in seconds (defaults to server.recv_timeout)
+        """
+        if timeout is None:
+            timeout = getattr(self.server,"recv_timeout",RECV_TIMEOUT)
+        deadline = time() + timeout
         message = []
-        self.request.setblocking(0)
         while True:
-            try:
-                message.append(self.request.recv(8192))
-            except:
-                if not message:
-                    continue
-                else:
+            if message and complete is None:
+                wait = 0
+            else:
+                wait = deadline - time()
+                if wait <= 0:
+                    raise SocketError(self.server,"Timed out receiving from %s:%d"%(
+                            self.client_address))
+            readable,_,_ = select([self.request],[],[],wait)
+            if not readable:
+                if complete is None and message:
                     break
+                continue
+            chunk = self.request.recv(8192)
+            if not chunk:
+                break
+            message.append(chunk)
+            if complete is not None and complete("".join(message)):
+                break
         return "".join(message)
             
 
+class RequestStats(object):
+    """Latency and queue-wait counters for requests handled by a TCPServer."""
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.handled = 0
+            self.rejected = 0
+            self.total_latency = 0.0
+            self.max_latency = 0.0
+            self.total_queue_wait = 0.0
+            self.max_queue_wait = 0.0
+
+    def record(self,queue_wait,latency):
+        with self._lock:
+            self.handled += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency,latency)
+            self.total_queue_wait += queue_wait
+            self.max_queue_wait = max(self.max_queue_wait,queue_wait)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def as_dict(self):
+        with self._lock:
+            n = max(self.handled,1)
+            return {
+                "handled":self.handled,
+                "rejected":self.rejected,
+                "mean_latency":self.total_latency/n,
+                "max_latency":self.max_latency,
+                "mean_queue_wait":self.total_queue_wait/n,
+                "max_queue_wait":self.max_queue_wait
+                }
+
+
 class TCPServer(SocketServer.TCPServer):
-    def __init__(self, ip, port, handler_class=BaseHandler):
+    """TCP server with optional bounded worker pool.
+
+    Notes: With workers=0 requests are handled one at a time on the
+    accept thread. Otherwise accepted requests are queued for a pool
+    of worker threads; when every worker is busy and queue_depth
+    requests are already waiting new connections are closed
+    immediately and counted as rejected. With queue_depth=0 requests
+    are only accepted while a worker is idle.
+
+    Args:
+    ip -- address to bind to
+    port -- port to bind to
+    handler_class -- BaseHandler subclass used for each request
+    recv_timeout -- deadline in seconds for BaseHandler.recvall
+    workers -- number of worker threads (0 for serial handling)
+    queue_depth -- maximum number of requests waiting for a worker
+    """
+    def __init__(self, ip, port, handler_class=BaseHandler, recv_timeout=RECV_TIMEOUT,
+                 workers=0, queue_depth=0):
         SocketServer.TCPServer.__init__(self, (ip, port), handler_class,
                                         bind_and_activate=False)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -89,31 +193,161 @@ class TCPServer(SocketServer.TCPServer):
         self.server_activate()
         self.client_address = None
         self.ip = ip
-        self.port = port
+        self.port = self.server_address[1]
+        self.recv_timeout = recv_timeout
+        self.workers = workers
+        self.stats = RequestStats()
+        self._requests = Queue() if workers else None
+        # one slot per request being handled or waiting for a worker
+        self._slots = Semaphore(workers+queue_depth)
+        self._worker_threads = []
         self.accept_thread = None
         self.shutdown_requested = Event()
 
     def start(self):
+        for ii in range(self.workers):
+            worker = Thread(target=self._worker,name="%s:%d worker %d"%(self.ip,self.port,ii))
+            worker.daemon = True
+            worker.start()
+            self._worker_threads.append(worker)
         self.accept_thread = Thread(target=self.serve_forever)
         self.accept_thread.daemon = True
         self.accept_thread.start()
         exit_funcs.register(self.shutdown)
+
+    def queue_size(self):
+        return self._requests.qsize() if self._requests is not None else 0
+
+    def _handle(self,request,client_address,queued_at):
+        start = time()
+        try:
+            self.finish_request(request,client_address)
+        except Exception:
+            self.handle_error(request,client_address)
+        finally:
+            self.shutdown_request(request)
+        self.stats.record(start-queued_at,time()-start)
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            try:
+                self._handle(*item)
+            finally:
+                self._slots.release()
+
+    def process_request(self,request,client_address):
+        if self._requests is None:
+            self._handle(request,client_address,time())
+            return
+        if not self._slots.acquire(False):
+            self.stats.record_rejected()
+            logger.warning("Request queue full on %s:%d, rejecting %s:%d"%(
+                    (self.ip,self.port)+tuple(client_address)))
+            self.shutdown_request(request)
+            return
+        self._requests.put((request,client_address,time()))
         
     def shutdown(self):
         SocketServer.TCPServer.shutdown(self)
         self.accept_thread.join()
+        for _ in self._worker_threads:
+            self._requests.put(None)
+        for worker in self._worker_threads:
+            worker.join()
+        self._worker_threads = []
         exit_funcs.deregister(self.shutdown)
 
 
 class TCPClient(BaseConnection):
-    def __init__(self,ip,port,timeout=2):
+    def __init__(self,ip,port,timeout=2,buffer_size=MAX_PACKET_SIZE):
         super(TCPClient,self).__init__(ip,port,socket.AF_INET,socket.SOCK_STREAM)
         self.sock.settimeout(timeout)
+        self._buffer_size = buffer_size
+        self._view = None
         self.connect()
 
     def send(self,msg):
         self.sock.send(msg)
 
+    def receive_into(self,buf,n=0):
+        """Receive directly into a writable buffer.
+
+        :param buf: bytearray or writable memoryview
+        :param n: maximum number of bytes (0 for the size of buf)
+        :return: number of bytes received
+        """
+        return self.sock.recv_into(buf,n)
+
+    def receive_view(self,n=None):
+        """Receive into the client's reusable buffer.
+
+        Notes: The returned memoryview is only valid until the next
+        call to receive_view or receive. At most buffer_size bytes are
+        read, whatever n is.
+
+        :param n: maximum number of bytes (default and limit buffer_size)
+        :return: memoryview of the received bytes
+        """
+        if self._view is None:
+            self._view = memoryview(bytearray(self._buffer_size))
+        if n is None or n > self._buffer_size:
+            n = self._buffer_size
+        nbytes = self.sock.recv_into(self._view,n)
+        return self._view[:nbytes]
+
+    def receive(self,n=MAX_PACKET_SIZE):
+        """Receive at most n bytes as a string.
+
+        Notes: Reads of up to buffer_size bytes go through the reusable
+        buffer; larger reads are made directly so that n is honoured.
+        """
+        if n > self._buffer_size:
+            return self.sock.recv(n)
+        return self.receive_view(n).tobytes()
+
+
+def is_multicast(ip):
+    return 224 <= int(ip.split(".")[0]) <= 239
+
+
+class UDPSender(BaseConnection):
+    def __init__(self,ip,port,ttl=1):
+        super(UDPSender,self).__init__(ip,port,socket.AF_INET,socket.SOCK_DGRAM)
+        if is_multicast(ip):
+            self.sock.setsockopt(socket.IPPROTO_IP,socket.IP_MULTICAST_TTL,ttl)
+
+    def send(self,msg):
+        self.sock.sendto(msg,(self.ip,self.port))
+
+
+class UDPReceiver(BaseConnection):
+    """Datagram receiver, joining the group if ip is a multicast address.
+
+    Args:
+    ip -- address (or multicast group) to receive on
+    port -- port to receive on
+    interface -- local interface address used to join a multicast group
+    timeout -- receive timeout in seconds
+    """
+    def __init__(self,ip,port,interface="0.0.0.0",timeout=2):
+        super(UDPReceiver,self).__init__(ip,port,socket.AF_INET,socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.sock.settimeout(timeout)
+        if is_multicast(ip):
+            try:
+                self.sock.bind(("",port))
+            except Exception as error:
+                raise SocketError(self,error)
+            membership = socket.inet_aton(ip) + socket.inet_aton(interface)
+            self.sock.setsockopt(socket.IPPROTO_IP,socket.IP_ADD_MEMBERSHIP,membership)
+        else:
+            self.bind()
+        # pick up the bound port when receiving on port 0
+        self.port = self.sock.getsockname()[1]
+
     def receive(self,n=MAX_PACKET_SIZE):
         return self.sock.recv(n)
 
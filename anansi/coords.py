@@ -91,6 +91,32 @@ def hadec_to_nsew(ha,dec,lat=lat,skew=skew,slope=slope):
     ns,ew = transform(ha,dec,R.T)
     return ns,ew
 
+def transform_array(a,b,R,inverse=True):
+    """Vectorised form of transform for arrays of angles."""
+    a = np.asarray(a,dtype="float64")
+    b = np.asarray(b,dtype="float64")
+    shape = np.broadcast(a,b).shape
+    a,b = np.broadcast_arrays(a,b)
+    cosb = np.cos(b).ravel()
+    P = np.vstack((cosb*np.cos(a).ravel(),cosb*np.sin(a).ravel(),np.sin(b).ravel()))
+    if inverse:
+        R = R.T
+    x,y,z = np.dot(R,P)
+    return np.arctan2(y,x).reshape(shape),np.arcsin(np.clip(z,-1.0,1.0)).reshape(shape)
+
+def hadec_to_nsew_array(ha,dec,lat=lat,skew=skew,slope=slope):
+    R = np.dot(nsew_to_azel_matrix(skew,slope),azel_to_hadec_matrix(lat))
+    return transform_array(ha,dec,R.T)
+
+def nsew_to_hadec_array(ns,ew,lat=lat,skew=skew,slope=slope):
+    R = np.dot(nsew_to_azel_matrix(skew,slope),azel_to_hadec_matrix(lat))
+    return transform_array(ns,ew,R)
+
+def hadec_to_azel_array(ha,dec,lat=lat):
+    """Geometric (unrefracted) azimuth and elevation, azimuth in [0,2pi)."""
+    az,el = transform_array(ha,dec,azel_to_hadec_matrix(lat),inverse=False)
+    return np.mod(az,2*np.pi),el
+
 def _catch_discontinuitues(ns,ew,tol=0.4):
     idxs = np.where(np.sqrt((ns[:-1] - ns[1:])**2 + (ew[:-1] - ew[1:])**2)>tol)
     for idx in idxs:
@@ -1,14 +1,109 @@
 import logging
 import inspect
+from bisect import bisect_left
 from functools import wraps,partial
 from threading import Lock, Thread
 from time import sleep
+from anansi.utils import monotonic
+
+# upper bounds (seconds) of the lock timing histogram bins, the last
+# bin collects everything slower
+LOCK_HISTOGRAM_BINS = [1e-5,1e-4,1e-3,1e-2,1e-1,1.0,10.0]
+
+
+class LockTiming(object):
+    """Count, total, maximum and histogram of a set of durations."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0]*(len(LOCK_HISTOGRAM_BINS)+1)
+
+    def record(self,duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max,duration)
+        self.histogram[bisect_left(LOCK_HISTOGRAM_BINS,duration)] += 1
+
+    def as_dict(self):
+        return {
+            "count":self.count,
+            "mean":self.total/self.count if self.count else 0.0,
+            "max":self.max,
+            "histogram":list(self.histogram)
+            }
+
+
+class LockStatistics(object):
+    """Wait and hold times for locks taken by the decorators below.
+
+    Notes: Recording is off by default and is switched on with
+    enable(). Timings are kept per lock and per method acquiring it;
+    locked_method locks are named by class and attribute, e.g.
+    "NSDriveInterface._lock".
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._timings = {}
+
+    def enable(self,enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}
+
+    def record(self,lock_name,method,wait,hold):
+        with self._lock:
+            key = (lock_name,method)
+            if key not in self._timings:
+                self._timings[key] = (LockTiming(),LockTiming())
+            wait_timing,hold_timing = self._timings[key]
+            wait_timing.record(wait)
+            hold_timing.record(hold)
+
+    def as_dict(self):
+        """Return {lock name:{method:{"wait":...,"hold":...}}}."""
+        with self._lock:
+            stats = {}
+            for (lock_name,method),(wait,hold) in self._timings.items():
+                stats.setdefault(lock_name,{})[method] = {
+                    "wait":wait.as_dict(),"hold":hold.as_dict()}
+            return stats
+
+    def dump(self):
+        """Return the statistics as a text table."""
+        lines = ["%-32s %-24s %8s %10s %10s %10s %10s"%(
+                "lock","method","count","wait mean","wait max","hold mean","hold max")]
+        for lock_name,methods in sorted(self.as_dict().items()):
+            for method,timing in sorted(methods.items()):
+                lines.append("%-32s %-24s %8d %10.6f %10.6f %10.6f %10.6f"%(
+                        lock_name,method,timing["wait"]["count"],
+                        timing["wait"]["mean"],timing["wait"]["max"],
+                        timing["hold"]["mean"],timing["hold"]["max"]))
+        return "\n".join(lines)
+
+lock_stats = LockStatistics()
+
+def _timed_call(lock,lock_name,func,args,kwargs):
+    start = monotonic()
+    lock.acquire()
+    acquired = monotonic()
+    try:
+        return func(*args,**kwargs)
+    finally:
+        lock.release()
+        lock_stats.record(lock_name,func.__name__,acquired-start,monotonic()-acquired)
 
 def locked_method(lock_name):
     def decorator(func):
         @wraps(func)
         def wrapped(self,*args,**kwargs):
             lock = self.__getattribute__(lock_name)
+            if lock_stats.enabled:
+                name = "%s.%s"%(type(self).__name__,lock_name)
+                return _timed_call(lock,name,func,(self,)+args,kwargs)
             lock.acquire()
             try:
                 return func(self,*args,**kwargs)
@@ -23,6 +118,8 @@ def serialised(func):
     serialised._lock = Lock()
     @wraps(func)
     def wrapped(*args,**kwargs):
+        if lock_stats.enabled:
+            return _timed_call(serialised._lock,"serialised",func,args,kwargs)
         serialised._lock.acquire()
         try:
             retval = func(*args,**kwargs)
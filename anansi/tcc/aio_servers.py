@@ -0,0 +1,52 @@
+import logging
+import trollius as asyncio
+from trollius import From
+from anansi.aio_comms import AsyncTCPServer
+from anansi.tcc.interface_server import TCCProtocol
+from anansi.tcc.status_server import StatusProtocol
+logger = logging.getLogger('anansi')
+
+
+class AsyncTCCServer(TCCProtocol,AsyncTCPServer):
+    def __init__(self,ip,port,controller,timeout=10.0,loop=None):
+        AsyncTCPServer.__init__(self,ip,port,timeout,loop)
+        TCCProtocol.__init__(self,controller)
+
+    @asyncio.coroutine
+    def handle(self,reader,writer):
+        yield From(AsyncTCPServer.handle(self,reader,writer))
+        if self.shutdown_requested.is_set():
+            self.loop.stop()
+
+
+class AsyncStatusServer(StatusProtocol,AsyncTCPServer):
+    request_expected = False
+
+    def __init__(self,ip,port,controller,timeout=10.0,loop=None):
+        AsyncTCPServer.__init__(self,ip,port,timeout,loop)
+        StatusProtocol.__init__(self,controller)
+
+
+def serve(controller,loop=None):
+    """Serve the TCC interface and status protocols from one event loop."""
+    from anansi.config import config
+    loop = loop if loop is not None else asyncio.get_event_loop()
+    tcc = config.tcc_server
+    status = config.status_server
+    servers = [AsyncTCCServer(tcc.ip,tcc.port,controller,tcc.timeout,loop),
+               AsyncStatusServer(status.ip,status.port,controller,status.timeout,loop)]
+    for server in servers:
+        loop.run_until_complete(server.start())
+    logger.info("Started event loop TCC servers")
+    try:
+        loop.run_forever()
+    finally:
+        for server in servers:
+            server.shutdown()
+
+if __name__ == "__main__":
+    from anansi.config import update_config_from_args
+    from anansi import args
+    from anansi.tcc.telescope_controller import TelescopeController
+    update_config_from_args(args.parse_anansi_args())
+    serve(TelescopeController())
@@ -0,0 +1,182 @@
+import json
+import logging
+from os import rename,makedirs
+from os.path import isabs,isfile,isdir,join,dirname,expanduser
+from threading import Lock,Timer
+import numpy as np
+from anansi import log
+logger = logging.getLogger('anansi')
+
+FAST = "fast"
+SLOW = "slow"
+SPEED_NAMES = [FAST,SLOW] # indexed by the eZ80 DRIVE_FAST/DRIVE_SLOW flags
+ARMS = ["east","west"]
+
+# minimum number of moving position samples needed to learn from a drive
+MIN_MOVING_SAMPLES = 4
+
+
+class DriveSpeedEstimator(object):
+    """Learned speed model for the arms of a single drive.
+
+    Notes: A slew of distance d at a given speed is modelled as taking
+    lag + d/rate seconds, where rate is the steady state speed of the
+    arm (radians/s) and lag absorbs the command latency and the
+    acceleration and deceleration of the motor. Both are exponential
+    moving averages of values measured from the drive's position
+    history after each completed drive, and are written to path (if
+    given) so that they persist between runs. Relative paths are taken
+    from the [state] path directory. Writes requested with
+    request_save are made from a timer thread at most once every
+    save_interval seconds, so drive threads never wait on the disk.
+
+    Args:
+    name -- drive name, used for logging
+    rates -- dict of default rates, {arm:{speed:rate}}
+    path -- JSON file the model is loaded from and saved to
+    smoothing -- weight given to each new measurement
+    save_interval -- minimum seconds between writes of the model
+    """
+    def __init__(self,name,rates,path=None,smoothing=0.2,save_interval=60.0):
+        self.name = name
+        self.smoothing = smoothing
+        self.save_interval = save_interval
+        self._lock = Lock()
+        self._dirty = False
+        self._timer = None
+        self.model = {}
+        for arm in ARMS:
+            self.model[arm] = {}
+            for speed in SPEED_NAMES:
+                self.model[arm][speed] = {"rate":rates[arm][speed],"lag":0.0,"samples":0}
+        if path and not isabs(path):
+            from anansi.config import config
+            path = join(expanduser(config.state.path),path)
+        self.path = path
+        if self.path and isfile(self.path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            for arm in ARMS:
+                for speed in SPEED_NAMES:
+                    self.model[arm][speed].update(stored[arm][speed])
+        except Exception:
+            logger.warning("Could not load %s drive speed model from %s"%(self.name,self.path),
+                           extra=log.tcc_status(),exc_info=True)
+
+    def save(self):
+        """Write the model to path.
+
+        Returns: True if the model was written
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            data = json.dumps(self.model,indent=2)
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        try:
+            if not isdir(dirname(self.path)):
+                makedirs(dirname(self.path))
+            with open(tmp,"w") as f:
+                f.write(data)
+            rename(tmp,self.path)
+        except (IOError,OSError):
+            logger.warning("Could not save %s drive speed model to %s"%(self.name,self.path),
+                           extra=log.tcc_status(),exc_info=True)
+            with self._lock:
+                self._dirty = True
+            return False
+        return True
+
+    def request_save(self):
+        """Save the model from a timer thread within save_interval seconds."""
+        if not self.path:
+            return
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = Timer(self.save_interval,self._save_pending)
+            self._timer.name = "%s speed model writer"%self.name
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _save_pending(self):
+        with self._lock:
+            self._timer = None
+        self.save()
+
+    def flush(self):
+        """Cancel any pending timed save and write unsaved changes now."""
+        with self._lock:
+            timer,self._timer = self._timer,None
+            dirty = self._dirty
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self.save()
+
+    def rate(self,arm,speed=FAST):
+        return self.model[arm][speed]["rate"]
+
+    def lag(self,arm,speed=FAST):
+        return self.model[arm][speed]["lag"]
+
+    def slew_time(self,arm,distance,speed=FAST):
+        """Predicted seconds for an arm to move distance radians."""
+        if distance <= 0:
+            return 0.0
+        return self.lag(arm,speed) + distance/self.rate(arm,speed)
+
+    def observe(self,arm,speed,started,records):
+        """Update the model from the positions recorded during a drive.
+
+        Args:
+        arm -- "east" or "west"
+        speed -- FAST or SLOW
+        started -- monotonic time the drive command was sent
+        records -- PositionHistory records covering the drive
+
+        Notes: The records must start before the arm began moving. A
+        history that has been truncated mid-drive would give too short
+        a distance for the elapsed time, so it is ignored.
+
+        Returns: True if the drive contained enough motion to learn from
+        """
+        times = records.time
+        tilts = records["%s_tilt"%arm]
+        moving = np.nonzero(np.diff(records["%s_count"%arm]))[0]
+        if len(moving) < MIN_MOVING_SAMPLES:
+            return False
+        if moving[0] == 0:
+            # no stationary sample before the motion: the history buffer
+            # wrapped during the drive, so the distance covered is unknown
+            logger.warning("%s drive %s arm history does not cover the start of the drive, "
+                           "not learning from it"%(self.name,arm),extra=log.tcc_status())
+            return False
+        first,last = moving[0],moving[-1]+1
+        distance = abs(tilts[last]-tilts[0])
+        duration = times[last]-started
+        # steady state speed from the second half of the motion, after acceleration
+        steady = slice((first+last)//2,last+1)
+        t = times[steady] - times[steady].mean()
+        y = tilts[steady]
+        if len(t) < 2 or (t*t).sum() == 0:
+            return False
+        rate = abs((t*(y-y.mean())).sum()/(t*t).sum())
+        if rate == 0:
+            return False
+        lag = max(duration - distance/rate,0.0)
+        with self._lock:
+            entry = self.model[arm][speed]
+            weight = 1.0 if entry["samples"] == 0 else self.smoothing
+            entry["rate"] += weight*(rate-entry["rate"])
+            entry["lag"] += weight*(lag-entry["lag"])
+            entry["samples"] += 1
+        logger.info("%s drive %s arm %s speed: measured %.6f rad/s, lag %.1f s"%(
+                self.name,arm,speed,rate,lag),extra=log.tcc_status())
+        return True
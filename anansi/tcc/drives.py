@@ -1,14 +1,21 @@
 from copy import copy
-from threading import Thread,Event,Lock
+from collections import deque
+from select import select
+import socket
+from threading import Thread,Event,Lock,Condition,current_thread
 from time import sleep
 from struct import pack,unpack
 from anansi import codec
-from numpy import sin,arcsin
-from anansi.comms import TCPClient
+import numpy as np
+from anansi.comms import TCPClient,SocketError
 from anansi import exit_funcs
 from anansi.config import config
 from anansi import log
 from anansi.decorators import locked_method
+from anansi.utils import monotonic
+from anansi.tcc.position_history import PositionHistory
+from anansi.tcc.drive_speeds import DriveSpeedEstimator,SPEED_NAMES
+from anansi.tcc.position_log import PositionLogPolicy,position_log_policy
 import logging
 logger = logging.getLogger('anansi')
 
@@ -21,12 +28,25 @@ DRIVE_NORTH = 0
 DRIVE_SOUTH = 1
 
 EZ80_SOCKET_COUNT_LIMIT = 18
+EZ80_SOCKET_COUNT_WARNING = 15
+
+# bytes requested per read from an eZ80 socket
+RECV_CHUNK_SIZE = 4096
 
 # eZ80 arm codes
 BOTH_ARMS = "1"
 EAST_ARM = "2"
 WEST_ARM = "3"
 
+# Drive events published to subscribers
+POSITION_EVENT = "position" # new "U" frame, value is the status dictionary
+REACHED_EVENT = "reached"   # "I" 13/14, value is the code
+ERROR_EVENT = "error"       # drive entered an error state, value is the error
+FINISHED_EVENT = "finished" # drive thread exited, value is None
+
+POSITION_LOG_MSG = ("Received %s drive position update    east: %-8.5g "
+                    "(%d)   west: %-8.5g (%d)")
+
 # Drive States
 # Drives support three states for each arm: auto, slow and disabled
 AUTO = "auto"
@@ -79,6 +99,12 @@ class eZ80Interruption(Exception):
         msg = "Exception E:0 caught from %s drive"%(drive_obj.name)
         super(eZ80Interruption,self).__init__(msg)
 
+class DriveThreadAlive(Exception):
+    def __init__(self,drive_obj):
+        message = "%s drive thread still running after interrupt, command refused"%(drive_obj.name)
+        super(DriveThreadAlive,self).__init__(message)
+        logger.error(message,extra=log.tcc_status())
+
 class eZ80SocketCountError(Exception):
     def __init__(self,count,drive_obj):
         message = "%s drive socket count (%d) exceeds maximum (%d)"%(drive_obj.name,count,EZ80_SOCKET_COUNT_LIMIT)
@@ -86,6 +112,24 @@ class eZ80SocketCountError(Exception):
         logger.error(message,extra=log.tcc_status())
 
 
+class TiltLimitError(Exception):
+    """Exception for tilts that convert to counts outside the drive limits.
+
+    Args:
+    arm -- "east" or "west"
+    index -- position of the first offending value in the request
+    count -- the offending count
+    drive_obj -- the drive the conversion was made for
+    """
+    def __init__(self,arm,index,count,drive_obj):
+        message = "%s drive %s arm count %d (element %d) outside limits [%d,%d]"%(
+            drive_obj.name,arm,count,index,drive_obj.min_count,drive_obj.max_count)
+        super(TiltLimitError,self).__init__(message)
+        self.arm = arm
+        self.index = index
+        self.count = count
+
+
 class CountError(Exception):
     """Exception for when number of counts is invalid
 
@@ -107,9 +151,12 @@ class DriveClient(object):
         self._port = port
         self._timeout = timeout
         self._drive_name = name
-        decoder,size = codec.gen_header_decoder(self._node)
-        self._header_decoder = decoder
-        self._header_size = size
+        self._codec = codec.FrameCodec(self._node)
+        self._header_size = self._codec.header_size
+        self._buffer = codec.FrameBuffer(self._codec,RECV_CHUNK_SIZE)
+        self._frames = deque()
+        self.reused = False
+        self.frames_received = 0
         self._open_client()
         
     @classmethod
@@ -136,10 +183,8 @@ class DriveClient(object):
             self._client = None
             
     def send(self,code,data=None):
-        header,msg = codec.simple_encoder(self._node,code,data)
-        self._client.send(header)
-        if len(msg)>0:
-            self._client.send(msg)
+        header,msg = self._codec.encode(code,data)
+        self._client.send(header+msg)
         if data:
             data_repr = unpack("B"*len(data),data)
             msg = "Sent %s drive %s command with data: %s"%(self._drive_name,code,data_repr)
@@ -147,32 +192,187 @@ class DriveClient(object):
             msg = "Sent %s drive %s command with no data"%(self._drive_name,code)
         logger.debug(msg,extra=log.eZ80_command(code,data,self._drive_name))
     
-    def receive(self):
+    def flush(self):
+        """Discard any unread data on the session.
+
+        Returns: False if the eZ80 has closed the session, else True
+        """
+        self._frames.clear()
+        self._buffer.clear()
+        if self._client is None:
+            return False
+        sock = self._client.sock
         try:
-            response = self._client.receive(self._header_size)
-        except Exception as error:
-            raise error
-        header = codec.simple_decoder(response,self._header_decoder)
-        data_size = header["HOB"]*256+header["LOB"]
-        if data_size > 0:
-            data = self._client.receive(data_size)
-            data_repr = unpack("B"*len(data),data)
-        else:
-            data = None
-        return header,data
+            while select([sock],[],[],0)[0]:
+                if not sock.recv(RECV_CHUNK_SIZE):
+                    return False
+        except Exception:
+            return False
+        return True
+
+    def cancel(self):
+        """Unblock a receive in progress on another thread.
+
+        Notes: The socket is shut down, so the blocked receive returns
+        immediately with a SocketError. The session cannot be reused.
+        """
+        client = self._client
+        if client is not None and client.sock is not None:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+    def pending(self):
+        """Number of complete frames already received but not returned."""
+        return len(self._frames)
+
+    def receive(self):
+        """Return the next (header,data) frame from the eZ80.
+
+        Notes: Reads are made in large chunks and may contain several
+        frames or a partial frame. Surplus frames are queued for
+        subsequent calls and partial frames are completed by later reads.
+        """
+        while not self._frames:
+            nbytes = self._client.receive_into(self._buffer.writable(RECV_CHUNK_SIZE))
+            if not nbytes:
+                raise SocketError(self._client,"Connection closed by %s drive"%self._drive_name)
+            self._buffer.commit(nbytes)
+            self._frames.extend(self._buffer.frames())
+        self.frames_received += 1
+        return self._frames.popleft()
     
 
+class DriveConnectionPool(object):
+    """Persistent sessions to the eZ80 of a single drive.
+
+    Notes: Sessions are returned to the pool after each completed
+    exchange and reused by the next command, so that commands do not
+    each pay for a new TCP connection and push the eZ80 towards
+    EZ80_SOCKET_COUNT_LIMIT. The socket count reported by the eZ80
+    through "C" messages is kept in reported_socket_count and new
+    sessions are only throttled when that count is high. open_count
+    is the number of sessions currently open on this side.
+
+    An idle session may have been closed by the eZ80 without the FIN
+    having arrived by the time it is reused, so callers should retry
+    a command once on a fresh session if a reused session fails before
+    any reply (see DriveInterface._stale_session).
+
+    Args:
+    drive -- the DriveInterface the sessions belong to
+    max_idle -- maximum number of idle sessions kept open
+    """
+    def __init__(self,drive,max_idle=1):
+        self._drive = drive
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = Lock()
+        self.open_count = 0
+        self.reported_socket_count = 0
+
+    def acquire(self,fresh=False):
+        """Return an open session, reusing an idle one unless fresh is set."""
+        with self._lock:
+            while self._idle and not fresh:
+                client = self._idle.pop()
+                if client.flush():
+                    client.reused = True
+                    client.frames_received = 0
+                    return client
+                logger.debug("Dropping closed %s drive session"%self._drive.name,
+                             extra=log.tcc_status())
+                self._close(client)
+        if self.reported_socket_count >= EZ80_SOCKET_COUNT_WARNING:
+            logger.warning("Approaching socket count limit on %s drive: having a wee rest"%(
+                    self._drive.name),extra=log.tcc_status())
+            sleep(0.3)
+        client = DriveClient.from_interface(self._drive)
+        with self._lock:
+            self.open_count += 1
+        return client
+
+    def release(self,client):
+        """Return a session to the pool after a completed exchange."""
+        with self._lock:
+            if len(self._idle) < self._max_idle and not client.pending():
+                self._idle.append(client)
+                return
+        self.discard(client)
+
+    def discard(self,client):
+        """Close a session that is broken or no longer required."""
+        with self._lock:
+            self._close(client)
+
+    def _close(self,client):
+        client.close()
+        self.open_count -= 1
+
+    def update_socket_count(self,count):
+        """Record the socket count reported by the eZ80 in a "C" message."""
+        self.reported_socket_count = count
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.pop())
+
+
+class DrivePoller(Thread):
+    """Refresh the cached status of an idle drive at a fixed rate.
+
+    Notes: While a drive thread is active the eZ80 streams position
+    updates itself, so polls are only sent when the drive is idle.
+    A failed poll is only logged; the drive error state is set once
+    max_failures polls in a row have failed, so a single dropped
+    status request does not end the current track.
+
+    Args:
+    drive -- the DriveInterface to poll
+    interval -- seconds between polls
+    max_failures -- consecutive failures before the drive error is set
+    """
+    def __init__(self,drive,interval,max_failures=3):
+        Thread.__init__(self)
+        self.name = "%s drive poller"%drive.name
+        self.daemon = True
+        self.drive = drive
+        self.interval = interval
+        self.max_failures = max_failures
+        self.failures = 0
+        self._shutdown = Event()
+
+    def shutdown(self):
+        self._shutdown.set()
+
+    def run(self):
+        while not self._shutdown.wait(self.interval):
+            if self.drive.active():
+                continue
+            try:
+                self.drive.get_status(max_age=self.interval,report_error=False)
+            except Exception as error:
+                self.failures += 1
+                logger.warning("Status poll of %s drive failed (%d in a row): %s"%(
+                        self.drive.name,self.failures,error),extra=log.tcc_status())
+                if self.failures == self.max_failures:
+                    logger.error("%s drive has not answered %d status polls"%(
+                            self.drive.name,self.failures),extra=log.tcc_status())
+                    self.drive._set_error(error)
+            else:
+                self.failures = 0
+
+
 class DriveInterface(object):
-    _data_decoder = [
-        ("east_status" ,lambda x: unpack("B",x)[0],1),
-        ("east_count"   ,lambda x: codec.it_unpack(x),3),
-        ("west_status" ,lambda x: unpack("B",x)[0],1),
-        ("west_count"   ,lambda x: codec.it_unpack(x),3)]
     def __init__(self,
                  node,ip,port,
                  west_scaling,east_scaling,tilt_zero,
                  minimum_count_limit,slow_drive_limit,
-                 name,timeout=5.0):
+                 name,timeout=5.0,max_idle_sessions=1,status_max_age=None,
+                 history_size=4096,min_count=0,max_count=(1<<24)-1,
+                 interrupt_grace=0.5,interrupt_timeout=2.0):
         self._node = node
         self._ip = ip
         self._port = port
@@ -183,12 +383,19 @@ class DriveInterface(object):
         self._slow_drive_limit = slow_drive_limit
         self.name = name
         self.timeout = timeout
+        self.min_count = min_count
+        self.max_count = max_count
         self._west_state = AUTO
         self._east_state = AUTO
         self.west_offset = 0.0
         self.east_offset = 0.0
         self.error_state = None
         self._active_drive = None
+        self._active_client = None
+        self.interrupt_grace = interrupt_grace
+        self.interrupt_timeout = interrupt_timeout
+        self.interrupt_latency = None
+        self.interrupt_latencies = deque(maxlen=100)
         self._active = Event()
         self._east_active = Event()
         self._west_active = Event()
@@ -196,6 +403,16 @@ class DriveInterface(object):
         self._lock = Lock()
         self._drive_thread_lock = Lock()
         self.status_dict = copy(DEFAULT_STATUS_DICT)
+        self.status_time = None
+        self.status_max_age = status_max_age
+        self.history = PositionHistory(history_size)
+        self.position_log = PositionLogPolicy()
+        self.position_trace = False
+        self.speeds = None
+        self._poller = None
+        self.connections = DriveConnectionPool(self,max_idle_sessions)
+        self._subscribers = []
+        self._events = Condition()
         self.exit_funcs = exit_funcs
         self.exit_funcs.register(self.clean_up)
 
@@ -205,8 +422,70 @@ class DriveInterface(object):
     def clear_error(self):
         self.error_state = None
 
+    def _set_error(self,error):
+        self.error_state = error
+        self._publish(ERROR_EVENT,error)
+
+    def subscribe(self,callback):
+        """Call callback(drive,event,value) on every drive event.
+
+        Notes: Callbacks run on the thread that received the event,
+        possibly while the drive lock is held, so they must return
+        quickly and must not call back into locked drive methods.
+        """
+        with self._events:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self,callback):
+        with self._events:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _publish(self,event,value=None):
+        with self._events:
+            subscribers = list(self._subscribers)
+            self._events.notify_all()
+        for callback in subscribers:
+            try:
+                callback(self,event,value)
+            except Exception:
+                logger.error("Exception in %s drive %s event subscriber"%(self.name,event),
+                             extra=log.tcc_status(),exc_info=True)
+
+    def wake(self):
+        """Wake all wait_for callers so that they re-check their predicates."""
+        with self._events:
+            self._events.notify_all()
+
+    def wait_for(self,predicate,timeout=None):
+        """Block until predicate(drive) is true or timeout seconds pass.
+
+        Notes: The predicate is re-evaluated on every published drive
+        event (position update, arm reached, error, drive finished) and
+        on calls to wake().
+
+        Returns: the final value of the predicate
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._events:
+            result = predicate(self)
+            while not result:
+                if deadline is None:
+                    self._events.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._events.wait(remaining)
+                result = predicate(self)
+        return result
+
     def clean_up(self):
+        self.stop_polling()
+        if self.speeds is not None:
+            self.speeds.flush()
         self.stop()
+        self.connections.close_all()
         self.exit_funcs.deregister(self.clean_up)
 
     def _check_state(self,state):
@@ -231,15 +510,78 @@ class DriveInterface(object):
         self._check_state(state)
         self._west_state = state
         
-    def new_client(self):
-        client = DriveClient.from_interface(self)
-        return client
+    def start_polling(self,interval,max_failures=3):
+        """Keep status_dict refreshed by a background poller."""
+        self.stop_polling()
+        self._poller = DrivePoller(self,interval,max_failures)
+        self._poller.start()
+
+    def stop_polling(self):
+        if self._poller is not None:
+            self._poller.shutdown()
+            self._poller = None
+
+    def status_age(self):
+        """Seconds since the last position update, or None if never updated."""
+        if self.status_time is None:
+            return None
+        return monotonic() - self.status_time
+
+    def new_client(self,fresh=False):
+        return self.connections.acquire(fresh)
+
+    def _stale_session(self,client,error):
+        """True if a reused session failed before any reply, i.e. the eZ80
+        had already closed it and the command can be retried."""
+        if (client.reused and client.frames_received == 0 and
+            isinstance(error,(SocketError,socket.error)) and
+            not isinstance(error,socket.timeout)):
+            logger.warning("Pooled %s drive session was closed by the eZ80, retrying on a new session"%(
+                    self.name),extra=log.tcc_status())
+            return True
+        return False
             
-    def interrupt(self):
+    def interrupt(self,timeout=None):
+        """Stop the active drive thread, waiting at most timeout seconds.
+
+        Notes: The drive thread is first given interrupt_grace seconds
+        to read the "E" 0 that the eZ80 sends when a drive is stopped
+        or replaced. If it is still blocked after that, its session is
+        shut down to cancel the read. The time taken is recorded in
+        interrupt_latency and interrupt_latencies.
+
+        Args:
+        timeout -- overall bound in seconds (defaults to interrupt_timeout)
+
+        Returns: True if the drive thread has exited
+        """
+        if timeout is None:
+            timeout = self.interrupt_timeout
+        drive_thread = self._active_drive
+        if drive_thread is None:
+            self._interrupt.clear()
+            return True
+        start = monotonic()
         self._interrupt.set()
-        if self._active_drive:
-            self._active_drive.join()
-        self._interrupt.clear()
+        try:
+            drive_thread.join(min(self.interrupt_grace,timeout))
+            if drive_thread.is_alive():
+                logger.debug("Cancelling %s drive thread read"%self.name,extra=log.tcc_status())
+                client = self._active_client
+                if client is not None:
+                    client.cancel()
+                drive_thread.join(max(timeout-(monotonic()-start),0))
+        finally:
+            self._interrupt.clear()
+        self.interrupt_latency = monotonic()-start
+        self.interrupt_latencies.append(self.interrupt_latency)
+        if drive_thread.is_alive():
+            logger.warning("%s drive thread still running %.2f s after interrupt"%(
+                    self.name,self.interrupt_latency),extra=log.tcc_status())
+            return False
+        logger.debug("Interrupted %s drive thread in %.3f s"%(self.name,self.interrupt_latency),
+                     extra=log.tcc_status())
+        return True
 
     def active(self):
         return self.east_active() or self.west_active()
@@ -250,8 +592,42 @@ class DriveInterface(object):
     def west_active(self):
         return self._west_active.is_set()
 
+    def _speed_estimator(self,dc,east_rate,west_rate):
+        rates = {
+            "east":{"fast":east_rate,"slow":east_rate*dc.slow_factor},
+            "west":{"fast":west_rate,"slow":west_rate*dc.slow_factor}}
+        return DriveSpeedEstimator(self.name,rates,dc.speed_file,dc.speed_smoothing,
+                                   config.state.save_interval)
+
+    def _observe_drive(self,started,speeds):
+        """Feed the positions recorded during a completed drive to the speed model."""
+        if self.speeds is None:
+            return
+        finished = monotonic()
+        records = self.history.window(finished-started,now=finished)
+        learned = False
+        for arm,speed in zip(["east","west"],speeds):
+            if speed is not None:
+                learned |= self.speeds.observe(arm,SPEED_NAMES[speed],started,records)
+        if learned:
+            self.speeds.request_save()
+
+    def slew_time(self,distance):
+        """Predicted seconds for all enabled arms to move distance radians."""
+        if self.speeds is None:
+            raise Exception("No speed model for %s drive"%self.name)
+        times = [0.0]
+        for arm,scaling in [("east",self._east_scaling),("west",self._west_scaling)]:
+            state = getattr(self,"%s_state"%arm)
+            if state == DISABLED:
+                continue
+            slow = state == SLOW or abs(distance)*scaling <= self._slow_drive_limit
+            speed = SPEED_NAMES[DRIVE_SLOW if slow else DRIVE_FAST]
+            times.append(self.speeds.slew_time(arm,abs(distance),speed))
+        return max(times)
+
     @locked_method("_drive_thread_lock")
-    def _drive_thread(self,client):
+    def _drive_thread(self,client,started=None,speeds=(None,None)):
         """A thread to handle the eZ80 status loop while driving.                                  
                                                                                                    
         Notes: Method is intended to be run as a thread. By setting                                
@@ -268,7 +644,13 @@ class DriveInterface(object):
         count_limit = 10
         try:
             while True:
-                header,data = client.receive()
+                try:
+                    header,data = client.receive()
+                except Exception:
+                    if self._interrupt.is_set():
+                        logger.debug("Drive thread read cancelled by interrupt.",extra=log.tcc_status())
+                        break
+                    raise
                 try:
                     code,response = self.parse(header,data)
                 except eZ80Interruption as error:
@@ -328,56 +710,94 @@ class DriveInterface(object):
                         elif west_crocked and not west_moved:
                             msg = "West arm failed to start driving NS drive"
                         logger.error(msg,extra=log.tcc_status())
-                        self.error_state = msg  ## this is important as it is used by the tracking thread
+                        self._set_error(msg)  ## this is important as it is used by the tracking thread
 
                     if east_crocked or west_crocked:
                         Thread(target=self.stop).start()
         except Exception as error:
             logger.error("Caught exception in %s drive thread loop"%self.name,
                          extra=log.tcc_status(),exc_info=True)
+            self.connections.discard(client)
             raise error
         else:
             logger.debug("Cleanly exiting drive thread.",extra=log.tcc_status())
+            if self._interrupt.is_set():
+                self.connections.discard(client)
+            else:
+                self.connections.release(client)
+                if started is not None and not self.has_error():
+                    self._observe_drive(started,speeds)
         finally:
-            client.close()
-            self._active.clear()
-            self._east_active.clear()
-            self._west_active.clear()
-            self._active_drive = None
+            # a thread left behind by a failed interrupt must not clear
+            # the state of the drive that replaced it
+            if self._active_drive is current_thread():
+                self._active.clear()
+                self._east_active.clear()
+                self._west_active.clear()
+                self._active_drive = None
+                self._active_client = None
+                self._publish(FINISHED_EVENT)
 
     @locked_method("_lock")
-    def _drive(self,drive_code,data):
+    def _drive(self,drive_code,data,speeds=(None,None)):
         """Send a drive command to the eZ80.                                                       
                                                                                                    
         Notes: This is first kill any active drive thread before                                   
         sending on a new command. Need to determine if any active                                  
         client should first be killed or not. This will spawn a drive                              
         thread to handle the drive loop of the eZ80.                                               
+
+        Args:
+        drive_code -- eZ80 arm code
+        data -- encoded counts and directions/speeds
+        speeds -- (east,west) DRIVE_FAST/DRIVE_SLOW flags, None for arms not driven
         """
         self.clear_error()
-        client = self.new_client()
         self._active.set()
-        client.send(drive_code,data)
-        self.interrupt()
-        while True:
+        started = monotonic()
+        for attempt in range(2):
+            client = self.new_client(fresh=attempt > 0)
             try:
-                header,data = client.receive()
-                code,response = self.parse(header,data)
-                if (code == "S") and (response == 0):
-                    self._active_drive = Thread(target=self._drive_thread,
-                                                args=(client,),name="%s drive thread"%self.name)
-                    self._active_drive.daemon = True
-                    self._active_drive.start()
-                    break
+                # flag the interruption before sending, the eZ80 may answer the
+                # running drive thread with "E" 0 before interrupt() is reached
+                self._interrupt.set()
+                try:
+                    client.send(drive_code,data)
+                except Exception:
+                    # interrupt() was never reached to clear the flag
+                    self._interrupt.clear()
+                    raise
+                if not self.interrupt():
+                    raise DriveThreadAlive(self)
+                # the interrupted thread cleared the active flags as it exited
+                self._active.set()
+                if speeds[0] is not None:
+                    self._east_active.set()
+                if speeds[1] is not None:
+                    self._west_active.set()
+                while True:
+                    header,response_data = client.receive()
+                    code,response = self.parse(header,response_data)
+                    if (code == "S") and (response == 0):
+                        break
             except Exception as error:
+                self.connections.discard(client)
+                if attempt == 0 and self._stale_session(client,error):
+                    continue
                 logger.error("Caught exception in %s drive preparation: %s"%(self.name,str(error)),
                              extra=log.tcc_status(),exc_info=True)
-                self.error_state = error
                 self._active.clear()
                 self._east_active.clear()
                 self._west_active.clear()
-                client.close()
+                self._set_error(error)
                 raise error
+            self._active_client = client
+            self._active_drive = Thread(target=self._drive_thread,
+                                        args=(client,started,speeds),
+                                        name="%s drive thread"%self.name)
+            self._active_drive.daemon = True
+            self._active_drive.start()
+            return
             
     def parse(self,header,data):
         """Parse a message returned from the eZ80.                                                 
@@ -403,69 +823,128 @@ class DriveInterface(object):
 
         code = header["Command option"]
         if code in ["E","I","W","V","S","C"]:
-            decoded_response = unpack("B",data)[0]
+            decoded_response = codec.decode_status(data)
             logger.info("Received code %s:%d from %s drive"%(code,decoded_response,self.name),
                         extra=log.eZ80_status(self.name,code,decoded_response))
         elif code == "U":
-            decoded_response = codec.simple_decoder(data,self._data_decoder)
+            decoded_response = codec.decode_position(data)
             decoded_response = self._calculate_tilts(decoded_response)
-            _old = self.status_dict.copy()
             self.status_dict.update(decoded_response)
-            msg = ("Received {name} drive position update    east: {east_tilt: <8.5} "
-                   "({east_count})   west: {west_tilt: <8.5} ({west_count})"
-                   ).format(name=self.name,**self.status_dict)
-            if not self.status_dict == _old:
-                logger.info(msg,extra=log.eZ80_position(self.name,self.status_dict))
-            else:
-                logger.info(msg)
+            self.status_time = monotonic()
+            self.history.append(self.status_time,self.status_dict)
+            self._log_position()
+            self._publish(POSITION_EVENT,self.status_dict)
         else:
             error = Exception("Unrecognized command option '%s' (ascii byte) received from %s drive"%(
                     unpack("B",code),self.name))
-            self.error_state = error
+            self._set_error(error)
             raise error
         if code == "E":
             if decoded_response == 0:
                 raise eZ80Interruption(self)
             error = eZ80Error(decoded_response,self)
-            self.error_state = error
+            self._set_error(error)
             raise error
-        if (code == "C") and (decoded_response > EZ80_SOCKET_COUNT_LIMIT):
-            error = eZ80SocketCountError(decoded_response,self)
-            self.error_state = error
-            raise error
-        if (code == "C") and (decoded_response >= 15):
-            logger.warning("Approaching socket count limit on %s drive: having a wee rest"%(
-                    self.name),extra=log.tcc_status())
-            sleep(0.3)            
+        if code == "I" and decoded_response in (13,14):
+            self._publish(REACHED_EVENT,decoded_response)
+        if code == "C":
+            self.connections.update_socket_count(decoded_response)
+            if decoded_response > EZ80_SOCKET_COUNT_LIMIT:
+                error = eZ80SocketCountError(decoded_response,self)
+                self._set_error(error)
+                raise error
         return code,decoded_response
 
-    @locked_method("_lock")
-    def get_status(self):
+    def _log_position(self):
+        """Log the current position as selected by the position_log policy.
+
+        Notes: Selected records go to the database through the
+        eZ80_position extra. Other frames produce no log record at all
+        unless position_trace (position_log_trace in the drive config)
+        is set, in which case they are logged at debug level.
+        """
+        records = self.position_log.select(self.status_time,self.status_dict)
+        for record in records:
+            logger.info(POSITION_LOG_MSG,self.name,record["east_tilt"],record["east_count"],
+                        record["west_tilt"],record["west_count"],
+                        extra=log.eZ80_position(self.name,record))
+        if not records and self.position_trace:
+            status = self.status_dict
+            logger.debug(POSITION_LOG_MSG,self.name,status["east_tilt"],status["east_count"],
+                         status["west_tilt"],status["west_count"])
+
+    def _request(self,code,data=None,expect=None,interrupt=False):
+        """Send a command on a pooled session and read until acknowledged.
+
+        Args:
+        code -- eZ80 command code
+        data -- command data
+        expect -- response code that must be received before the "S"
+        interrupt -- interrupt any active drive thread after sending
+        """
+        for attempt in range(2):
+            client = self.connections.acquire(fresh=attempt > 0)
+            try:
+                if interrupt:
+                    self._interrupt.set()
+                try:
+                    client.send(code,data)
+                except Exception:
+                    # interrupt() was never reached to clear the flag
+                    self._interrupt.clear()
+                    raise
+                if interrupt and not self.interrupt():
+                    raise DriveThreadAlive(self)
+                seen = expect is None
+                while True:
+                    header,response_data = client.receive()
+                    response_code,_ = self.parse(header,response_data)
+                    if response_code == expect:
+                        seen = True
+                    elif response_code == "S" and seen:
+                        break
+            except Exception as error:
+                self.connections.discard(client)
+                if attempt == 0 and self._stale_session(client,error):
+                    continue
+                raise error
+            else:
+                self.connections.release(client)
+                return
+
+    def get_status(self,max_age=None,report_error=True):
         """Get status dictionary for NS drive.                                                     
                                                                                                    
         Notes: If telescope is on an active drive this will not send                               
         a new request, instead returning the current status dictionary.                            
+        If max_age is given and the cached status is no older than
+        max_age seconds, it is returned without taking the drive lock.
+        A failed request sets the drive error state unless report_error
+        is False.
                                                                                                    
         Returns: Status dictionary                                                                 
         """
+        if max_age is not None:
+            age = self.status_age()
+            if age is not None and age <= max_age:
+                return self.status_dict
+        return self._refresh_status(max_age,report_error)
+
+    @locked_method("_lock")
+    def _refresh_status(self,max_age=None,report_error=True):
+        # another caller may have refreshed the status while we waited on the lock
+        if max_age is not None:
+            age = self.status_age()
+            if age is not None and age <= max_age:
+                return self.status_dict
         if not self.active():
-            client = self.new_client()
             try:
-                client.send("U",None)
-                self.interrupt()
-                code = None
-                while code != "U":
-                    header,data = client.receive()
-                    code,response = self.parse(header,data)
-                while code != "S":
-                    header,data = client.receive()
-                    code,_ = self.parse(header,data)
+                self._request("U",None,expect="U",interrupt=True)
             except Exception as error:
-                logger.error("Could not retreive drive status",extra=log.tcc_status(),exc_info=True)
-                self.error_state = error
+                if report_error:
+                    logger.error("Could not retreive drive status",extra=log.tcc_status(),exc_info=True)
+                    self._set_error(error)
                 raise error
-            finally:
-                client.close()
         return self.status_dict
 
     @locked_method("_lock")
@@ -474,14 +953,7 @@ class DriveInterface(object):
                                                                                                    
         Notes: This will first kill any active drive thread before sending.                        
         """
-        client = self.new_client()
-        client.send("0",None)
-        self.interrupt()
-        code = None
-        while code != "S":
-            header,data = client.receive()
-            code,_ = self.parse(header,data)
-        client.close()
+        self._request("0",None,interrupt=True)
         
     @locked_method("_lock")
     def set_verbose(self,verbose=True):
@@ -489,13 +961,7 @@ class DriveInterface(object):
 
         Notes: 1 = verbose, 0 = quiet
         """
-        client = self.new_client()
-        client.send("V",pack("B",1 if verbose else 0))
-        code = None
-        while code != "S":
-            header,data = client.receive()
-            code,_ = self.parse(header,data)
-        client.close()
+        self._request("V",pack("B",1 if verbose else 0))
 
     def _prepare(self,east_counts=None,west_counts=None):
         """Prepare values for drive message.                                                       
@@ -512,7 +978,7 @@ class DriveInterface(object):
         Returns: (east arm direction, west arm direction,                                          
                   east arm speed, west arm speed)                                                  
         """
-        status = self.get_status()
+        status = self.get_status(self.status_max_age)
         if east_counts is not None:
             east_offset = east_counts - status["east_count"]
             east_dir = self._get_direction(east_offset)
@@ -540,18 +1006,87 @@ class DriveInterface(object):
             west_speed = None
         return east_dir,west_dir,east_speed,west_speed
 
+    # Encoder counts are linear in _tilt_to_axis(tilt). Drives with a
+    # non-linear encoder geometry override these two hooks, which must
+    # accept both scalars and numpy arrays.
+    def _tilt_to_axis(self,tilt):
+        return tilt
+
+    def _axis_to_tilt(self,axis):
+        return axis
+
     def tilts_to_counts(self,east_tilt,west_tilt):
-        """Convert tilts in radians to encoder counts."""
-        east_counts = int(self._tilt_zero + self._east_scaling * (east_tilt+self.east_offset))
-        west_counts = int(self._tilt_zero + self._west_scaling * (west_tilt+self.west_offset))
+        """Convert tilts in radians to encoder counts.
+
+        Notes: Counts are truncated towards zero, as for
+        tilts_to_counts_array.
+        """
+        east_counts = int(self._tilt_zero + self._east_scaling * self._tilt_to_axis(east_tilt+self.east_offset))
+        west_counts = int(self._tilt_zero + self._west_scaling * self._tilt_to_axis(west_tilt+self.west_offset))
         return east_counts,west_counts
   
     def counts_to_tilts(self,east_counts,west_counts):
         """Convert encoder counts to tilts in radians."""
-        east_tilt = ((east_counts-self._tilt_zero)/self._east_scaling) - self.east_offset
-        west_tilt = ((west_counts-self._tilt_zero)/self._west_scaling) - self.west_offset
+        east_tilt = self._axis_to_tilt((east_counts-self._tilt_zero)/self._east_scaling) - self.east_offset
+        west_tilt = self._axis_to_tilt((west_counts-self._tilt_zero)/self._west_scaling) - self.west_offset
         return east_tilt,west_tilt
 
+    def tilts_to_counts_array(self,east_tilts,west_tilts,check_limits=True):
+        """Convert arrays of tilts in radians to encoder counts.
+
+        Notes: Counts are truncated towards zero, so each element
+        matches tilts_to_counts for the same tilt.
+
+        Args:
+        east_tilts -- array of east arm tilts
+        west_tilts -- array of west arm tilts
+        check_limits -- raise TiltLimitError if any count is outside
+                        [min_count,max_count]
+
+        Returns: (east counts, west counts) as int64 arrays
+        """
+        counts = []
+        for arm,tilts,scaling,offset in [
+            ("east",east_tilts,self._east_scaling,self.east_offset),
+            ("west",west_tilts,self._west_scaling,self.west_offset)]:
+            axis = self._tilt_to_axis(np.asarray(tilts,dtype="float64")+offset)
+            arm_counts = np.trunc(self._tilt_zero + scaling*axis).astype("int64")
+            if check_limits:
+                self._check_count_limits(arm,arm_counts)
+            counts.append(arm_counts)
+        return tuple(counts)
+
+    def counts_to_tilts_array(self,east_counts,west_counts):
+        """Convert arrays of encoder counts to tilts in radians.
+
+        Returns: (east tilts, west tilts) as float64 arrays
+        """
+        tilts = []
+        for counts,scaling,offset in [
+            (east_counts,self._east_scaling,self.east_offset),
+            (west_counts,self._west_scaling,self.west_offset)]:
+            axis = (np.asarray(counts,dtype="float64")-self._tilt_zero)/scaling
+            tilts.append(self._axis_to_tilt(axis) - offset)
+        return tuple(tilts)
+
+    def counts_in_limits(self,counts):
+        """Boolean mask of counts within [min_count,max_count]."""
+        counts = np.asarray(counts)
+        return (counts >= self.min_count) & (counts <= self.max_count)
+
+    def _check_count_limits(self,arm,counts):
+        bad = np.flatnonzero(~self.counts_in_limits(counts))
+        if bad.size:
+            raise TiltLimitError(arm,bad[0],np.ravel(counts)[bad[0]],self)
+
+    def minimum_step(self,tilt,delta=1e-3):
+        """Smallest tilt change (radians) about tilt that moves both
+        arms by more than the minimum count limit."""
+        tilts = [tilt,tilt+delta]
+        east,west = self.tilts_to_counts_array(tilts,tilts,check_limits=False)
+        per_radian = min(abs(east[1]-east[0]),abs(west[1]-west[0]))/delta
+        return (self._minimum_count_limit+1)/per_radian
+
     def set_tilts(self,east_tilt,west_tilt):
         """Set the tilts of the E and W arm NS drives."""
         east_count,west_count = self.tilts_to_counts(east_tilt,west_tilt)
@@ -585,7 +1120,7 @@ class DriveInterface(object):
                 data = encoded_count+encoded_dir_speed
                 self._east_active.set()
                 self._west_active.set()
-                self._drive(BOTH_ARMS,data)
+                self._drive(BOTH_ARMS,data,(es,ws))
 
     def set_east_tilt(self,east_tilt):
         """Set tilt of east arm."""
@@ -607,7 +1142,7 @@ class DriveInterface(object):
                 encoded_dir_speed = pack("B",dir_speed)
                 data = encoded_count+encoded_dir_speed
                 self._east_active.set()
-                self._drive(EAST_ARM,data)
+                self._drive(EAST_ARM,data,(es,None))
 
     def set_west_tilt(self,west_tilt):
         """Set tilt of west arm."""
@@ -629,7 +1164,7 @@ class DriveInterface(object):
                 encoded_dir_speed = pack("B",dir_speed)
                 data = encoded_count+encoded_dir_speed
                 self._west_active.set()
-                self._drive(WEST_ARM,data)
+                self._drive(WEST_ARM,data,(None,ws))
 
     def _calculate_tilts(self,u_dict):
         """Update status dictionary to converts counts to tilts."""
@@ -656,10 +1191,16 @@ class NSDriveInterface(DriveInterface):
             dc.node_name,dc.ip,dc.port,
             dc.west_scaling,dc.east_scaling,dc.tilt_zero,
             dc.minimum_counts,dc.slow_counts,
-            "ns",dc.timeout)
+            "ns",dc.timeout,dc.max_idle_sessions,dc.status_max_age,
+            dc.history_size,dc.min_count,dc.max_count,
+            dc.interrupt_grace,dc.interrupt_timeout)
         self._east_rate = dc.east_rate
         self._west_rate = dc.west_rate
         self.slow_factor = dc.slow_factor
+        self.speeds = self._speed_estimator(dc,dc.east_rate,dc.west_rate)
+        self.position_log = position_log_policy(
+            dc.position_log,dc.position_log_interval,dc.position_log_threshold)
+        self.position_trace = dc.position_log_trace
 
     @property
     def east_rate(self):
@@ -704,22 +1245,22 @@ class MDDriveInterface(DriveInterface):
             dc.node_name,dc.ip,dc.port,
             dc.west_scaling,dc.east_scaling,dc.tilt_zero,
             dc.minimum_counts,dc.slow_counts,
-            "md",dc.timeout)
+            "md",dc.timeout,dc.max_idle_sessions,dc.status_max_age,
+            dc.history_size,dc.min_count,dc.max_count,
+            dc.interrupt_grace,dc.interrupt_timeout)
         self.east_rate = dc.east_rate
         self.west_rate = dc.west_rate
         self.slow_factor = dc.slow_factor
+        self.speeds = self._speed_estimator(dc,dc.east_rate,dc.west_rate)
+        self.position_log = position_log_policy(
+            dc.position_log,dc.position_log_interval,dc.position_log_threshold)
+        self.position_trace = dc.position_log_trace
         
-    def tilts_to_counts(self,east_tilt,west_tilt):
-        """Convert tilts in radians to encoder counts."""
-        east_counts = int(self._tilt_zero + self._east_scaling * sin(east_tilt+self.east_offset))
-        west_counts = int(self._tilt_zero + self._west_scaling * sin(west_tilt+self.west_offset))
-        return east_counts,west_counts
+    def _tilt_to_axis(self,tilt):
+        return np.sin(tilt)
 
-    def counts_to_tilts(self,east_counts,west_counts):
-        """Convert encoder counts to tilts in radians."""
-        east_tilt = arcsin((east_counts-self._tilt_zero)/self._east_scaling) - self.east_offset
-        west_tilt = arcsin((west_counts-self._tilt_zero)/self._west_scaling) - self.west_offset
-        return east_tilt,west_tilt
+    def _axis_to_tilt(self,axis):
+        return np.arcsin(axis)
 
     def _get_direction(self,offset):
         return DRIVE_WEST if offset >= 0 else DRIVE_EAST
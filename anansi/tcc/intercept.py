@@ -0,0 +1,142 @@
+"""Slew intercept and tracking lead time solvers.
+
+Notes: Both solvers work on a single column ("ns" or "ew") of a
+TrackTable. Around any time t the source is described by a local
+quadratic model x(t+dt) = x + v*dt + a*dt*dt/2 fitted to three table
+samples, so each iteration costs three table interpolations rather
+than an ephem compute. Iteration counts are bounded; a solver that has
+not converged returns its latest estimate.
+"""
+from math import sqrt
+import ephem as eph
+
+
+class LocalTrajectory(object):
+    """Quadratic model of a track table column about a date.
+
+    Args:
+    table -- TrackTable of the source
+    name -- column to model ("ns" or "ew")
+    date -- ephem date the model is centred on (default now)
+    span -- seconds between the samples the model is fitted to
+    """
+    def __init__(self,table,name,date=None,span=60.0):
+        self.date = float(eph.now()) if date is None else float(date)
+        self.span = span
+        # forward samples only, so the table is never asked for the past
+        dates = [self.date + ii*span*eph.second for ii in range(3)]
+        x0,x1,x2 = table.value(name,dates)
+        self.x = x0
+        self.v = (4*x1 - 3*x0 - x2)/(2*span)
+        self.a = (x2 - 2*x1 + x0)/(span*span)
+
+    def __call__(self,dt):
+        return self.x + self.v*dt + 0.5*self.a*dt*dt
+
+    def rate(self,dt):
+        return self.v + self.a*dt
+
+
+def intercept_time(table,name,position,slew_time,date=None,span=60.0,
+                   iterations=6,precision=0.1):
+    """Seconds until an arm at position, driven now, meets the source.
+
+    Notes: Solves t = slew_time(|x(t)-position|) with Newton's method,
+    using the local source rate and the local slope of slew_time. The
+    first step, taken from t = 0, is the closed-form solution for a
+    source moving linearly.
+
+    Args:
+    table -- TrackTable of the source
+    name -- column to solve for ("ns" or "ew")
+    position -- current tilt of the arm (radians)
+    slew_time -- function returning the seconds taken to move a distance
+    date -- ephem date the drive starts (default now)
+    span -- sample spacing of the local trajectory models
+    iterations -- maximum number of Newton steps
+    precision -- convergence threshold in seconds
+
+    Returns: intercept time in seconds from date
+    """
+    date = float(eph.now()) if date is None else float(date)
+    t = 0.0
+    for ii in range(iterations):
+        model = LocalTrajectory(table,name,date+t*eph.second,span)
+        offset = model.x - position
+        distance = abs(offset)
+        duration = slew_time(distance)
+        delta = max(1e-3*distance,1e-6)
+        slope = (slew_time(distance+delta) - duration)/delta
+        sign = 1.0 if offset >= 0 else -1.0
+        closing = slope*sign*model.v
+        if closing >= 0.5:
+            # source is outrunning the drive: fall back to a fixed point step
+            step = duration - t
+        else:
+            step = (duration - t)/(1.0 - closing)
+        t = max(t + step,0.0)
+        if abs(step) < precision:
+            break
+    return t
+
+
+def _first_crossing(v,a,tolerance,offset=0.0):
+    """Smallest positive dt with |offset + v*dt + a*dt*dt/2| = tolerance, or None."""
+    if abs(offset) >= tolerance:
+        return 0.0
+    roots = []
+    for target in (tolerance-offset,-tolerance-offset):
+        if a == 0:
+            if v != 0:
+                roots.append(target/v)
+            continue
+        discriminant = v*v + 2*a*target
+        if discriminant < 0:
+            continue
+        root = sqrt(discriminant)
+        roots.extend([(-v+root)/a,(-v-root)/a])
+    roots = [dt for dt in roots if dt > 0]
+    return min(roots) if roots else None
+
+
+def lead_time(table,name,tolerance,position=None,date=None,span=60.0,iterations=6,
+              precision=0.1,max_time=3600.0):
+    """Seconds until the source is more than tolerance radians from
+    position (by default its own position at date).
+
+    Notes: The closed-form crossing of the local quadratic model is
+    refined with Newton steps on the table itself. Sources that do not
+    drift (e.g. fixed NS/EW coordinates) return max_time.
+
+    Args:
+    table -- TrackTable of the source
+    name -- column to solve for ("ns" or "ew")
+    tolerance -- drift in radians
+    position -- position the drift is measured from
+    date -- ephem date to solve from (default now)
+    span -- sample spacing of the local trajectory models
+    iterations -- maximum number of Newton steps
+    precision -- convergence threshold in seconds
+    max_time -- upper bound on the returned lead time
+
+    Returns: lead time in seconds from date
+    """
+    date = float(eph.now()) if date is None else float(date)
+    model = LocalTrajectory(table,name,date,span)
+    origin = model.x if position is None else position
+    t = _first_crossing(model.v,model.a,tolerance,model.x-origin)
+    if t is None or t > max_time:
+        return max_time
+    if t == 0:
+        return t
+    for ii in range(iterations):
+        local = LocalTrajectory(table,name,date+t*eph.second,span)
+        drift = local.x - origin
+        rate = local.rate(0.0) if drift >= 0 else -local.rate(0.0)
+        if rate <= 0:
+            break
+        step = (tolerance - abs(drift))/rate
+        t = min(max(t + step,0.0),max_time)
+        if abs(step) < precision:
+            break
+    return t
@@ -5,9 +5,9 @@ from lxml import etree
 import logging
 from anansi import exit_funcs
 from anansi import log
-from anansi.utils import d2r
+from anansi.utils import d2r,FanOutError
 from anansi.tcc import drives
-from anansi.comms import TCPServer,BaseHandler
+from anansi.comms import TCPServer,BaseHandler,SocketError,xml_message_complete
 from anansi.tcc.coordinates import make_coordinates
 from anansi.tcc.telescope_controller import TelescopeController
 from anansi.config import config
@@ -44,6 +44,7 @@ class TCCRequest(object):
         self.tcc_info = None
         self.tracking_mode = None
         self.coordinates = None
+        self.observations = []
         self.user = None
         self.comment = None
         self.east_state = drives.DISABLED
@@ -66,23 +67,37 @@ class TCCRequest(object):
         if server_cmds is not None:
             self.server_command = server_cmds.find("command").text.strip()
             
+    def parse_pointing(self,pointing):
+        info = {
+            "system":pointing.attrib.get("system","equatorial").strip(),
+            "tracking":pointing.attrib.get("tracking","on").strip(),
+            "units":pointing.attrib.get("units","radians").strip(),
+            "epoch":pointing.attrib.get("epoch","2000").strip(),
+            "x":pointing.find("xcoord").text.strip(),
+            "y":pointing.find("ycoord").text.strip()}
+        if info["units"] in ["radians","degrees"]:
+            info["x"] = float(info["x"])
+            info["y"] = float(info["y"])
+        info["tracking"] = info["tracking"] == "on"
+        return info
+
+    def parse_observations(self,tcc_cmd):
+        for element in tcc_cmd.findall("observation"):
+            info = self.parse_pointing(element)
+            info["dwell"] = float(element.attrib["dwell"])
+            info["start"] = element.attrib.get("start")
+            info["end"] = element.attrib.get("end")
+            info["name"] = element.attrib.get("name")
+            self.observations.append(info)
+
     def parse_tcc_commands(self):
         tcc_cmd = self.msg.find("tcc_command")
         if tcc_cmd is not None:
             self.tcc_command = tcc_cmd.find("command").text.strip()
-            if self.tcc_command == "point":
-                pointing = tcc_cmd.find("pointing")
-                self.tcc_info = {
-                    "system":pointing.attrib.get("system","equatorial").strip(),
-                    "tracking":pointing.attrib.get("tracking","on").strip(),
-                    "units":pointing.attrib.get("units","radians").strip(),
-                    "epoch":pointing.attrib.get("epoch","2000").strip(),
-                    "x":pointing.find("xcoord").text.strip(),
-                    "y":pointing.find("ycoord").text.strip()}
-                if self.tcc_info["units"] in ["radians","degrees"]:
-                    self.tcc_info["x"] = float(self.tcc_info["x"])
-                    self.tcc_info["y"] = float(self.tcc_info["y"])
-                self.tcc_info["tracking"] = self.tcc_info["tracking"] == "on"
+            if self.tcc_command == "queue":
+                self.parse_observations(tcc_cmd)
+            elif self.tcc_command == "point":
+                self.tcc_info = self.parse_pointing(tcc_cmd.find("pointing"))
                 
                 self.drive_info = {}
                 for drive in ['ns','md']:
@@ -102,19 +117,27 @@ class TCCRequest(object):
 
 class TCCRequestHandler(BaseHandler):
     def handle(self):
-        msg = self.request.recv(8192)
-        response = self.server.parse_message(msg)
-        self.request.send(str(response))
+        try:
+            msg = self.recvall(self.server.message_complete)
+        except SocketError as error:
+            logger.error("Could not receive TCC command: %s"%str(error),extra=log.tcc_status())
+            return
+        self.request.send(self.server.respond(msg))
         if self.server.shutdown_requested.is_set():
             self.server.shutdown()
         
 
-class TCCServer(TCPServer):
-    def __init__(self,ip,port,controller):
-        TCPServer.__init__(self,ip,port,handler_class=TCCRequestHandler)
+class TCCProtocol(object):
+    """TCC command handling shared by the blocking and event loop servers."""
+    def __init__(self,controller):
         self.controller = controller
         self.shutdown_requested = Event()
 
+    message_complete = staticmethod(xml_message_complete("tcc_request"))
+
+    def respond(self,msg):
+        return str(self.parse_message(msg))
+
     def _set_drive_parameters(self,request):
         for drive in ['ns','md']:
             _drive = getattr(self.controller,"%s_drive"%drive)
@@ -171,7 +194,20 @@ class TCCServer(TCPServer):
                         coords = make_coordinates(ns,ew,system="nsew",units="radians")
                     logger.debug("Generated coordinates object of type %s"%type(coords),extra=log.tcc_status())
                     logger.debug("Setting tracking status to %s"%track,extra=log.tcc_status())
+                    # direct pointings take over from any running observation queue
+                    self.controller.queue.stop()
                     self.controller.observe(coords,track=track)
+                elif request.tcc_command == "queue":
+                    for info in request.observations:
+                        logger.info("Queueing observation of %s %s (%s,%s,%s) for %.0f s"%(
+                                info["x"],info["y"],info["system"],info["units"],info["epoch"],
+                                info["dwell"]),extra=log.tcc_status())
+                        coords = make_coordinates(info["x"],info["y"],system=info["system"],
+                                                  units=info["units"],epoch=info["epoch"])
+                        self.controller.queue_observation(coords,info["dwell"],info["start"],
+                                                          info["end"],info["tracking"],info["name"])
+                elif request.tcc_command == "clear_queue":
+                    self.controller.queue.clear()
                 elif request.tcc_command == "stop":
                     self.controller.stop()
                 else:
@@ -179,8 +215,16 @@ class TCCServer(TCPServer):
         except Exception as error:
             logger.error("Exception encountered during parsing of TCC command message",
                          extra=log.tcc_status(),exc_info=True)
+            if isinstance(error,FanOutError):
+                logger.error("Underlying errors:\n%s"%error.format_tracebacks(),
+                             extra=log.tcc_status())
             response.error("TCC command failed: %s"%str(error))
         else:
             response.success("TCC command passed")
         return response
-           
+
+
+class TCCServer(TCCProtocol,TCPServer):
+    def __init__(self,ip,port,controller,timeout=10.0):
+        TCPServer.__init__(self,ip,port,handler_class=TCCRequestHandler,recv_timeout=timeout)
+        TCCProtocol.__init__(self,controller)
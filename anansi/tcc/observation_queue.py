@@ -0,0 +1,349 @@
+from threading import Thread,Event,Condition
+from math import ceil
+import logging
+import numpy as np
+import ephem as eph
+from anansi.tcc.track_table import TrackTable
+from anansi.utils import d2r
+from anansi.config import config
+from anansi import log
+logger = logging.getLogger('anansi')
+
+# fixed point iterations used to find where a slew meets a moving target
+SLEW_ITERATIONS = 4
+
+
+class Observation(object):
+    """A queued target.
+
+    Args:
+    coordinates -- coordinates object from anansi.tcc.coordinates
+    dwell -- seconds to spend on source
+    start -- ephem date before which the observation may not start
+    end -- ephem date by which the observation must finish
+    track -- track the source (False points and holds)
+    name -- label used in logs
+    """
+    def __init__(self,coordinates,dwell,start=None,end=None,track=True,name=None):
+        self.coordinates = coordinates
+        self.dwell = float(dwell)
+        self.start = None if start is None else float(eph.Date(start))
+        self.end = None if end is None else float(eph.Date(end))
+        self.track = track
+        self.name = name or str(coordinates)
+        self.table = None
+        self.started = None
+        self.finished = None
+
+    def position(self,date):
+        """(ns,ew) of the target at date."""
+        return tuple(self.table.values(["ns","ew"],date))
+
+    def __repr__(self):
+        return "Observation(%s,dwell=%.0f)"%(self.name,self.dwell)
+
+
+class ObservationPlanner(object):
+    """Orders observations to minimise slew and idle time.
+
+    Notes: A visit to an observation departs immediately, arrives
+    after the slew predicted by slew_time and then starts at the first
+    time the target is inside its window and stays inside the NS/MD
+    limits for the whole dwell. A greedy pass repeatedly picks the
+    observation that can start soonest; 2-opt segment reversals of the
+    first optimise_limit entries are then accepted while they bring
+    the end of the last observation forward. Observations that cannot
+    be visited before the planning horizon are left unscheduled.
+
+    Args:
+    slew_time -- function of two (ns,ew) positions returning seconds
+    ns_limit -- NS limit in radians
+    md_limit -- MD limit in radians
+    horizon -- seconds ahead that observations are planned
+    step -- resolution in seconds of the limit and window checks
+    passes -- maximum number of 2-opt passes
+    optimise_limit -- maximum number of observations reordered by 2-opt
+    """
+    def __init__(self,slew_time,ns_limit,md_limit,horizon=43200.0,step=60.0,
+                 passes=3,optimise_limit=25):
+        self.slew_time = slew_time
+        self.ns_limit = ns_limit
+        self.md_limit = md_limit
+        self.horizon = horizon
+        self.step = step
+        self.passes = passes
+        self.optimise_limit = optimise_limit
+
+    def _prepare(self,observation):
+        t = config.tracking
+        if observation.table is None:
+            observation.table = TrackTable(observation.coordinates,
+                                           duration=self.horizon+t.table_margin,
+                                           step=self.step,
+                                           knot_spacing=t.table_knot_spacing,
+                                           margin=t.table_margin)
+
+    def _earliest_start(self,observation,earliest,latest):
+        """First start in [earliest,latest] keeping the target inside the
+        limits for the whole dwell, or None."""
+        span = int(ceil(observation.dwell/self.step))
+        count = int((latest-earliest)/eph.second/self.step) + 1
+        dates = earliest + np.arange(count+span)*self.step*eph.second
+        ns,ew = observation.table.values(["ns","ew"],dates)
+        bad = (np.abs(ns) > self.ns_limit) | (np.abs(ew) > self.md_limit)
+        bad_count = np.concatenate([[0],np.cumsum(bad)])
+        windows = bad_count[span+1:span+1+count] - bad_count[:count]
+        good = np.flatnonzero(windows == 0)
+        if not good.size:
+            return None
+        return dates[good[0]]
+
+    def visit(self,observation,position,date,horizon_end):
+        """Plan a visit to observation from position at date.
+
+        Returns: (depart,start,end) dates, or None if it cannot be visited
+        """
+        slew = 0.0
+        for ii in range(SLEW_ITERATIONS):
+            slew = self.slew_time(position,observation.position(date+slew*eph.second))
+        earliest = date + slew*eph.second
+        if observation.start is not None:
+            earliest = max(earliest,observation.start)
+        finish = horizon_end if observation.end is None else min(observation.end,horizon_end)
+        latest = finish - observation.dwell*eph.second
+        if earliest > latest:
+            return None
+        start = self._earliest_start(observation,earliest,latest)
+        if start is None:
+            return None
+        if start > earliest:
+            # leave as late as possible so the telescope is not driven early
+            slew = self.slew_time(position,observation.position(start))
+            date = max(date,start - slew*eph.second)
+        return date,start,start+observation.dwell*eph.second
+
+    def _simulate(self,sequence,position,date,horizon_end):
+        schedule = []
+        for observation in sequence:
+            visit = self.visit(observation,position,date,horizon_end)
+            if visit is None:
+                return None
+            schedule.append((observation,)+visit)
+            date = visit[2]
+            position = observation.position(date)
+        return schedule
+
+    def _greedy(self,observations,position,date,horizon_end):
+        remaining = list(observations)
+        sequence = []
+        while remaining:
+            best = None
+            for observation in remaining:
+                visit = self.visit(observation,position,date,horizon_end)
+                if visit is not None and (best is None or visit[1] < best[1][1]):
+                    best = (observation,visit)
+            if best is None:
+                break
+            observation,visit = best
+            remaining.remove(observation)
+            sequence.append(observation)
+            date = visit[2]
+            position = observation.position(date)
+        return sequence,remaining
+
+    def _two_opt(self,sequence,position,date,horizon_end):
+        best = self._simulate(sequence,position,date,horizon_end)
+        size = min(len(sequence),self.optimise_limit)
+        for ii in range(self.passes):
+            improved = False
+            for first in range(size-1):
+                for last in range(first+1,size):
+                    candidate = (sequence[:first] + sequence[first:last+1][::-1] +
+                                 sequence[last+1:])
+                    schedule = self._simulate(candidate,position,date,horizon_end)
+                    if schedule is not None and schedule[-1][3] < best[-1][3] - eph.second:
+                        sequence,best = candidate,schedule
+                        improved = True
+            if not improved:
+                break
+        return sequence
+
+    def schedule(self,observations,position,date=None):
+        """Order observations for a telescope at position (ns,ew) at date.
+
+        Returns: (list of (observation,depart,start,end), list of
+                  observations that could not be scheduled)
+        """
+        date = float(eph.now()) if date is None else float(date)
+        horizon_end = date + self.horizon*eph.second
+        for observation in observations:
+            self._prepare(observation)
+        sequence,unscheduled = self._greedy(observations,position,date,horizon_end)
+        if len(sequence) > 2:
+            sequence = self._two_opt(sequence,position,date,horizon_end)
+        schedule = self._simulate(sequence,position,date,horizon_end) or []
+        return schedule,unscheduled
+
+
+class ObservationQueue(object):
+    """Queue of observations executed back to back by the controller.
+
+    Notes: The queue is re-planned from the telescope's current
+    position before each observation, so targets added while it runs
+    are fitted in. Each observation is started with
+    TelescopeController.observe at its planned departure time, under
+    the controller's observe_lock so that a pointing made after stop()
+    cannot be replaced by a queued observation. Observations are timed
+    from the moment both drives report being on source and ended after
+    their dwell. Observations whose window has passed are discarded.
+
+    Args:
+    controller -- TelescopeController that executes the observations
+    """
+    def __init__(self,controller):
+        self.controller = controller
+        qc = config.observation_queue
+        self.planner = ObservationPlanner(self._slew_time,d2r(qc.ns_limit),d2r(qc.md_limit),
+                                          qc.horizon,qc.step,qc.passes,qc.optimise_limit)
+        self.acquire_timeout = qc.acquire_timeout
+        self.poll_interval = qc.poll_interval
+        self.pending = []
+        self.completed = []
+        self.schedule = []
+        self.current = None
+        self._changed = Condition()
+        self._stop = Event()
+        self._runner = None
+
+    def _slew_time(self,a,b):
+        return max(self.controller.ns_drive.slew_time(abs(a[0]-b[0])),
+                   self.controller.md_drive.slew_time(abs(a[1]-b[1])))
+
+    def _drive_position(self,drive):
+        status = drive.get_status(drive.status_max_age)
+        return (status["east_tilt"]+status["west_tilt"])/2
+
+    def position(self):
+        """Current (ns,ew) of the telescope."""
+        return (self._drive_position(self.controller.ns_drive),
+                self._drive_position(self.controller.md_drive))
+
+    def add(self,coordinates,dwell,start=None,end=None,track=True,name=None):
+        observation = Observation(coordinates,dwell,start,end,track,name)
+        with self._changed:
+            self.pending.append(observation)
+            self._changed.notify_all()
+        logger.info("Queued %s"%observation,extra=log.tcc_status())
+        return observation
+
+    def clear(self):
+        with self._changed:
+            self.pending = []
+            self.schedule = []
+            self._changed.notify_all()
+
+    def plan(self,date=None):
+        """Re-plan the pending observations from the current position.
+
+        Notes: Planning reads the drive positions and can take seconds,
+        so it works on a copy of the pending list without holding the
+        queue lock. Observations removed while planning are dropped
+        from the result.
+        """
+        date = float(eph.now()) if date is None else float(date)
+        with self._changed:
+            expired = [obs for obs in self.pending if obs.end is not None and obs.end < date]
+            for observation in expired:
+                logger.warning("Discarding %s, its window has passed"%observation,
+                               extra=log.tcc_status())
+                self.pending.remove(observation)
+            pending = list(self.pending)
+        schedule,unscheduled = self.planner.schedule(pending,self.position(),date)
+        for observation in unscheduled:
+            logger.warning("Cannot currently schedule %s"%observation,extra=log.tcc_status())
+        with self._changed:
+            schedule = [entry for entry in schedule if entry[0] in self.pending]
+            self.schedule = schedule
+        return schedule
+
+    def running(self):
+        return self._runner is not None and self._runner.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        self._stop.clear()
+        self._runner = Thread(target=self._run,name="observation queue")
+        self._runner.daemon = True
+        self._runner.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self.running():
+            self._runner.join(config.tracking.end_timeout)
+
+    def _wait_until(self,date):
+        seconds = (date - eph.now())/eph.second
+        if seconds > 0:
+            self._stop.wait(seconds)
+
+    def _on_source(self):
+        track = self.controller.current_track
+        return (track is not None and track.on_target("ns",None) and
+                track.on_target("md",None))
+
+    def _observe(self,observation,depart):
+        self._wait_until(depart)
+        with self.controller.observe_lock:
+            # stop() may have been called while another thread held the lock
+            if self._stop.is_set():
+                return False
+            logger.info("Starting queued %s"%observation,extra=log.tcc_status())
+            self.controller.observe(observation.coordinates,track=observation.track)
+        waited = 0.0
+        while not self._on_source():
+            if self._stop.wait(self.poll_interval):
+                return False
+            waited += self.poll_interval
+            if waited > self.acquire_timeout:
+                logger.error("Could not acquire %s"%observation,extra=log.tcc_status())
+                return False
+        observation.started = float(eph.now())
+        if self._stop.wait(observation.dwell):
+            return False
+        observation.finished = float(eph.now())
+        logger.info("Finished queued %s"%observation,extra=log.tcc_status())
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                schedule = self.plan()
+            except Exception as error:
+                logger.error("Could not plan observation queue",extra=log.tcc_status(),exc_info=True)
+                schedule = []
+            if not schedule:
+                with self._changed:
+                    if not self._stop.is_set():
+                        # re-plan when targets are added or they may have risen
+                        self._changed.wait(self.planner.step)
+                continue
+            observation,depart,start,end = schedule[0]
+            with self._changed:
+                if observation not in self.pending:
+                    continue
+                self.pending.remove(observation)
+                self.current = observation
+            try:
+                if self._observe(observation,depart):
+                    self.completed.append(observation)
+                elif self._stop.is_set():
+                    # interrupted, so keep it for when the queue is restarted
+                    with self._changed:
+                        self.pending.insert(0,observation)
+            except Exception as error:
+                logger.error("Queued %s failed"%observation,extra=log.tcc_status(),exc_info=True)
+            finally:
+                self.current = None
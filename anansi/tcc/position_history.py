@@ -0,0 +1,90 @@
+from threading import Lock
+import numpy as np
+from anansi.utils import monotonic
+
+POSITION_HISTORY_DTYPE = np.dtype([
+        ("time","f8"),
+        ("east_count","i4"),
+        ("west_count","i4"),
+        ("east_tilt","f8"),
+        ("west_tilt","f8"),
+        ("east_status","u1"),
+        ("west_status","u1")])
+
+
+class PositionHistory(object):
+    """Fixed size ring buffer of timestamped drive positions.
+
+    Notes: Appends are O(1) and overwrite the oldest record once the
+    buffer is full. Queries return chronologically ordered copies as
+    numpy record arrays, so callers may use them without holding the
+    buffer lock. Times are from anansi.utils.monotonic.
+
+    Args:
+    size -- maximum number of records kept
+    """
+    def __init__(self,size=4096):
+        self._records = np.zeros(size,dtype=POSITION_HISTORY_DTYPE).view(np.recarray)
+        self._size = size
+        self._next = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def append(self,timestamp,status):
+        """Record a status dictionary taken at timestamp."""
+        with self._lock:
+            self._records[self._next] = (timestamp,) + tuple(
+                status[key] for key in POSITION_HISTORY_DTYPE.names[1:])
+            self._next = (self._next + 1) % self._size
+            self._count = min(self._count + 1,self._size)
+
+    def _ordered(self,n):
+        # the n most recent records, oldest first; caller holds the lock
+        n = min(n,self._count)
+        start = self._next - n
+        if start >= 0:
+            return self._records[start:self._next].copy()
+        return np.concatenate((self._records[start:],self._records[:self._next])).view(np.recarray)
+
+    def last(self,n=1):
+        """Return the n most recent records, oldest first."""
+        with self._lock:
+            return self._ordered(n)
+
+    def window(self,seconds,now=None):
+        """Return the records taken within the last seconds, oldest first."""
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            records = self._ordered(self._count)
+        start = np.searchsorted(records.time,now-seconds)
+        return records[start:]
+
+    def velocity(self,seconds,arm="east",field="tilt",now=None):
+        """Least squares rate of change of an arm's tilt or count.
+
+        Args:
+        seconds -- length of the window to fit over
+        arm -- "east" or "west"
+        field -- "tilt" (radians/s) or "count" (counts/s)
+
+        Returns: rate per second, or nan if fewer than two records
+        fall in the window
+        """
+        records = self.window(seconds,now)
+        if len(records) < 2:
+            return np.nan
+        t = records.time - records.time.mean()
+        y = records["%s_%s"%(arm,field)].astype("f8")
+        var = (t*t).sum()
+        if var == 0:
+            return np.nan
+        return (t*(y-y.mean())).sum()/var
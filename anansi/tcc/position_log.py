@@ -0,0 +1,137 @@
+"""Decimation policies for drive position logging.
+
+Notes: Each "U" frame received from an eZ80 is offered to the drive's
+policy through select(), which returns the position records (if any)
+that should be logged to the database. Records that are not selected
+are never formatted.
+"""
+
+POSITION_KEYS = ["east_count","west_count","east_status","west_status"]
+
+
+def _position(status):
+    return tuple(status[key] for key in POSITION_KEYS)
+
+
+class PositionLogPolicy(object):
+    """Base policy: log every frame."""
+    def __init__(self):
+        self.seen = 0
+        self.emitted = 0
+
+    def select(self,timestamp,status):
+        """Return the list of status dictionaries to log for this frame."""
+        self.seen += 1
+        records = self._select(timestamp,status)
+        self.emitted += len(records)
+        return records
+
+    def _select(self,timestamp,status):
+        return [dict(status)]
+
+
+class ChangePolicy(PositionLogPolicy):
+    """Log frames whose counts or status bytes differ from the last logged."""
+    def __init__(self):
+        super(ChangePolicy,self).__init__()
+        self._last = None
+
+    def _changed(self,status):
+        return _position(status) != self._last
+
+    def _emit(self,status):
+        self._last = _position(status)
+        return [dict(status)]
+
+    def _select(self,timestamp,status):
+        if self._changed(status):
+            return self._emit(status)
+        return []
+
+
+class IntervalPolicy(ChangePolicy):
+    """Log changed positions at most once every interval seconds."""
+    def __init__(self,interval):
+        super(IntervalPolicy,self).__init__()
+        self.interval = interval
+        self._last_time = None
+
+    def _select(self,timestamp,status):
+        if self._last_time is not None and timestamp - self._last_time < self.interval:
+            return []
+        if not self._changed(status):
+            return []
+        self._last_time = timestamp
+        return self._emit(status)
+
+
+class ThresholdPolicy(ChangePolicy):
+    """Log when either arm has moved threshold counts since the last
+    logged position, or when a status byte changes."""
+    def __init__(self,threshold):
+        super(ThresholdPolicy,self).__init__()
+        self.threshold = threshold
+
+    def _select(self,timestamp,status):
+        last = self._last
+        if (last is None or
+            abs(status["east_count"]-last[0]) >= self.threshold or
+            abs(status["west_count"]-last[1]) >= self.threshold or
+            (status["east_status"],status["west_status"]) != last[2:]):
+            return self._emit(status)
+        return []
+
+
+class MinMaxPolicy(PositionLogPolicy):
+    """Log the extreme positions of each arm over every interval.
+
+    Notes: At the end of each interval the records holding the
+    minimum and maximum count of each arm are logged (distinct records
+    only, in time order), so the envelope of the motion is kept at no
+    more than four rows per interval.
+    """
+    def __init__(self,interval):
+        super(MinMaxPolicy,self).__init__()
+        self.interval = interval
+        self._start = None
+        self._extremes = {}
+
+    def _update(self,timestamp,status):
+        for arm in ["east","west"]:
+            count = status["%s_count"%arm]
+            for kind,better in [("min",lambda a,b: a < b),("max",lambda a,b: a > b)]:
+                key = (arm,kind)
+                current = self._extremes.get(key)
+                if current is None or better(count,current[1]["%s_count"%arm]):
+                    self._extremes[key] = (timestamp,dict(status))
+
+    def _select(self,timestamp,status):
+        records = []
+        if self._start is None:
+            self._start = timestamp
+        elif timestamp - self._start >= self.interval:
+            unique = {}
+            for record_time,record in self._extremes.values():
+                unique[record_time] = record
+            records = [unique[key] for key in sorted(unique)]
+            self._extremes = {}
+            self._start = timestamp
+        self._update(timestamp,status)
+        return records
+
+
+POSITION_LOG_POLICIES = {
+    "all":lambda interval,threshold: PositionLogPolicy(),
+    "change":lambda interval,threshold: ChangePolicy(),
+    "interval":lambda interval,threshold: IntervalPolicy(interval),
+    "threshold":lambda interval,threshold: ThresholdPolicy(threshold),
+    "minmax":lambda interval,threshold: MinMaxPolicy(interval),
+    }
+
+def position_log_policy(name,interval=1.0,threshold=10):
+    """Build a policy by name: all, change, interval, threshold or minmax."""
+    try:
+        return POSITION_LOG_POLICIES[name](interval,threshold)
+    except KeyError:
+        raise ValueError("Unknown position log policy '%s', valid policies are: %s"%(
+                name,sorted(POSITION_LOG_POLICIES.keys())))
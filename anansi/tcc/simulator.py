@@ -0,0 +1,364 @@
+"""Local emulation of the eZ80 drive controllers.
+
+Notes: An EZ80Simulator speaks the same framed protocol as the NS
+(NST_SWIN) and MD (MDT_SWIN) eZ80s, so DriveInterface can be pointed
+at it through config/simulator.cfg. Arm motion is modelled with
+configurable fast and slow speeds, a start lag and count limits,
+and can be run on an accelerated clock. Faults (eZ80 errors mid
+drive, stalled arms) are injected on request.
+
+Run both drives locally with:
+    python -m anansi.tcc.simulator --config simulator.cfg
+"""
+import random
+import socket
+import logging
+from select import select
+from struct import pack
+from threading import Thread,Lock
+from time import sleep
+from anansi import codec
+from anansi.comms import TCPServer,BaseHandler
+from anansi.utils import monotonic
+logger = logging.getLogger('anansi')
+
+# status bytes reported for each arm
+STATUS_IDLE = 112
+STATUS_RUNNING = 113
+STATUS_NORTH_LIMIT = 116
+STATUS_SOUTH_LIMIT = 114
+
+# eZ80 codes sent by the simulator
+OVER_AND_OUT = 0
+WEST_REACHED = 13
+EAST_REACHED = 14
+SESSION_ABRUPT_CLOSE = 0
+INVALID_BYTE_PATTERN = 10
+TELESCOPE_UNSAFE_MOVEMENT_DETECTED = 20
+EAST_LIMIT_REACHED = 10
+WEST_LIMIT_REACHED = 20
+
+
+class SimulatedArm(object):
+    """A single telescope arm driven towards a target count.
+
+    Args:
+    name -- "east" or "west"
+    count -- initial encoder count
+    fast_rate -- counts per second at fast speed
+    slow_rate -- counts per second at slow speed
+    min_count -- lower count limit
+    max_count -- upper count limit
+    start_lag -- seconds between a command and the arm moving
+    """
+    def __init__(self,name,count,fast_rate,slow_rate,min_count,max_count,start_lag=0.0):
+        self.name = name
+        self.count = float(count)
+        self.rates = [fast_rate,slow_rate] # indexed by DRIVE_FAST/DRIVE_SLOW
+        self.min_count = min_count
+        self.max_count = max_count
+        self.start_lag = start_lag
+        self.stalled = False
+        self.target = None
+        self.rate = 0.0
+        self.wait = 0.0
+        self.at_limit = False
+
+    def start(self,target,speed):
+        self.target = target
+        self.rate = self.rates[speed]
+        self.wait = self.start_lag
+        self.at_limit = False
+
+    def stop(self):
+        self.target = None
+
+    def moving(self):
+        return self.target is not None
+
+    def step(self,dt):
+        """Advance the arm by dt simulated seconds.
+
+        Returns: "reached", "limit" or None
+        """
+        if self.target is None:
+            return None
+        if self.wait > 0:
+            used = min(self.wait,dt)
+            self.wait -= used
+            dt -= used
+        if self.stalled or dt <= 0:
+            return None
+        offset = self.target - self.count
+        move = min(abs(offset),self.rate*dt)
+        self.count += move if offset >= 0 else -move
+        if self.count >= self.max_count or self.count <= self.min_count:
+            self.count = min(max(self.count,self.min_count),self.max_count)
+            self.at_limit = True
+            self.target = None
+            return "limit"
+        if self.count == self.target:
+            self.target = None
+            return "reached"
+        return None
+
+    def status(self):
+        if self.at_limit:
+            return STATUS_NORTH_LIMIT if self.count >= self.max_count else STATUS_SOUTH_LIMIT
+        if self.target is not None and self.wait <= 0 and not self.stalled:
+            return STATUS_RUNNING
+        return STATUS_IDLE
+
+
+class EZ80Session(object):
+    """A client connection to the simulator."""
+    def __init__(self,sock,frame_codec):
+        self.sock = sock
+        self._codec = frame_codec
+        self._send_lock = Lock()
+        self.served = False
+
+    def close(self):
+        """Close the session from the eZ80 side."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def send(self,code,value=None,data=None):
+        if value is not None:
+            data = pack("B",value)
+        header,data = self._codec.encode(code,data)
+        with self._send_lock:
+            try:
+                self.sock.sendall(header+data)
+            except socket.error:
+                pass
+
+
+class EZ80SessionHandler(BaseHandler):
+    def handle(self):
+        sim = self.server
+        session = sim.open_session(self.request)
+        frame_buffer = codec.FrameBuffer(sim.codec)
+        try:
+            while not sim.shutdown_requested.is_set():
+                readable,_,_ = select([self.request],[],[],0.5)
+                if not readable:
+                    continue
+                chunk = self.request.recv(4096)
+                if not chunk:
+                    break
+                frame_buffer.feed(chunk)
+                for header,data in frame_buffer.frames():
+                    sim.command(session,header["Command option"],data)
+        except socket.error:
+            pass
+        finally:
+            sim.close_session(session)
+
+
+class EZ80Simulator(TCPServer):
+    """Threaded emulation of a single eZ80 drive controller.
+
+    Notes: Each client connection is a session served by its own
+    worker. A drive command ("1" both arms, "2" east, "3" west) is
+    acknowledged with "S" 0, interrupts any drive running on another
+    session with "E" 0 and then streams "U" position updates (when
+    verbose) followed by "I" 14/13 as the east/west arms arrive and
+    "I" 0 once both have stopped. "0" stops the drive, "U" returns the
+    position and "V" sets verbosity. New sessions are told the open
+    socket count with a "C" message.
+
+    Args:
+    node_name -- eZ80 node name used in frame headers
+    ip -- address to serve on
+    port -- port to serve on (0 picks a free port)
+    east_count, west_count -- initial arm counts
+    fast_rate, slow_rate -- arm speeds in counts per second
+    min_count, max_count -- arm count limits
+    start_lag -- simulated seconds before arms respond to a command
+    latency -- real seconds added before each reply
+    update_interval -- real seconds between motion updates
+    clock_rate -- simulated seconds per real second
+    fault_probability -- chance of an "E" 20 fault part way through a drive
+    stalled_arm -- "east" or "west" to simulate an arm that never moves
+    max_sessions -- number of concurrent sessions served
+    single_use_sessions -- close a session, without replying, when it is
+                           sent a second command (an eZ80 that has
+                           dropped an idle session)
+    """
+    def __init__(self,node_name,ip,port,east_count,west_count,
+                 fast_rate,slow_rate,min_count,max_count,
+                 start_lag=0.0,latency=0.0,update_interval=0.25,clock_rate=1.0,
+                 fault_probability=0.0,stalled_arm=None,max_sessions=20,
+                 single_use_sessions=False):
+        TCPServer.__init__(self,ip,port,EZ80SessionHandler,
+                           workers=max_sessions,queue_depth=max_sessions)
+        self.port = self.server_address[1]
+        self.node_name = node_name
+        self.codec = codec.FrameCodec(node_name)
+        self.arms = {}
+        for name,count in [("east",east_count),("west",west_count)]:
+            self.arms[name] = SimulatedArm(name,count,fast_rate,slow_rate,
+                                           min_count,max_count,start_lag)
+        if stalled_arm in self.arms:
+            self.arms[stalled_arm].stalled = True
+        self.latency = latency
+        self.update_interval = update_interval
+        self.clock_rate = clock_rate
+        self.fault_probability = fault_probability
+        self.single_use_sessions = single_use_sessions
+        self.verbose = True
+        self.sessions = []
+        self.commands = 0
+        self._state_lock = Lock()
+        self._active_session = None
+        self._fault_at = None
+        self._motion_thread = None
+
+    @classmethod
+    def from_config(cls,sim_config,drive_config):
+        sc = sim_config
+        return cls(drive_config.node_name,drive_config.ip,drive_config.port,
+                   sc.east_count,sc.west_count,sc.fast_rate,sc.slow_rate,
+                   sc.min_count,sc.max_count,sc.start_lag,sc.latency,
+                   sc.update_interval,sc.clock_rate,sc.fault_probability,
+                   sc.stalled_arm,sc.max_sessions)
+
+    def start(self):
+        TCPServer.start(self)
+        self._motion_thread = Thread(target=self._motion_loop,
+                                     name="%s simulator motion"%self.node_name)
+        self._motion_thread.daemon = True
+        self._motion_thread.start()
+
+    def shutdown(self):
+        self.shutdown_requested.set()
+        TCPServer.shutdown(self)
+        self._motion_thread.join()
+        self.server_close()
+
+    def open_session(self,sock):
+        session = EZ80Session(sock,self.codec)
+        with self._state_lock:
+            self.sessions.append(session)
+            count = len(self.sessions)
+        session.send("C",count)
+        return session
+
+    def close_session(self,session):
+        with self._state_lock:
+            self.sessions.remove(session)
+            if self._active_session is session:
+                self._active_session = None
+                for arm in self.arms.values():
+                    arm.stop()
+
+    def _position(self):
+        east,west = self.arms["east"],self.arms["west"]
+        return codec.encode_position(east.status(),int(round(east.count)),
+                                     west.status(),int(round(west.count)))
+
+    def _interrupt(self,session):
+        # caller holds the state lock
+        active = self._active_session
+        if active is not None and active is not session:
+            active.send("E",SESSION_ABRUPT_CLOSE)
+        self._active_session = None
+        self._fault_at = None
+        for arm in self.arms.values():
+            arm.stop()
+
+    def command(self,session,code,data):
+        """Handle one command frame received on a session."""
+        self.commands += 1
+        if self.latency:
+            sleep(self.latency)
+        if self.single_use_sessions and session.served:
+            session.close()
+            return
+        session.served = True
+        with self._state_lock:
+            if code == "U":
+                session.send("U",data=self._position())
+            elif code == "V":
+                self.verbose = bool(ord(data[0])) if data else True
+            elif code == "0":
+                self._interrupt(session)
+            elif code in "123":
+                self._interrupt(session)
+                self._start_drive(session,code,data)
+            else:
+                session.send("E",INVALID_BYTE_PATTERN)
+                return
+            session.send("S",0)
+
+    def _start_drive(self,session,code,data):
+        # caller holds the state lock
+        flags = ord(data[-1])
+        if code == "1":
+            targets = [("east",codec.it_unpack(data[0:3])),("west",codec.it_unpack(data[3:6]))]
+        elif code == "2":
+            targets = [("east",codec.it_unpack(data[0:3]))]
+        else:
+            targets = [("west",codec.it_unpack(data[0:3]))]
+        for name,target in targets:
+            speed = (flags & 1) if name == "east" else (flags >> 2) & 1
+            self.arms[name].start(target,speed)
+        self._active_session = session
+        if random.random() < self.fault_probability:
+            self._fault_at = random.uniform(0,10.0)
+        else:
+            self._fault_at = None
+
+    def _motion_loop(self):
+        last = monotonic()
+        while not self.shutdown_requested.wait(self.update_interval):
+            now = monotonic()
+            dt = (now-last)*self.clock_rate
+            last = now
+            with self._state_lock:
+                self._step(dt)
+
+    def _step(self,dt):
+        # caller holds the state lock
+        session = self._active_session
+        if session is None:
+            return
+        if self._fault_at is not None:
+            self._fault_at -= dt
+            if self._fault_at <= 0:
+                session.send("E",TELESCOPE_UNSAFE_MOVEMENT_DETECTED)
+                self._interrupt(None)
+                return
+        events = [(name,arm.step(dt)) for name,arm in sorted(self.arms.items())]
+        if self.verbose:
+            session.send("U",data=self._position())
+        for name,event in events:
+            if event == "reached":
+                session.send("I",EAST_REACHED if name == "east" else WEST_REACHED)
+            elif event == "limit":
+                session.send("W",EAST_LIMIT_REACHED if name == "east" else WEST_LIMIT_REACHED)
+        if not any(arm.moving() for arm in self.arms.values()):
+            session.send("I",OVER_AND_OUT)
+            self._active_session = None
+
+
+def simulate(config):
+    """Start simulators for the NS and MD drives described in config."""
+    simulators = [
+        EZ80Simulator.from_config(config.ns_simulator,config.ns_drive),
+        EZ80Simulator.from_config(config.md_simulator,config.md_drive)]
+    for sim in simulators:
+        sim.start()
+        logger.info("Simulating %s eZ80 on %s:%d"%(sim.node_name,sim.ip,sim.port))
+    return simulators
+
+if __name__ == "__main__":
+    from anansi.config import config,update_config_from_args
+    from anansi import args
+    update_config_from_args(args.parse_anansi_args())
+    simulators = simulate(config)
+    while True:
+        sleep(1.0)
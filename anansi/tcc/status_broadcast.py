@@ -0,0 +1,140 @@
+from threading import Thread,Event
+from time import time
+import logging
+from lxml import etree
+from anansi.comms import UDPSender,UDPReceiver
+from anansi.utils import gen_xml_element
+from anansi import exit_funcs
+from anansi import log
+logger = logging.getLogger('anansi')
+
+
+COORDINATE_KEYS = ["RA","Dec","HA","NS","EW","LMST"]
+ARM_KEYS = ["tilt","count","driving","state","on_target","system_status"]
+
+
+def compact_status(status_dict,attributes=None):
+    """Serialise the broadcast subset of a status dictionary.
+
+    Notes: Values are carried as attributes of a single element per
+    drive arm rather than one element per value, which keeps the
+    datagram to a few hundred bytes.
+
+    Args:
+    status_dict -- status dictionary from StatusProtocol.snapshot
+    attributes -- extra attributes set on the root element
+
+    Returns: XML string
+    """
+    root = gen_xml_element("tcc_status",attributes={
+            "error_string":str(status_dict["error_string"])})
+    for key in COORDINATE_KEYS:
+        root.attrib[key] = str(status_dict[key])
+    if attributes is not None:
+        for key,val in attributes.items():
+            root.attrib[key] = str(val)
+    for drive in ["ns","md"]:
+        _drive = gen_xml_element(drive,attributes={"error":str(status_dict[drive]["error"])})
+        for arm in ["east","west"]:
+            _drive.append(gen_xml_element(arm,attributes={
+                        key:str(status_dict[drive][arm][key]) for key in ARM_KEYS}))
+        root.append(_drive)
+    return etree.tostring(root)
+
+
+class StatusBroadcaster(Thread):
+    """Publish status snapshots to a UDP/multicast group.
+
+    Notes: Each datagram is the compact_status of the status server's
+    cached snapshot, so broadcasting does not add drive or ephemeris
+    reads. The cache is only refreshed here when no request has
+    updated it for max_age seconds. The root element carries a
+    "sequence" attribute that increases by one per datagram and the
+    "time" the snapshot was taken, so receivers can detect loss and
+    staleness.
+
+    Args:
+    status_server -- StatusProtocol instance providing the snapshots
+    ip -- destination address or multicast group
+    port -- destination port
+    interval -- seconds between datagrams
+    ttl -- multicast time-to-live
+    max_age -- seconds after which the cached snapshot is refreshed
+    """
+    def __init__(self,status_server,ip,port,interval=1.0,ttl=1,max_age=10.0):
+        Thread.__init__(self)
+        self.name = "status broadcaster"
+        self.daemon = True
+        self.status_server = status_server
+        self.interval = interval
+        self.max_age = max_age
+        self.sequence = 0
+        self._sender = UDPSender(ip,port,ttl)
+        self._shutdown = Event()
+
+    def shutdown(self):
+        self._shutdown.set()
+        exit_funcs.deregister(self.shutdown)
+
+    def start(self):
+        Thread.start(self)
+        exit_funcs.register(self.shutdown)
+
+    def broadcast(self):
+        updated,status = self.status_server.snapshot()
+        if updated is None or time() - updated > self.max_age:
+            self.status_server.update()
+            updated,status = self.status_server.snapshot()
+        self.sequence += 1
+        self._sender.send(compact_status(status,{
+                    "sequence":self.sequence,"time":"%.3f"%updated}))
+
+    def run(self):
+        while not self._shutdown.wait(self.interval):
+            try:
+                self.broadcast()
+            except Exception as error:
+                logger.error("Could not send status broadcast",extra=log.tcc_status(),exc_info=True)
+        self._sender.close()
+
+
+class StatusListener(object):
+    """Receive status snapshots from a StatusBroadcaster.
+
+    Args:
+    ip -- address or multicast group to listen on
+    port -- port to listen on
+    timeout -- receive timeout in seconds
+    """
+    def __init__(self,ip,port,timeout=5.0):
+        self._receiver = UDPReceiver(ip,port,timeout=timeout)
+        self.last_sequence = None
+        self.received = 0
+        self.lost = 0
+
+    def receive(self):
+        """Wait for the next snapshot.
+
+        Returns: (sequence number, lxml root element)
+        """
+        xml = etree.fromstring(self._receiver.receive())
+        sequence = int(xml.attrib["sequence"])
+        if self.last_sequence is not None and sequence > self.last_sequence + 1:
+            self.lost += sequence - self.last_sequence - 1
+        self.last_sequence = sequence
+        self.received += 1
+        return sequence,xml
+
+    def close(self):
+        self._receiver.close()
+
+if __name__ == "__main__":
+    from anansi.config import config,update_config_from_args
+    from anansi import args
+    update_config_from_args(args.parse_anansi_args())
+    b = config.status_broadcast
+    listener = StatusListener(b.ip,b.port)
+    while True:
+        sequence,xml = listener.receive()
+        print "Received status %d (%d lost)"%(sequence,listener.lost)
+        print etree.tostring(xml,pretty_print=True)
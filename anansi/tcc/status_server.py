@@ -1,11 +1,14 @@
-from threading import Event
+from functools import partial
+from threading import Event,RLock
 from time import sleep,time
 import copy
 import logging
 from lxml import etree
 import ephem as eph
 from anansi.comms import TCPServer,BaseHandler
-from anansi.utils import gen_xml_element
+from anansi.utils import gen_xml_element,fan_out
+from anansi.decorators import lock_stats,LOCK_HISTOGRAM_BINS
+from anansi.config import config
 from anansi import exit_funcs
 from anansi import log
 logger = logging.getLogger('anansi')
@@ -50,41 +53,50 @@ STATUS_DICT_DEFAULTS = {
 
 class StatusRequestHandler(BaseHandler):
     def handle(self):
+        self.request.send(self.server.respond())
+
+
+class StatusProtocol(object):
+    """Status reporting shared by the blocking and event loop servers."""
+    def __init__(self,controller):
+        self.status_dict = STATUS_DICT_DEFAULTS
+        self.controller = controller
+        self.updated = None
+        self._status_lock = RLock()
+
+    def respond(self,msg=None):
         try:
-            self.server.update()
+            self.update()
         except Exception as error:
             logger.error("Could not update status server",extra=log.tcc_status(),exc_info=True)
-            self.request.send("Error on status request: %s"%str(error))
-            return 
+            return "Error on status request: %s"%str(error)
     
         try:
-            xml = self.server.get_xml_status()
-            response = etree.tostring(xml,encoding='ISO-8859-1')
+            response = self.status_message()
         except Exception as error:
             logger.error("Could not create XML status message",extra=log.tcc_status(),exc_info=True)
-            self.request.send("Error on status request: %s"%str(error))
+            return "Error on status request: %s"%str(error)
         else:
-            self.request.send(response)
+            return response
 
-
-class StatusServer(TCPServer):
-    def __init__(self,ip,port,controller):
-        TCPServer.__init__(self,ip,port,handler_class=StatusRequestHandler)
-        self.status_dict = STATUS_DICT_DEFAULTS
-        self.controller = controller
-        self.last_update = {
-            "ns":0.0,
-            "md":0.0
-            }
+    def status_message(self,xml_declaration=True,attributes=None):
+        """Serialise the current status dictionary as an XML string."""
+        with self._status_lock:
+            xml = self.get_xml_status()
+        if attributes is not None:
+            for key,val in attributes.items():
+                xml.attrib[key] = str(val)
+        if xml_declaration:
+            return etree.tostring(xml,encoding='ISO-8859-1')
+        else:
+            return etree.tostring(xml)
 
     def _get_drive_info(self,drive,drive_name):
-        now = time()
-        if now - self.last_update[drive_name] > UPDATE_WAIT:
-            self.last_update[drive_name] = now
-            status = drive.get_status()
-        else:
-            status = drive.status_dict
+        status = drive.get_status(max_age=UPDATE_WAIT)
+        with self._status_lock:
+            self._set_drive_info(drive,drive_name,status)
 
+    def _set_drive_info(self,drive,drive_name,status):
         for arm in ['east','west']:
             self.status_dict[drive_name][arm]['count'] = status['%s_count'%arm]
             self.status_dict[drive_name][arm]['system_status'] = status['%s_status'%arm]
@@ -96,8 +108,33 @@ class StatusServer(TCPServer):
             self.status_dict[drive_name][arm]['offset'] = getattr(drive,"%s_offset"%arm)
 
 
+    def _table_position(self,table):
+        # interpolated from the controller's track table rather than a full ephem compute
+        pos = table.position()
+        eq = eph.Equatorial(pos["a_ra"],pos["a_dec"],epoch=table.epoch)
+        gal = eph.Galactic(eq)
+        ecl = eph.Ecliptic(eq)
+        return {
+            "RA":str(eph.hours(pos["ra"])),
+            "Dec":str(eph.degrees(pos["dec"])),
+            "HA":str(eph.degrees(pos["ha"])),
+            "Glat":str(float(gal.lat)),
+            "Glon":str(float(gal.long)),
+            "Elat":str(eph.degrees(ecl.lat)),
+            "Elon":str(eph.degrees(ecl.long)),
+            "Alt":str(pos["alt"]),
+            "Az":str(pos["az"]),
+            "NS":str(pos["ns"]),
+            "EW":str(pos["ew"]),
+            "LMST":str(eph.hours(pos["lst"]))
+            }
+
     def update(self):
-        if self.controller.coordinates is not None:
+        if self.controller.track_table is not None:
+            pos_dict = self._table_position(self.controller.track_table)
+            with self._status_lock:
+                self.status_dict.update(pos_dict)
+        elif self.controller.coordinates is not None:
             coords = self.controller.coordinates.new_instance()
             coords.compute()
             pos_dict = {
@@ -114,11 +151,24 @@ class StatusServer(TCPServer):
                 "EW":str(float(coords.ew)),
                 "LMST":str(coords.lst)
                 }
-            self.status_dict.update(pos_dict)
-        self._get_drive_info(self.controller.ns_drive,"ns")
-        self._get_drive_info(self.controller.md_drive,"md")
-        self.status_dict['ns']['error'] = str(self.controller.ns_drive.error_state)
-        self.status_dict['md']['error'] = str(self.controller.md_drive.error_state)
+            with self._status_lock:
+                self.status_dict.update(pos_dict)
+        fan_out({
+                "ns":partial(self._get_drive_info,self.controller.ns_drive,"ns"),
+                "md":partial(self._get_drive_info,self.controller.md_drive,"md")},
+                config.controller.drive_deadline)
+        with self._status_lock:
+            self.status_dict['ns']['error'] = str(self.controller.ns_drive.error_state)
+            self.status_dict['md']['error'] = str(self.controller.md_drive.error_state)
+            self.updated = time()
+
+    def snapshot(self):
+        """Copy of the cached status without refreshing it.
+
+        Returns: (time of the last update or None, status dictionary)
+        """
+        with self._status_lock:
+            return self.updated,copy.deepcopy(self.status_dict)
 
     def _xml_from_key(self,key):
         return gen_xml_element(key,str(self.status_dict[key]))
@@ -159,8 +209,42 @@ class StatusServer(TCPServer):
                 _append(_arm,arm,drive)
                 _drive.append(_arm)
             root.append(_drive)
+
+        stats = getattr(self,"stats",None)
+        if stats is not None:
+            server = gen_xml_element("server")
+            for key,val in sorted(stats.as_dict().items()):
+                server.append(gen_xml_element(key,str(val)))
+            server.append(gen_xml_element("queue_size",str(self.queue_size())))
+            root.append(server)
+
+        if lock_stats.enabled:
+            root.append(self._lock_statistics_xml())
         return root
 
+    def _lock_statistics_xml(self):
+        locks = gen_xml_element("locks",attributes={
+                "histogram_bins":",".join(str(ii) for ii in LOCK_HISTOGRAM_BINS)})
+        for lock_name,methods in sorted(lock_stats.as_dict().items()):
+            for method,timing in sorted(methods.items()):
+                lock = gen_xml_element("lock",attributes={"name":lock_name,"method":method})
+                for kind in ["wait","hold"]:
+                    stats = timing[kind]
+                    lock.append(gen_xml_element(kind,attributes={
+                                "count":str(stats["count"]),
+                                "mean":"%.6f"%stats["mean"],
+                                "max":"%.6f"%stats["max"],
+                                "histogram":",".join(str(ii) for ii in stats["histogram"])}))
+                locks.append(lock)
+        return locks
+
+
+class StatusServer(StatusProtocol,TCPServer):
+    def __init__(self,ip,port,controller,workers=0,queue_depth=0):
+        TCPServer.__init__(self,ip,port,handler_class=StatusRequestHandler,
+                           workers=workers,queue_depth=queue_depth)
+        StatusProtocol.__init__(self,controller)
+
 if __name__ == "__main__":
     from anansi.config import update_config_from_args,config
     from anansi import args
@@ -169,7 +253,7 @@ if __name__ == "__main__":
     update_config_from_args(args.parse_anansi_args())
     s = config.status_server
     controller = TelescopeController()
-    server = StatusServer(s.ip,s.port,controller)
+    server = StatusServer(s.ip,s.port,controller,s.workers,s.queue_depth)
     server.start()
     while not server.shutdown_requested.is_set():
         sleep(1.0)
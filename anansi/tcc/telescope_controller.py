@@ -1,32 +1,46 @@
-from threading import Thread,Event
-from time import sleep,time
+from collections import deque
+from threading import Thread,Event,RLock,current_thread
+from time import time
 import copy
 import logging
-from scipy.optimize import fmin
 import ephem as eph
-from anansi.utils import gen_xml_element,d2r,r2d
+from anansi.utils import gen_xml_element,d2r,r2d,fan_out,FanOutError
 from anansi.tcc.drives import NSDriveInterface,MDDriveInterface,CountError,TelescopeArmsDisabled,eZ80Error
 from anansi.tcc import drives
+from anansi.tcc.track_table import TrackTable
+from anansi.tcc.intercept import intercept_time,lead_time,LocalTrajectory
+from anansi.tcc.observation_queue import ObservationQueue
+from anansi.decorators import locked_method
 from anansi.config import config
 from anansi import log
 logger = logging.getLogger('anansi')
 
+# tracking modes, selected by config.tracking.mode
+STEPPED = "stepped"
+STREAMING = "streaming"
+
 class BaseTracker(Thread):
-    def __init__(self, drive, coords, nsew, rate, tolerance, track, stop):
+    def __init__(self, drive, table, nsew, rate, tolerance, track, stop):
         Thread.__init__(self)
         self.name = "%s tracker thread"%(drive.name)
         self.drive = drive
         self.drive.clear_error()
         self._track = track
-        self.coords = coords
+        self.table = table
         self.rate = rate
         self.nsew = nsew
         self._stop = stop
         self.tolerance = tolerance
         self.on_source = False
+        self._setpoint = None
+        self._backoff = config.tracking.retry_backoff
+
+    def _target(self,date=None):
+        """Source position on this tracker's axis at date (default now)."""
+        return self.table.value(self.nsew,date)
 
     def _max_tilt_offset(self,tilt):
-        state = self.drive.get_status()
+        state = self.drive.get_status(self.drive.status_max_age)
         if self.drive.east_state != drives.DISABLED and self.drive.west_state!=drives.DISABLED:
             east_offset = abs(state["east_tilt"]-tilt)
             west_offset = abs(state["west_tilt"]-tilt)
@@ -42,12 +56,11 @@ class BaseTracker(Thread):
             raise TelescopeArmsDisabled(self.drive.name)
         
     def on_target(self,arm=None):
-        self.coords.compute()
-        x = getattr(self.coords,self.nsew)
+        x = self._target()
         if arm is None:
             tilt = self._max_tilt_offset(x)
         elif arm in ['east','west']:
-            tilt = self.drive.get_status()['%s_tilt'%arm]
+            tilt = self.drive.get_status(self.drive.status_max_age)['%s_tilt'%arm]
         else:
             raise Exception("Valid arm names are east and west")
         offset = abs(tilt-x)
@@ -55,31 +68,53 @@ class BaseTracker(Thread):
         logger.info("%s drive is %.5f radians from target"%(self.drive.name,offset))
         return self.on_source
 
-    def __mdt(self,t,*args):
-        t = abs(t)
-        telescope_pos = args[0]
-        date = eph.now() + t*eph.second
-        self.coords.compute(date)
-        source_pos = getattr(self.coords,self.nsew)
-        offset = abs(telescope_pos - source_pos)
-        return abs(offset-t*self.rate)
-            
+    def _wait(self,until_idle,timeout=5.0):
+        """Sleep until the track is stopped, the drive errors or (if
+        until_idle) the current drive finishes, for at most timeout seconds."""
+        def done(drive):
+            return (self._stop.is_set() or drive.has_error() or
+                    (until_idle and not drive.active()))
+        s = config.tracking
+        timeout = min(max(timeout,s.min_wait),s.max_wait)
+        self.drive.wait_for(done,timeout)
+
+    def _arrival_time(self):
+        """Seconds until the running drive is expected to reach its setpoint."""
+        s = config.tracking
+        if self._setpoint is None:
+            return s.max_wait
+        tilt = self._max_tilt_offset(self._setpoint)
+        return self.drive.slew_time(abs(tilt-self._setpoint)) + s.arrival_margin
+
+    def _drift_time(self):
+        """Seconds until the source leaves tolerance of the telescope position."""
+        s = config.tracking
+        tilt = self._max_tilt_offset(self._target())
+        return lead_time(self.table,self.nsew,self.tolerance,position=tilt,
+                         span=s.solver_span,iterations=s.solver_iterations,
+                         precision=s.solver_precision,max_time=s.max_wait)
+
+    def _back_off(self):
+        """Wait before retrying a failed drive command, doubling the wait
+        on each consecutive failure. Returns early if the track is stopped."""
+        self._stop.wait(self._backoff)
+        self._backoff = min(2*self._backoff,config.tracking.max_backoff)
+
     def drive_time(self):
-        self.coords.compute()
-        tilt = self._max_tilt_offset(self.coords.ns)
-        dt = fmin(self.__mdt,[0.0,],args=(tilt,),disp=False)[0]
+        tilt = self._max_tilt_offset(self._target())
+        s = config.tracking
+        dt = intercept_time(self.table,self.nsew,tilt,self.drive.slew_time,
+                            span=s.solver_span,iterations=s.solver_iterations,
+                            precision=s.solver_precision)
         logger.info("Predicted slew time for %s drive: %.0f"%(self.drive.name,dt),
                     extra=log.tcc_status())
         return dt
-        
-    def __mpd(self,t):
-        t = abs(t)
-        self.coords.compute()
-        x = getattr(self.coords,self.nsew)
-        date = eph.now() + t*eph.second
-        self.coords.compute(date)
-        nx = getattr(self.coords,self.nsew)
-        return abs(abs(nx-x) - self.tolerance)
+
+    def lead_time(self):
+        s = config.tracking
+        return lead_time(self.table,self.nsew,self.tolerance,
+                         span=s.solver_span,iterations=s.solver_iterations,
+                         precision=s.solver_precision,max_time=s.max_lead_time)
 
     def set_tilts(self,tilt):
         try:
@@ -93,14 +128,17 @@ class BaseTracker(Thread):
             else:
                 raise TelescopeArmsDisabled(self.drive.name)
         except CountError:
-            sleep(2)
+            self._back_off()
         except eZ80Error:
             logger.error("Caught eZ80 error in %s tracker"%(self.drive.name),extra=log.tcc_status())
             self.end()
         except Exception as error:
             msg = "Set tilt failed on %s drive tracker for tilt %f"%(self.drive.name,tilt)
             logger.error(msg,extra=log.tcc_status(),exc_info=True)
-            sleep(2)
+            self._back_off()
+        else:
+            self._setpoint = tilt
+            self._backoff = config.tracking.retry_backoff
     
     def slew(self):
         while not self.on_target():
@@ -112,13 +150,12 @@ class BaseTracker(Thread):
                 self.end()
                 break
             elif self.drive.active():
-                sleep(5)
+                self._wait(until_idle=True,timeout=self._arrival_time())
                 continue
             else:
                 dt = self.drive_time()
                 date = eph.now() + dt*eph.second
-                self.coords.compute(date)
-                self.set_tilts(getattr(self.coords,self.nsew))
+                self.set_tilts(self._target(date))
                         
     def track(self):
         while not self._stop.is_set():
@@ -126,52 +163,145 @@ class BaseTracker(Thread):
                 logger.error("%s drive in error state"%(self.drive.name),extra=log.tcc_status())
                 self.end()
                 break
-            elif self.drive.active() or self.on_target():
-                sleep(5)
+            elif self.drive.active():
+                self._wait(until_idle=True,timeout=self._arrival_time())
+                continue
+            elif self.on_target():
+                self._wait(until_idle=False,timeout=self._drift_time())
                 continue
             else:
                 logger.info("Updating tracking position for %s drive"%self.drive.name,
                             extra=log.tcc_status())
-                pt = fmin(self.__mpd,[0.0,],disp=False)[0]
+                pt = self.lead_time()
                 date = eph.now() + pt*eph.second
-                self.coords.compute(date)
-                self.set_tilts(getattr(self.coords,self.nsew))
+                self.set_tilts(self._target(date))
                 
+    def _plan(self,date,count):
+        """Plan the next count streaming setpoints after date.
+
+        Notes: Setpoints are spaced along the source trajectory so that
+        consecutive setpoints differ by the larger of the tolerance and
+        the drive's minimum step. The telescope must sit on setpoint k
+        while the source is within half a step of it, so each setpoint
+        is sent early enough to arrive by the midpoint between its
+        source time and the previous one, plus handoff_margin.
+
+        Returns: list of (send date, tilt, source date)
+        """
+        s = config.tracking
+        step = max(self.tolerance,self.drive.minimum_step(self._target(date)))
+        dates = [float(date)]
+        for ii in range(count):
+            dt = lead_time(self.table,self.nsew,step,date=dates[-1],
+                           span=s.solver_span,iterations=s.solver_iterations,
+                           precision=s.solver_precision,max_time=s.max_lead_time)
+            dates.append(dates[-1] + dt*eph.second)
+        tilts = self.table.value(self.nsew,dates)
+        plan = []
+        for ii in range(1,count+1):
+            slew = self.drive.slew_time(abs(tilts[ii]-tilts[ii-1])) + s.handoff_margin
+            send = (dates[ii-1]+dates[ii])/2 - slew*eph.second
+            plan.append((send,tilts[ii],dates[ii]))
+        return plan
+
+    def _stream_start(self):
+        """Date from which to plan setpoints: now, or when the source
+        will reach the telescope if the telescope is ahead of it."""
+        s = config.tracking
+        now = eph.now()
+        model = LocalTrajectory(self.table,self.nsew,now,s.solver_span)
+        ahead = self._max_tilt_offset(model.x) - model.x
+        if ahead*model.v <= 0:
+            return now
+        dt = lead_time(self.table,self.nsew,abs(ahead),date=now,
+                       span=s.solver_span,iterations=s.solver_iterations,
+                       precision=s.solver_precision,max_time=s.max_lead_time)
+        return now + dt*eph.second
+
+    def stream(self):
+        """Track by streaming planned setpoints to the drive.
+
+        Notes: Unlike track(), the next setpoint is sent before the
+        source leaves the tolerance of the current one, so the drive is
+        re-pointed in small steps while the source stays on target.
+        Each batch is planned from no earlier than _stream_start(), so
+        a tracker that has fallen behind does not replay old setpoints.
+        Setpoints within the drive's minimum step of the last one sent,
+        or of the telescope if none has been, are skipped (e.g. for a
+        source that does not move).
+        """
+        plan = deque()
+        date = self._stream_start()
+        while not self._stop.is_set():
+            if self.drive.has_error():
+                logger.error("%s drive in error state"%(self.drive.name),extra=log.tcc_status())
+                self.end()
+                break
+            if not plan:
+                date = max(float(date),float(self._stream_start()))
+                plan.extend(self._plan(date,config.tracking.lookahead))
+                date = plan[-1][2]
+            now = eph.now()
+            # drop setpoints that are already due to be replaced
+            while len(plan) > 1 and plan[1][0] <= now:
+                plan.popleft()
+            send,tilt,_ = plan[0]
+            wait = (send-now)/eph.second
+            if wait > 0:
+                self._wait(until_idle=False,timeout=wait)
+                if self._stop.is_set() or self.drive.has_error():
+                    continue
+            self.on_target()
+            plan.popleft()
+            last = self._setpoint
+            if last is None:
+                last = self._max_tilt_offset(tilt)
+            if abs(tilt-last) < self.drive.minimum_step(tilt):
+                continue
+            self.set_tilts(tilt)
+
     def run(self):
         self.slew()
-        if self._track:
+        if not self._track:
+            return
+        if config.tracking.mode == STREAMING:
+            self.stream()
+        else:
             self.track()
             
     def end(self):
         logger.info("Ending %s drive track"%(self.drive.name),extra=log.tcc_status())
         self._stop.set()
-        sleep(2)
+        self.drive.wake()
+        if current_thread() is not self and self.is_alive():
+            # let the tracker loop exit so it cannot re-drive after the stop
+            self.join(config.tracking.end_timeout)
         self.drive.stop()
         
 
 class NSTracker(BaseTracker):
-    def __init__(self, drive, coords,track,stop):
+    def __init__(self, drive, table,track,stop):
         rate = config.ns_drive.east_rate
         tolerance = config.ns_drive.tolerance
-        BaseTracker.__init__(self, drive, coords, "ns", rate, tolerance, track,stop)
+        BaseTracker.__init__(self, drive, table, "ns", rate, tolerance, track,stop)
 
 class MDTracker(BaseTracker):
-    def __init__(self, drive, coords,track,stop):
+    def __init__(self, drive, table,track,stop):
         rate = config.md_drive.east_rate
         tolerance = config.md_drive.tolerance
-        BaseTracker.__init__(self, drive, coords, "ew", rate, tolerance, track,stop)
+        BaseTracker.__init__(self, drive, table, "ew", rate, tolerance, track,stop)
 
 class Tracker(object):
-    def __init__(self,ns_drive,md_drive,coords,track=True):
+    def __init__(self,ns_drive,md_drive,table,track=True):
         stop = Event()
-        self.md_tracker = MDTracker(md_drive,coords.new_instance(), track, stop)
-        self.ns_tracker = NSTracker(ns_drive,coords.new_instance(), track, stop)
+        self.md_tracker = MDTracker(md_drive,table, track, stop)
+        self.ns_tracker = NSTracker(ns_drive,table, track, stop)
         self.md_tracker.start()
         self.ns_tracker.start()
         
     def end(self):
-        self.md_tracker.end()
-        self.ns_tracker.end()
+        fan_out({"md":self.md_tracker.end,"ns":self.ns_tracker.end},
+                config.controller.drive_deadline)
         self.md_tracker.join()
         self.ns_tracker.join()
         
@@ -188,23 +318,50 @@ class TelescopeController(object):
         self.current_track = None
         self.ns_drive = NSDriveInterface()
         self.md_drive = MDDriveInterface()
+        for drive,dc in [(self.ns_drive,config.ns_drive),(self.md_drive,config.md_drive)]:
+            if dc.poll_interval > 0:
+                drive.start_polling(dc.poll_interval,dc.poll_max_failures)
         self.coordinates = None
+        self.track_table = None
+        # serialises replacing the current track between the TCC
+        # server and the observation queue runner
+        self.observe_lock = RLock()
+        self.queue = ObservationQueue(self)
+
+    def _both_drives(self,method_name):
+        """Call a method on both drives concurrently."""
+        return fan_out({
+                "ns":getattr(self.ns_drive,method_name),
+                "md":getattr(self.md_drive,method_name)},
+                       config.controller.drive_deadline)
 
     def clean_up(self):
-        self.ns_drive.clean_up()
-        self.md_drive.clean_up()
+        self.queue.stop()
+        self._both_drives("clean_up")
 
     def stop(self):
         logger.info("Ending tracks and stopping telescope",extra=log.tcc_status())
+        self.queue.stop()
         self.end_current_track()
-        self.ns_drive.stop()
-        self.md_drive.stop()
+        self._both_drives("stop")
         
+    @locked_method("observe_lock")
     def observe(self,coordinates,track=True):
+        t = config.tracking
+        table = TrackTable(coordinates,t.table_duration,t.table_step,
+                           t.table_knot_spacing,t.table_margin)
         self.coordinates = coordinates
+        self.track_table = table
         self.end_current_track()
-        self.current_track = Tracker(self.ns_drive,self.md_drive,coordinates,track=track)
+        self.current_track = Tracker(self.ns_drive,self.md_drive,table,track=track)
         
+    def queue_observation(self,coordinates,dwell,start=None,end=None,track=True,name=None):
+        """Add an observation to the queue and start executing the queue."""
+        observation = self.queue.add(coordinates,dwell,start,end,track,name)
+        self.queue.start()
+        return observation
+
+    @locked_method("observe_lock")
     def end_current_track(self):
         if self.current_track:
             logger.info("Ending current track",extra=log.tcc_status())
@@ -213,6 +370,9 @@ class TelescopeController(object):
             except Exception as error:
                 logger.error("Exception caught while attempting to end the current track",
                              extra=log.tcc_status(),exc_info=True)
+                if isinstance(error,FanOutError):
+                    logger.error("Underlying errors:\n%s"%error.format_tracebacks(),
+                                 extra=log.tcc_status())
             finally:
                 self.current_track = None
     
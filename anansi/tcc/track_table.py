@@ -0,0 +1,119 @@
+from threading import Lock
+import logging
+import numpy as np
+import ephem as eph
+from anansi.coords import hadec_to_nsew_array,nsew_to_hadec_array,hadec_to_azel_array
+from anansi import log
+logger = logging.getLogger('anansi')
+
+# sidereal angle swept per second of UT (radians)
+SIDEREAL_RATE = 2*np.pi*1.00273790935/86400.0
+
+TRACK_COLUMNS = ["ns","ew","ha","dec","ra","lst","alt","az","a_ra","a_dec"]
+
+
+class TrackTable(object):
+    """Precomputed positions of a source on a regular time grid.
+
+    Notes: The coordinates are computed with ephem only at knots
+    knot_spacing seconds apart. The apparent RA and Dec are
+    interpolated between knots onto a grid of step seconds, local
+    sidereal time is advanced analytically from the first knot, and
+    HA, NS/EW and Alt/Az are then evaluated for the whole grid in one
+    vectorised pass. Alt/Az are geometric, without refraction.
+
+    Queries interpolate on the grid. A query outside the table, or
+    within margin seconds of its end, rebuilds the table from the
+    earliest requested time, so callers never see a stale table.
+
+    Args:
+    coords -- coordinates object from anansi.tcc.coordinates
+    duration -- seconds covered by the table
+    step -- grid spacing in seconds
+    knot_spacing -- seconds between ephem evaluations
+    margin -- seconds before the end of the table at which it is extended
+    """
+    def __init__(self,coords,duration=14400.0,step=10.0,knot_spacing=600.0,margin=600.0):
+        self.coords = coords.new_instance()
+        self.duration = duration
+        self.step = step
+        self.knot_spacing = knot_spacing
+        self.margin = margin
+        self.epoch = eph.J2000
+        self.builds = 0
+        self._lock = Lock()
+        self._table = None
+        self.build()
+
+    def build(self,start=None,duration=None):
+        """Compute the table from start (an ephem date, default now)."""
+        start = float(eph.now()) if start is None else float(start)
+        duration = self.duration if duration is None else duration
+        knot_times = np.arange(0.0,duration+self.knot_spacing,self.knot_spacing)
+        knots = np.empty((len(knot_times),4))
+        lst0 = None
+        for ii,t in enumerate(knot_times):
+            self.coords.compute(eph.Date(start + t*eph.second))
+            if lst0 is None:
+                lst0 = float(self.coords.lst)
+            knots[ii] = (float(self.coords.ns),float(self.coords.ew),
+                         float(self.coords.a_ra),float(self.coords.a_dec))
+        self.epoch = getattr(self.coords,"_epoch",eph.J2000)
+        # HA/Dec are taken from the knot NS/EW through the same telescope
+        # model used for the grid, so the grid reproduces ephem's NS/EW
+        knot_ha,knot_dec = nsew_to_hadec_array(knots[:,0],knots[:,1])
+        # apparent RA consistent with the analytic sidereal time
+        knot_ra = np.unwrap(lst0 + SIDEREAL_RATE*knot_times - knot_ha)
+        t = np.arange(0.0,duration+self.step,self.step)
+        columns = {}
+        columns["ra"] = np.interp(t,knot_times,knot_ra)
+        columns["dec"] = np.interp(t,knot_times,knot_dec)
+        columns["a_ra"] = np.interp(t,knot_times,np.unwrap(knots[:,2]))
+        columns["a_dec"] = np.interp(t,knot_times,knots[:,3])
+        columns["lst"] = lst0 + SIDEREAL_RATE*t
+        columns["ha"] = columns["lst"] - columns["ra"]
+        columns["ns"],columns["ew"] = hadec_to_nsew_array(columns["ha"],columns["dec"])
+        columns["az"],columns["alt"] = hadec_to_azel_array(columns["ha"],columns["dec"])
+        self._table = (start,start+duration*eph.second,t,columns)
+        self.builds += 1
+        logger.debug("Built %d point track table from %s"%(len(t),eph.Date(start)),
+                     extra=log.tcc_status())
+
+    def _covering(self,dates):
+        """Return a table covering dates, extending it if required."""
+        first,last = dates.min(),dates.max()
+        with self._lock:
+            start,end,_,_ = self._table
+            if first < start or last > end - self.margin*eph.second:
+                span = (last-first)/eph.second
+                self.build(first,max(self.duration,span+2*self.margin))
+            return self._table
+
+    def values(self,names,dates=None):
+        """Interpolate columns at the given ephem dates (default now).
+
+        Returns: list of arrays (or floats for a scalar date), one per name
+        """
+        if dates is None:
+            dates = eph.now()
+        scalar = np.ndim(dates) == 0
+        dates = np.atleast_1d(np.asarray(dates,dtype="float64"))
+        start,_,t,columns = self._covering(dates)
+        offsets = (dates-start)/eph.second
+        results = []
+        for name in names:
+            value = np.interp(offsets,t,columns[name])
+            if name in ("ra","lst","a_ra","az"):
+                value = np.mod(value,2*np.pi)
+            elif name == "ha":
+                value = np.mod(value+np.pi,2*np.pi)-np.pi
+            results.append(float(value[0]) if scalar else value)
+        return results
+
+    def value(self,name,dates=None):
+        """Interpolate a single column, e.g. table.value("ns")."""
+        return self.values([name],dates)[0]
+
+    def position(self,date=None):
+        """Return a dict of every column at a single date."""
+        return dict(zip(TRACK_COLUMNS,self.values(TRACK_COLUMNS,date)))
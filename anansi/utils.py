@@ -4,7 +4,14 @@ import ctypes as C
 from struct import unpack,pack
 from lxml import etree
 from numpy import pi
-from time import sleep
+from time import sleep,time
+from traceback import format_exc
+
+try:
+    from monotonic import monotonic
+except ImportError:
+    # wall clock fallback; only used for measuring short intervals
+    monotonic = time
  
 class CustomTimer(_Timer):
     def __init__(self,interval,func,*args,**kwargs):
@@ -44,6 +51,77 @@ class RepeatTimer(Thread):
         if self._timer is not None:
             self._timer.cancel()
 
+class FanOutError(Exception):
+    """Raised by fan_out when any call fails or misses the deadline.
+
+    Notes: The message names each failed call and the type and
+    message of its exception, so callers that only report str(error)
+    still show the underlying errors.
+
+    Args:
+    errors -- dict of label to exception for the failed calls
+    results -- dict of label to return value for the successful calls
+    tracebacks -- dict of label to formatted traceback for the failed calls
+    """
+    def __init__(self,errors,results,tracebacks=None):
+        msg = "; ".join("%s: %s: %s"%(label,type(error).__name__,error)
+                        for label,error in sorted(errors.items()))
+        super(FanOutError,self).__init__(msg)
+        self.errors = errors
+        self.results = results
+        self.tracebacks = tracebacks or {}
+
+    def format_tracebacks(self):
+        """Tracebacks of the underlying errors, labelled by call."""
+        return "\n".join("%s: %s"%(label,self.tracebacks.get(label,"%r\n"%error))
+                         for label,error in sorted(self.errors.items()))
+
+
+def fan_out(calls,timeout=None):
+    """Run calls concurrently and wait for all of them.
+
+    Notes: Each call runs in its own daemon thread, so a call still
+    blocked at the deadline does not stop the caller returning (or
+    the process exiting). The total wait is bounded by timeout rather
+    than the sum of the individual call times.
+
+    Args:
+    calls -- dict of label to callable taking no arguments
+    timeout -- overall deadline in seconds (None to wait indefinitely)
+
+    Returns: dict of label to return value
+
+    Raises: FanOutError if any call raised or was still running at
+    the deadline
+    """
+    results = {}
+    errors = {}
+    tracebacks = {}
+    def run(label,func):
+        try:
+            results[label] = func()
+        except Exception as error:
+            tracebacks[label] = format_exc()
+            errors[label] = error
+    threads = []
+    for label,func in calls.items():
+        thread = Thread(target=run,args=(label,func),name="fan out: %s"%label)
+        thread.daemon = True
+        thread.start()
+        threads.append((label,thread))
+    deadline = None if timeout is None else monotonic() + timeout
+    for label,thread in threads:
+        if deadline is None:
+            thread.join()
+        else:
+            thread.join(max(deadline-monotonic(),0))
+        if thread.is_alive():
+            errors[label] = Exception("Timed out after %.1f seconds"%timeout)
+    if errors:
+        raise FanOutError(dict(errors),dict(results),dict(tracebacks))
+    return results
+
+
 class NestedDict(dict):
     def __missing__(self, key):
         self[key] = NestedDict()
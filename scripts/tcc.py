@@ -1,19 +1,29 @@
 from time import sleep
 from anansi import args
 from anansi.config import config,update_config_from_args
+from anansi.decorators import lock_stats
 from anansi.tcc.interface_server import TCCServer
 from anansi.tcc.status_server import StatusServer
+from anansi.tcc.status_broadcast import StatusBroadcaster
 from anansi.tcc.telescope_controller import TelescopeController
 import logging
 
 def main():
+    lock_stats.enable(config.diagnostics.lock_statistics)
     controller = TelescopeController()
     tcc = config.tcc_server
     status = config.status_server
-    interface_server = TCCServer(tcc.ip,tcc.port,controller)
-    status_server = StatusServer(status.ip,status.port,controller)
+    interface_server = TCCServer(tcc.ip,tcc.port,controller,tcc.timeout)
+    status_server = StatusServer(status.ip,status.port,controller,
+                                 status.workers,status.queue_depth)
     interface_server.start()
     status_server.start()
+    broadcast = config.status_broadcast
+    if broadcast.enabled:
+        broadcaster = StatusBroadcaster(status_server,broadcast.ip,broadcast.port,
+                                        broadcast.interval,broadcast.ttl,
+                                        broadcast.max_age)
+        broadcaster.start()
     logging.getLogger('anansi').info("Started all TCC components")
     logging.getLogger('anansi').info("Awaiting TCC inputs...")
     while not interface_server.shutdown_requested.is_set():
@@ -0,0 +1,66 @@
+try:
+    import trollius as asyncio
+    from trollius import From,Return
+except ImportError:
+    asyncio = None
+from anansi.comms import xml_message_complete
+
+PING = "<tcc_request><server_command><command>ping</command></server_command></tcc_request>"
+
+def _run(loop,server,client_coroutine):
+    loop.run_until_complete(server.start())
+    try:
+        return loop.run_until_complete(client_coroutine(server.port))
+    finally:
+        server.shutdown()
+
+def test_frame_echo_round_trip():
+    if asyncio is None:
+        print "trollius not installed, skipping"
+        return
+    from anansi.aio_comms import AsyncTCPServer,AsyncFrameClient
+
+    class EchoServer(AsyncTCPServer):
+        def respond(self,msg):
+            return msg
+
+    loop = asyncio.new_event_loop()
+    server = EchoServer("127.0.0.1",0,timeout=2.0,loop=loop)
+
+    @asyncio.coroutine
+    def exchange(port):
+        client = AsyncFrameClient("NST_SWIN","127.0.0.1",port,timeout=2.0,loop=loop)
+        yield From(client.send_command("U"))
+        header,data = yield From(client.receive_frame())
+        client.close()
+        raise Return((header,data))
+
+    header,data = _run(loop,server,exchange)
+    assert header["Command option"] == "U"
+    loop.close()
+
+def test_tcc_server_parses_command():
+    if asyncio is None:
+        print "trollius not installed, skipping"
+        return
+    from anansi.aio_comms import AsyncTCPClient
+    from anansi.tcc.aio_servers import AsyncTCCServer
+
+    loop = asyncio.new_event_loop()
+    server = AsyncTCCServer("127.0.0.1",0,None,timeout=2.0,loop=loop)
+
+    @asyncio.coroutine
+    def exchange(port):
+        client = AsyncTCPClient("127.0.0.1",port,timeout=2.0,loop=loop)
+        yield From(client.send(PING))
+        reply = yield From(client.receive())
+        client.close()
+        raise Return(reply)
+
+    reply = _run(loop,server,exchange)
+    assert "<success>TCC command passed</success>" in reply
+    loop.close()
+
+if __name__ == "__main__":
+    test_frame_echo_round_trip()
+    test_tcc_server_parses_command()
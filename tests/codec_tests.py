@@ -0,0 +1,205 @@
+from struct import pack,unpack
+import ctypes as C
+from timeit import timeit
+import numpy as np
+from anansi import codec
+
+NODE = "NST_SWIN"
+
+def _frame(code,data=""):
+    header,data = codec.simple_encoder(NODE,code,data)
+    return header+data
+
+def test_header_matches_simple_decoder():
+    frame_codec = codec.FrameCodec(NODE)
+    decoder,size = codec.gen_header_decoder(NODE)
+    header,_ = frame_codec.encode("U","x"*300)
+    assert frame_codec.header_size == size
+    assert frame_codec.decode_header(header) == codec.simple_decoder(header,decoder)
+
+def test_position_matches_simple_decoder():
+    decoder = [
+        ("east_status",lambda x: ord(x),1),
+        ("east_count",codec.it_unpack,3),
+        ("west_status",lambda x: ord(x),1),
+        ("west_count",codec.it_unpack,3)]
+    for east,west in [(0,0),(32768,40000),(8388608,16777215)]:
+        data = pack("B",112) + codec.it_pack(east) + pack("B",113) + codec.it_pack(west)
+        assert codec.decode_position(data) == codec.simple_decoder(data,decoder)
+        assert codec.encode_position(112,east,113,west) == data
+
+def test_split_frames_keeps_partial_frame():
+    frame_codec = codec.FrameCodec(NODE)
+    position = codec.encode_position(112,100,112,200)
+    buf = _frame("S",pack("B",0)) + _frame("U",position) + _frame("I",pack("B",13))
+    partial = _frame("U",position)[:-3]
+    frames,offset = frame_codec.split_frames(bytearray(buf+partial))
+    assert [header["Command option"] for header,_ in frames] == ["S","U","I"]
+    assert codec.decode_position(frames[1][1])["west_count"] == 200
+    assert codec.decode_status(frames[2][1]) == 13
+    assert offset == len(buf)
+
+def test_frame_buffer_reassembles_short_reads():
+    frame_codec = codec.FrameCodec(NODE)
+    frame_buffer = codec.FrameBuffer(frame_codec,size=16)
+    stream = "".join(_frame("U",codec.encode_position(112,ii,112,ii+1)) for ii in range(50))
+    frames = []
+    for ii in range(0,len(stream),7):
+        frame_buffer.feed(stream[ii:ii+7])
+        frames.extend(frame_buffer.frames())
+    assert len(frame_buffer) == 0
+    assert [codec.decode_position(data)["east_count"] for _,data in frames] == range(50)
+
+def test_count_arrays_match_scalar_codec():
+    counts = np.random.randint(0,1<<24,size=1000)
+    packed = codec.it_pack_array(counts)
+    assert packed == "".join(codec.it_pack(int(ii)) for ii in counts)
+    assert (codec.it_unpack_array(packed) == counts).all()
+
+def test_position_arrays_match_scalar_codec():
+    east = np.random.randint(0,1<<24,size=100)
+    west = np.random.randint(0,1<<24,size=100)
+    data = codec.encode_position_array(112,east,113,west)
+    assert data == "".join(codec.encode_position(112,e,113,w) for e,w in zip(east,west))
+    decoded = codec.decode_position_array(data)
+    assert (decoded.east_count == east).all()
+    assert (decoded.west_count == west).all()
+    assert (decoded.west_status == 113).all()
+
+# Bit-loop IEEE754 codecs used by anansi.codec before FLOAT_STRUCT, kept
+# as the reference implementation for the struct based codecs.
+def _ft_unpack_loop(data):
+    """IEEE754 float data unpacker
+
+    :param data: a byte string of length 4
+    :return: floating point representation of data
+    """
+    bits = 32
+    expbits = 8
+    shift = C.c_longlong()
+    result = C.c_longdouble()
+    data = unpack("BBBB",data)
+    buf = (C.c_ubyte*4)(*data)
+    i = buf[0]<<24 | buf[1]<<16 | buf[2]<<8 | buf[3]<<0
+    significandbits = bits - expbits - 1
+    if (i==0):
+        return 0.0;
+    result.value = (i&((1<<significandbits)-1)) 
+    result.value /= (1<<significandbits) 
+    result.value += 1.0 
+    bias = (1<<(expbits-1)) - 1
+    shift.value = ((i>>significandbits)&((1<<expbits)-1)) - bias;
+    while(shift.value > 0):
+        result.value *= 2.0
+        shift.value-=1
+    while(shift.value < 0):
+        result.value /= 2.0
+        shift.value+=1
+    result.value *= -1.0 if (i>>(bits-1))&1 else 1.0
+    return result.value
+
+
+def _ft_pack_loop(value):
+    """IEEE754 float data packer
+
+    :param value: a floating point number
+    :return: an 4 bytes string 
+    """
+    bits = 32
+    expbits = 8
+    significandbits = C.c_uint(bits - expbits - 1)
+    value = C.c_longdouble(value)
+    shift = C.c_int()
+    output = (C.c_ubyte*4)(0,0,0,0)
+
+    if (value.value == 0.0):
+        return output
+
+    if (value.value < 0):
+        sign = 1
+        fnorm = -value.value
+    else:
+        sign = 0
+        fnorm = value.value
+
+    shift.value = 0
+    while (fnorm >= 2.0):
+        fnorm/=2.0
+        shift.value+=1
+    while (fnorm < 1.0):
+        fnorm *= 2.0
+        shift.value -= 1
+    fnorm = fnorm - 1.0
+    
+    significand = C.c_longlong(long(fnorm * ((1<<significandbits.value) + 0.5)))
+    exp = shift.value + ((1<<(expbits-1)) - 1)
+    result = C.c_ulonglong((sign<<(bits-1)) | (exp<<(bits-expbits-1)) | significand.value)
+    output[0] = result.value >> 24
+    output[1] = result.value >> 16
+    output[2] = result.value >> 8
+    output[3] = result.value >> 0
+    return output
+
+
+def _normal_float_patterns(n=2000):
+    # finite, normalised single precision bit patterns
+    exponents = np.random.randint(1,255,size=n).astype(np.uint32)
+    mantissas = np.random.randint(0,1<<23,size=n).astype(np.uint32)
+    signs = np.random.randint(0,2,size=n).astype(np.uint32)
+    patterns = (signs<<31) | (exponents<<23) | mantissas
+    return [pack(">I",int(ii)) for ii in patterns]
+
+def test_ft_unpack_matches_bit_loop():
+    for data in _normal_float_patterns() + ["\x00"*4]:
+        assert codec.ft_unpack(data) == _ft_unpack_loop(data)
+
+def test_ft_pack_matches_bit_loop():
+    for data in _normal_float_patterns():
+        value = codec.ft_unpack(data)
+        assert codec.ft_pack(value) == "".join(map(chr,_ft_pack_loop(value)))
+    # values not representable in single precision agree to within one ulp
+    for value in np.random.uniform(-1e4,1e4,size=1000):
+        fast = unpack(">i",codec.ft_pack(value))[0]
+        loop = unpack(">i","".join(map(chr,_ft_pack_loop(value))))[0]
+        assert abs(fast-loop) <= 1
+
+def test_ft_pack_overflow():
+    assert codec.ft_pack(3.4028234663852886e38) == "\x7f\x7f\xff\xff"
+    assert codec.ft_pack(float("inf")) == "\x7f\x80\x00\x00"
+    try:
+        codec.ft_pack(1e39)
+    except OverflowError:
+        pass
+    else:
+        raise AssertionError("ft_pack accepted a value above FLT_MAX")
+
+def test_float_arrays_match_scalar_codec():
+    patterns = _normal_float_patterns()
+    data = "".join(patterns)
+    values = codec.ft_unpack_array(data)
+    assert list(values) == [codec.ft_unpack(ii) for ii in patterns]
+    assert codec.ft_pack_array(values) == data
+
+def benchmark():
+    data = _normal_float_patterns(1)[0]
+    block = "".join(_normal_float_patterns(10000))
+    n = 10000
+    print "ft_unpack (bit loop): %8.2f us"%(1e6*timeit(lambda: _ft_unpack_loop(data),number=n)/n)
+    print "ft_unpack (struct):   %8.2f us"%(1e6*timeit(lambda: codec.ft_unpack(data),number=n)/n)
+    value = codec.ft_unpack(data)
+    print "ft_pack (bit loop):   %8.2f us"%(1e6*timeit(lambda: _ft_pack_loop(value),number=n)/n)
+    print "ft_pack (struct):     %8.2f us"%(1e6*timeit(lambda: codec.ft_pack(value),number=n)/n)
+    print "ft_unpack_array:      %8.2f us per 10000"%(1e6*timeit(lambda: codec.ft_unpack_array(block),number=100)/100)
+
+if __name__ == "__main__":
+    test_header_matches_simple_decoder()
+    test_position_matches_simple_decoder()
+    test_split_frames_keeps_partial_frame()
+    test_frame_buffer_reassembles_short_reads()
+    test_count_arrays_match_scalar_codec()
+    test_position_arrays_match_scalar_codec()
+    test_ft_unpack_matches_bit_loop()
+    test_ft_pack_matches_bit_loop()
+    test_ft_pack_overflow()
+    test_float_arrays_match_scalar_codec()
+    benchmark()
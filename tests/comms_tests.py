@@ -0,0 +1,232 @@
+import socket
+from time import sleep
+from threading import Event
+from anansi.comms import (TCPServer,TCPClient,BaseHandler,RequestStats,SocketError,
+                          xml_message_complete)
+
+def test_request_stats():
+    stats = RequestStats()
+    assert stats.as_dict()["mean_latency"] == 0.0
+    stats.record(0.5,1.0)
+    stats.record(1.5,3.0)
+    stats.record_rejected()
+    summary = stats.as_dict()
+    assert summary["handled"] == 2
+    assert summary["rejected"] == 1
+    assert summary["mean_latency"] == 2.0
+    assert summary["max_latency"] == 3.0
+    assert summary["mean_queue_wait"] == 1.0
+    assert summary["max_queue_wait"] == 1.5
+    stats.reset()
+    assert stats.as_dict()["handled"] == 0
+
+def _wait_for(test,timeout=5.0):
+    for ii in range(int(timeout/0.01)):
+        if test():
+            return True
+        sleep(0.01)
+    return test()
+
+def test_worker_pool_rejects_when_full():
+    started = Event()
+    release = Event()
+
+    class BlockingHandler(BaseHandler):
+        def handle(self):
+            started.set()
+            release.wait(5.0)
+            self.request.sendall("ok")
+
+    server = TCPServer("127.0.0.1",0,BlockingHandler,workers=1,queue_depth=1)
+    port = server.server_address[1]
+    server.start()
+    clients = []
+    try:
+        # first request occupies the only worker
+        clients.append(socket.create_connection(("127.0.0.1",port),5.0))
+        assert started.wait(5.0)
+        # second waits in the queue
+        clients.append(socket.create_connection(("127.0.0.1",port),5.0))
+        assert _wait_for(lambda: server.queue_size() == 1)
+        # third finds the queue full and is closed without a reply
+        rejected = socket.create_connection(("127.0.0.1",port),5.0)
+        assert _wait_for(lambda: server.stats.rejected == 1)
+        assert rejected.recv(16) == ""
+        rejected.close()
+        release.set()
+        for client in clients:
+            assert client.recv(16) == "ok"
+        assert _wait_for(lambda: server.stats.handled == 2)
+    finally:
+        release.set()
+        for client in clients:
+            client.close()
+        server.shutdown()
+    summary = server.stats.as_dict()
+    assert summary["rejected"] == 1
+    assert summary["max_queue_wait"] > 0
+    assert summary["max_latency"] >= summary["mean_latency"] > 0
+
+def test_default_queue_depth_rejects_when_workers_busy():
+    started = Event()
+    release = Event()
+
+    class BlockingHandler(BaseHandler):
+        def handle(self):
+            started.set()
+            release.wait(5.0)
+            self.request.sendall("ok")
+
+    server = TCPServer("127.0.0.1",0,BlockingHandler,workers=1)
+    server.start()
+    client = None
+    try:
+        client = socket.create_connection(("127.0.0.1",server.port),5.0)
+        assert started.wait(5.0)
+        rejected = socket.create_connection(("127.0.0.1",server.port),5.0)
+        assert _wait_for(lambda: server.stats.rejected == 1)
+        assert rejected.recv(16) == ""
+        rejected.close()
+        release.set()
+        assert client.recv(16) == "ok"
+        # the worker is free again, so the next request is handled
+        assert _wait_for(lambda: server.stats.handled == 1)
+        # the worker frees its slot just after recording the request
+        sleep(0.2)
+        again = socket.create_connection(("127.0.0.1",server.port),5.0)
+        assert again.recv(16) == "ok"
+        again.close()
+        assert server.stats.rejected == 1
+    finally:
+        release.set()
+        if client is not None:
+            client.close()
+        server.shutdown()
+
+def test_serial_server():
+    class EchoHandler(BaseHandler):
+        def handle(self):
+            self.request.sendall(self.recvall())
+
+    server = TCPServer("127.0.0.1",0,EchoHandler)
+    port = server.server_address[1]
+    server.start()
+    try:
+        client = socket.create_connection(("127.0.0.1",port),5.0)
+        client.sendall("ping")
+        assert client.recv(16) == "ping"
+        client.close()
+        assert _wait_for(lambda: server.stats.handled == 1)
+    finally:
+        server.shutdown()
+    assert server.queue_size() == 0
+
+def _recvall_server(results,timeout):
+    class XMLHandler(BaseHandler):
+        def handle(self):
+            try:
+                results.append(self.recvall(xml_message_complete("tcc_request"),timeout))
+            except SocketError as error:
+                results.append(error)
+                return
+            self.request.sendall("done")
+
+    server = TCPServer("127.0.0.1",0,XMLHandler)
+    server.start()
+    return server
+
+def test_recvall_split_message():
+    results = []
+    server = _recvall_server(results,5.0)
+    try:
+        client = socket.create_connection(("127.0.0.1",server.port),5.0)
+        for part in ["<tcc_request><server_",
+                     "command><command>ping</command>",
+                     "</server_command></tcc_req",
+                     "uest>\n"]:
+            client.sendall(part)
+            sleep(0.05)
+        # the reply arrives without the client closing its side
+        assert client.recv(16) == "done"
+        client.close()
+    finally:
+        server.shutdown()
+    assert results == ["<tcc_request><server_command><command>ping</command>"
+                       "</server_command></tcc_request>\n"]
+
+def test_recvall_deadline():
+    results = []
+    server = _recvall_server(results,0.3)
+    try:
+        client = socket.create_connection(("127.0.0.1",server.port),5.0)
+        client.sendall("<tcc_request><server_command>")
+        # stall mid-message
+        assert _wait_for(lambda: results,timeout=2.0)
+        assert client.recv(16) == ""
+        client.close()
+    finally:
+        server.shutdown()
+    assert isinstance(results[0],SocketError)
+    assert "Timed out" in str(results[0])
+
+def _sending_server(payload):
+    class SendingHandler(BaseHandler):
+        def handle(self):
+            self.request.sendall(payload)
+            # hold the connection open until the client is done
+            self.request.recv(1)
+
+    server = TCPServer("127.0.0.1",0,SendingHandler)
+    server.start()
+    return server
+
+def _receive_all(receive,nbytes):
+    received = []
+    while sum(len(chunk) for chunk in received) < nbytes:
+        received.append(receive())
+    return "".join(received)
+
+def test_receive_into_partial_reads():
+    payload = "".join(chr(ii%256) for ii in range(1000))
+    server = _sending_server(payload)
+    try:
+        client = TCPClient("127.0.0.1",server.port,timeout=5.0)
+        buf = bytearray(1000)
+        view = memoryview(buf)
+        offset = 0
+        while offset < len(payload):
+            # read in small pieces into successive slices of the view
+            offset += client.receive_into(view[offset:],min(64,len(payload)-offset))
+        assert str(buf) == payload
+        client.send("x")
+        client.close()
+    finally:
+        server.shutdown()
+
+def test_receive_view_and_cap():
+    payload = "y"*300
+    server = _sending_server(payload)
+    try:
+        client = TCPClient("127.0.0.1",server.port,timeout=5.0,buffer_size=100)
+        sleep(0.1)
+        view = client.receive_view(1000)
+        assert isinstance(view,memoryview)
+        assert len(view) == 100
+        assert view.tobytes() == payload[:100]
+        # receive honours n beyond buffer_size
+        rest = _receive_all(lambda: client.receive(1000),200)
+        assert rest == payload[100:]
+        client.send("x")
+        client.close()
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test_request_stats()
+    test_worker_pool_rejects_when_full()
+    test_default_queue_depth_rejects_when_workers_busy()
+    test_serial_server()
+    test_recvall_split_message()
+    test_recvall_deadline()
+    test_receive_into_partial_reads()
+    test_receive_view_and_cap()
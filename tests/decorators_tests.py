@@ -0,0 +1,108 @@
+from threading import Lock,Thread,Event
+from time import sleep
+from anansi.decorators import (LockTiming,LockStatistics,LOCK_HISTOGRAM_BINS,
+                               lock_stats,locked_method,_timed_call)
+
+class Locked(object):
+    def __init__(self):
+        self._lock = Lock()
+
+    @locked_method("_lock")
+    def work(self,value):
+        return value
+
+    @locked_method("_lock")
+    def fail(self):
+        raise ValueError("failed")
+
+def test_lock_timing():
+    timing = LockTiming()
+    assert timing.as_dict()["mean"] == 0.0
+    for duration in [5e-6,0.5,100.0]:
+        timing.record(duration)
+    stats = timing.as_dict()
+    assert stats["count"] == 3
+    assert stats["max"] == 100.0
+    assert abs(stats["mean"] - (5e-6+0.5+100.0)/3) < 1e-9
+    assert stats["histogram"][0] == 1
+    assert stats["histogram"][LOCK_HISTOGRAM_BINS.index(1.0)] == 1
+    assert stats["histogram"][-1] == 1
+    assert sum(stats["histogram"]) == 3
+
+def test_lock_statistics():
+    stats = LockStatistics()
+    assert not stats.enabled
+    stats.record("Drive._lock","stop",0.001,0.5)
+    stats.record("Drive._lock","stop",0.003,1.5)
+    stats.record("Drive._lock","get_status",0.0,0.1)
+    summary = stats.as_dict()
+    assert sorted(summary["Drive._lock"]) == ["get_status","stop"]
+    stop = summary["Drive._lock"]["stop"]
+    assert stop["wait"]["count"] == 2
+    assert abs(stop["wait"]["mean"] - 0.002) < 1e-9
+    assert stop["hold"]["max"] == 1.5
+    assert "get_status" in stats.dump()
+    stats.reset()
+    assert stats.as_dict() == {}
+
+def test_timed_call_measures_wait_and_hold():
+    lock = Lock()
+    held = Event()
+    def hold():
+        with lock:
+            held.set()
+            sleep(0.1)
+    lock_stats.reset()
+    holder = Thread(target=hold)
+    holder.start()
+    held.wait(5.0)
+    assert _timed_call(lock,"test",lambda value: value,(3,),{}) == 3
+    holder.join()
+    timing = lock_stats.as_dict()["test"]["<lambda>"]
+    assert timing["wait"]["count"] == 1
+    assert timing["wait"]["max"] > 0.05
+    assert timing["hold"]["max"] < timing["wait"]["max"]
+    lock_stats.reset()
+
+def test_timed_call_releases_on_error():
+    lock = Lock()
+    def fail():
+        raise ValueError("failed")
+    lock_stats.reset()
+    try:
+        _timed_call(lock,"test",fail,(),{})
+    except ValueError:
+        pass
+    else:
+        assert False, "exception swallowed"
+    assert lock.acquire(False)
+    lock.release()
+    assert lock_stats.as_dict()["test"]["fail"]["hold"]["count"] == 1
+    lock_stats.reset()
+
+def test_locked_method_statistics():
+    locked = Locked()
+    lock_stats.reset()
+    lock_stats.enable()
+    try:
+        assert locked.work(4) == 4
+        try:
+            locked.fail()
+        except ValueError:
+            pass
+        summary = lock_stats.as_dict()["Locked._lock"]
+        assert summary["work"]["hold"]["count"] == 1
+        assert summary["fail"]["hold"]["count"] == 1
+    finally:
+        lock_stats.enable(False)
+        lock_stats.reset()
+    # nothing is recorded while disabled
+    locked.work(5)
+    assert lock_stats.as_dict() == {}
+
+if __name__ == "__main__":
+    test_lock_timing()
+    test_lock_statistics()
+    test_timed_call_measures_wait_and_hold()
+    test_timed_call_releases_on_error()
+    test_locked_method_statistics()
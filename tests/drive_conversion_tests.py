@@ -0,0 +1,46 @@
+import copy
+import numpy as np
+from anansi.config import config
+from anansi.tcc import drives
+
+def _drive(cls,drive_config):
+    dc = copy.copy(drive_config)
+    dc.poll_interval = 0
+    dc.speed_file = ""
+    drive = cls(dc)
+    drive.east_offset = 0.0012
+    drive.west_offset = -0.0007
+    return drive
+
+def _check_matches_scalar(drive,tilts):
+    east,west = drive.tilts_to_counts_array(tilts,-tilts)
+    assert [(e,w) for e,w in zip(east,west)] == [drive.tilts_to_counts(t,-t) for t in tilts]
+    east_tilts,west_tilts = drive.counts_to_tilts_array(east,west)
+    scalar = [drive.counts_to_tilts(e,w) for e,w in zip(east,west)]
+    assert np.allclose(east_tilts,[e for e,_ in scalar])
+    assert np.allclose(west_tilts,[w for _,w in scalar])
+
+def test_ns_arrays_match_scalar():
+    drive = _drive(drives.NSDriveInterface,config.ns_drive)
+    _check_matches_scalar(drive,np.linspace(-0.9,0.9,2001))
+
+def test_md_arrays_match_scalar():
+    drive = _drive(drives.MDDriveInterface,config.md_drive)
+    _check_matches_scalar(drive,np.linspace(-1.1,1.1,2001))
+
+def test_limits():
+    drive = _drive(drives.NSDriveInterface,config.ns_drive)
+    tilts = np.array([0.0,0.5,1.2,-0.3])
+    try:
+        drive.tilts_to_counts_array(tilts,tilts)
+    except drives.TiltLimitError as error:
+        assert error.arm == "east" and error.index == 2
+    else:
+        raise AssertionError("TiltLimitError not raised")
+    east,_ = drive.tilts_to_counts_array(tilts,tilts,check_limits=False)
+    assert list(drive.counts_in_limits(east)) == [True,True,False,True]
+
+if __name__ == "__main__":
+    test_ns_arrays_match_scalar()
+    test_md_arrays_match_scalar()
+    test_limits()
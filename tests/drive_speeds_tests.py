@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+from os.path import join,isfile
+from time import sleep
+import numpy as np
+from anansi.tcc.position_history import PositionHistory
+from anansi.tcc.drive_speeds import DriveSpeedEstimator,FAST,SLOW
+
+RATES = {"east":{FAST:0.001,SLOW:0.0005},"west":{FAST:0.001,SLOW:0.0005}}
+
+def _drive_history(rate,lag,distance,scaling=20000.0,step=0.25):
+    # arms sit still for lag seconds then move at rate until distance is covered
+    history = PositionHistory(size=1024)
+    for t in np.arange(0.0,lag+distance/rate+2.0,step):
+        tilt = min(max(t-lag,0.0)*rate,distance)
+        status = {"east_count":int(tilt*scaling),"west_count":0,
+                  "east_tilt":int(tilt*scaling)/scaling,"west_tilt":0.0,
+                  "east_status":112,"west_status":112}
+        history.append(t,status)
+    return history.last(1024)
+
+def test_estimator_learns_rate_and_lag():
+    estimator = DriveSpeedEstimator("ns",RATES)
+    records = _drive_history(rate=0.0015,lag=3.0,distance=0.05)
+    assert estimator.observe("east",FAST,0.0,records)
+    assert abs(estimator.rate("east") - 0.0015) < 0.00002
+    assert abs(estimator.lag("east") - 3.0) < 0.5
+    assert abs(estimator.slew_time("east",0.05) - (3.0+0.05/0.0015)) < 0.5
+    # arms that did not move teach nothing
+    assert not estimator.observe("west",FAST,0.0,records)
+    assert estimator.rate("west") == 0.001
+
+def test_truncated_history_is_ignored():
+    estimator = DriveSpeedEstimator("ns",RATES)
+    records = _drive_history(rate=0.0015,lag=3.0,distance=0.05)
+    # the buffer wrapped, keeping only the second half of the motion
+    assert not estimator.observe("east",FAST,0.0,records[len(records)//2:])
+    assert estimator.rate("east") == 0.001
+    assert estimator.lag("east") == 0.0
+    assert estimator.model["east"][FAST]["samples"] == 0
+
+def test_model_is_saved_off_thread():
+    directory = tempfile.mkdtemp()
+    try:
+        path = join(directory,"state","ns_speeds.json")
+        estimator = DriveSpeedEstimator("ns",RATES,path,save_interval=0.05)
+        estimator.observe("east",FAST,0.0,_drive_history(rate=0.0015,lag=3.0,distance=0.05))
+        estimator.request_save()
+        assert not isfile(path)
+        for ii in range(100):
+            if isfile(path):
+                break
+            sleep(0.05)
+        loaded = DriveSpeedEstimator("ns",RATES,path)
+        assert loaded.rate("east") == estimator.rate("east")
+        # later changes are written by flush without waiting for the timer
+        estimator.save_interval = 60.0
+        estimator.observe("east",FAST,0.0,_drive_history(rate=0.002,lag=3.0,distance=0.05))
+        estimator.request_save()
+        estimator.flush()
+        assert DriveSpeedEstimator("ns",RATES,path).rate("east") == estimator.rate("east")
+    finally:
+        shutil.rmtree(directory)
+
+def test_save_errors_are_logged():
+    directory = tempfile.mkdtemp()
+    try:
+        blocker = join(directory,"file")
+        open(blocker,"w").close()
+        estimator = DriveSpeedEstimator("ns",RATES,join(blocker,"ns_speeds.json"))
+        assert not estimator.save()
+        assert estimator._dirty
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_estimator_learns_rate_and_lag()
+    test_truncated_history_is_ignored()
+    test_model_is_saved_off_thread()
+    test_save_errors_are_logged()
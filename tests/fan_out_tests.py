@@ -0,0 +1,83 @@
+import logging
+from threading import RLock
+from time import sleep
+from anansi.utils import fan_out,FanOutError,monotonic
+from anansi.tcc.interface_server import TCCProtocol
+from anansi.tcc.telescope_controller import TelescopeController
+
+STOP = "<tcc_request><tcc_command><command>stop</command></tcc_command></tcc_request>"
+
+class DriveFault(Exception):
+    pass
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self,record):
+        self.messages.append(record.getMessage())
+
+def _fail(message):
+    def call():
+        raise DriveFault(message)
+    return call
+
+def test_results():
+    assert fan_out({"a":lambda: 1,"b":lambda: 2}) == {"a":1,"b":2}
+
+def test_deadline():
+    start = monotonic()
+    try:
+        fan_out({"slow":lambda: sleep(5.0),"fast":lambda: "done"},timeout=0.2)
+    except FanOutError as error:
+        assert monotonic() - start < 2.0
+        assert error.results == {"fast":"done"}
+        assert "Timed out" in str(error.errors["slow"])
+    else:
+        assert False, "no FanOutError raised"
+
+def test_errors_are_aggregated():
+    try:
+        fan_out({"ns":_fail("ns fault"),"md":_fail("md fault"),"ok":lambda: 3},timeout=5.0)
+    except FanOutError as error:
+        assert sorted(error.errors) == ["md","ns"]
+        assert error.results == {"ok":3}
+        assert isinstance(error.errors["ns"],DriveFault)
+        assert "ns: DriveFault: ns fault" in str(error)
+        assert "md: DriveFault: md fault" in str(error)
+        assert "raise DriveFault(message)" in error.format_tracebacks()
+    else:
+        assert False, "no FanOutError raised"
+
+class FailingController(object):
+    def stop(self):
+        fan_out({"ns":_fail("ns drive fault")})
+
+class FailingTrack(object):
+    def end(self):
+        fan_out({"md":_fail("md drive fault")})
+
+def test_drive_errors_are_reported():
+    handler = RecordingHandler()
+    logger = logging.getLogger('anansi')
+    logger.addHandler(handler)
+    try:
+        reply = TCCProtocol(FailingController()).respond(STOP)
+        assert "ns drive fault" in reply
+        controller = TelescopeController.__new__(TelescopeController)
+        controller.observe_lock = RLock()
+        controller.current_track = FailingTrack()
+        controller.end_current_track()
+        assert controller.current_track is None
+    finally:
+        logger.removeHandler(handler)
+    logged = "\n".join(handler.messages)
+    assert "ns drive fault" in logged
+    assert "md drive fault" in logged
+
+if __name__ == "__main__":
+    test_results()
+    test_deadline()
+    test_errors_are_aggregated()
+    test_drive_errors_are_reported()
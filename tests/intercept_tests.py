@@ -0,0 +1,52 @@
+import numpy as np
+import ephem as eph
+from anansi.tcc.coordinates import make_coordinates
+from anansi.tcc.track_table import TrackTable
+from anansi.tcc.intercept import intercept_time,lead_time
+
+def _table():
+    coords = make_coordinates("12:30:00","-45:00:00",system="equatorial")
+    return TrackTable(coords,duration=7200.0,step=10.0,knot_spacing=600.0,margin=600.0)
+
+def _slew_time(distance,rate=0.000727,lag=5.0):
+    return 0.0 if distance <= 0 else lag + distance/rate
+
+def test_intercept_time():
+    table = _table()
+    now = eph.now()
+    for name in ["ns","ew"]:
+        x = table.value(name,now)
+        for position in [x-0.3,x-0.01,x+0.01,x+0.3]:
+            t = intercept_time(table,name,position,_slew_time,date=now)
+            source = table.value(name,now+t*eph.second)
+            assert abs(_slew_time(abs(source-position)) - t) < 0.1,(name,position,t)
+
+def test_lead_time():
+    table = _table()
+    now = eph.now()
+    for name in ["ns","ew"]:
+        for tolerance in [0.0002,0.002]:
+            t = lead_time(table,name,tolerance,date=now)
+            x0,x1 = table.value(name,[now,now+t*eph.second])
+            assert abs(abs(x1-x0) - tolerance) < 1e-3*tolerance,(name,tolerance,t)
+
+def test_lead_time_from_position():
+    table = _table()
+    now = eph.now()
+    x = table.value("ew",now)
+    assert lead_time(table,"ew",0.0002,position=x+0.001,date=now) == 0.0
+    for position in [x-0.0001,x+0.0001]:
+        t = lead_time(table,"ew",0.0002,position=position,date=now)
+        source = table.value("ew",now+t*eph.second)
+        assert abs(abs(source-position) - 0.0002) < 1e-6,(position,t)
+
+def test_fixed_source_lead_time():
+    coords = make_coordinates(0.3,-0.2,system="nsew",units="radians")
+    table = TrackTable(coords,duration=7200.0)
+    assert lead_time(table,"ns",0.002,max_time=600.0) == 600.0
+
+if __name__ == "__main__":
+    test_intercept_time()
+    test_lead_time()
+    test_lead_time_from_position()
+    test_fixed_source_lead_time()
@@ -0,0 +1,126 @@
+from threading import Thread,RLock,Event
+from time import sleep
+import ephem as eph
+from anansi.utils import d2r
+from anansi.tcc.coordinates import make_coordinates
+from anansi.tcc.observation_queue import Observation,ObservationPlanner,ObservationQueue
+
+NS_RATE = 0.001454
+MD_RATE = 0.000727
+
+def _slew_time(a,b):
+    return max(abs(a[0]-b[0])/NS_RATE,abs(a[1]-b[1])/MD_RATE)
+
+def _planner(**kwargs):
+    return ObservationPlanner(_slew_time,d2r(53.0),d2r(64.0),**kwargs)
+
+def _nsew(ns,ew,dwell=300.0,**kwargs):
+    return Observation(make_coordinates(d2r(ns),d2r(ew),system="nsew",units="radians"),
+                       dwell,name="%s,%s"%(ns,ew),**kwargs)
+
+def _check(schedule,position,date):
+    for observation,depart,start,end in schedule:
+        assert depart >= date - 1e-9
+        assert start - depart >= _slew_time(position,observation.position(start))*eph.second - 1e-5
+        assert abs(end - start - observation.dwell*eph.second) < 1e-9
+        if observation.start is not None:
+            assert start >= observation.start
+        if observation.end is not None:
+            assert end <= observation.end
+        position,date = observation.position(end),end
+
+def test_ordering_minimises_slews():
+    observations = [_nsew(ns,0.0) for ns in [40,-40,10,-10,30,-30,0]]
+    now = float(eph.now())
+    planner = _planner()
+    schedule,unscheduled = planner.schedule(observations,(0.0,0.0),now)
+    assert not unscheduled and len(schedule) == 7
+    _check(schedule,(0.0,0.0),now)
+    in_order = planner._simulate(observations,(0.0,0.0),now,now+planner.horizon*eph.second)
+    assert schedule[-1][3] < in_order[-1][3]
+
+def test_windows_and_limits():
+    now = float(eph.now())
+    later = now + 3600*eph.second
+    observations = [
+        _nsew(0.0,0.0,start=later),
+        _nsew(10.0,0.0),
+        _nsew(60.0,0.0), # outside the NS limit
+        _nsew(0.0,10.0,end=now+60*eph.second)] # window too short
+    schedule,unscheduled = _planner().schedule(observations,(0.0,0.0),now)
+    assert [obs.name for obs,_,_,_ in schedule] == ["10.0,0.0","0.0,0.0"]
+    assert sorted(obs.name for obs in unscheduled) == ["0.0,10.0","60.0,0.0"]
+    _check(schedule,(0.0,0.0),now)
+    assert schedule[1][2] == later
+
+def test_source_in_limits():
+    now = float(eph.now())
+    source = Observation(make_coordinates("12:30:00","-45:00:00"),600.0)
+    schedule,unscheduled = _planner().schedule([source],(0.0,0.0),now)
+    _,depart,start,end = schedule[0]
+    ns,ew = source.position(start)
+    assert abs(ns) <= d2r(53.0) and abs(ew) <= d2r(64.0)
+    _check(schedule,(0.0,0.0),now)
+
+class PointingController(object):
+    def __init__(self):
+        self.observe_lock = RLock()
+        self.observed = []
+
+    def observe(self,coordinates,track=True):
+        with self.observe_lock:
+            self.observed.append(coordinates)
+
+def test_stopped_queue_does_not_replace_pointing():
+    controller = PointingController()
+    queue = ObservationQueue(controller)
+    observation = _nsew(10.0,0.0)
+    results = []
+    runner = Thread(target=lambda: results.append(
+            queue._observe(observation,float(eph.now()))))
+    # a direct pointing is in progress when the runner reaches its departure
+    with controller.observe_lock:
+        runner.start()
+        sleep(0.1)
+        queue.stop()
+        controller.observe("point")
+    runner.join(5.0)
+    assert results == [False]
+    assert controller.observed == ["point"]
+
+class SlowPositionQueue(ObservationQueue):
+    """Queue whose position read blocks until released."""
+    def __init__(self):
+        ObservationQueue.__init__(self,PointingController())
+        self.planner = _planner()
+        self.reading = Event()
+        self.release = Event()
+
+    def position(self):
+        self.reading.set()
+        self.release.wait(5.0)
+        return (0.0,0.0)
+
+def test_planning_does_not_hold_queue_lock():
+    queue = SlowPositionQueue()
+    first = queue.add(make_coordinates(d2r(10.0),0.0,system="nsew",units="radians"),300.0)
+    second = queue.add(make_coordinates(d2r(-10.0),0.0,system="nsew",units="radians"),300.0)
+    schedules = []
+    planner = Thread(target=lambda: schedules.append(queue.plan()))
+    planner.start()
+    assert queue.reading.wait(5.0)
+    # the queue can be changed while planning is in progress
+    with queue._changed:
+        queue.pending.remove(first)
+    queue.add(make_coordinates(0.0,d2r(10.0),system="nsew",units="radians"),300.0)
+    queue.release.set()
+    planner.join(10.0)
+    assert [entry[0] for entry in schedules[0]] == [second]
+    assert queue.schedule == schedules[0]
+
+if __name__ == "__main__":
+    test_ordering_minimises_slews()
+    test_windows_and_limits()
+    test_source_in_limits()
+    test_stopped_queue_does_not_replace_pointing()
+    test_planning_does_not_hold_queue_lock()
@@ -0,0 +1,35 @@
+import numpy as np
+from anansi.tcc.position_history import PositionHistory
+
+def _status(count):
+    return {
+        "east_count":count,
+        "west_count":2*count,
+        "east_tilt":0.001*count,
+        "west_tilt":0.002*count,
+        "east_status":112,
+        "west_status":113}
+
+def test_ring_buffer_wraps():
+    history = PositionHistory(size=8)
+    for ii in range(20):
+        history.append(float(ii),_status(ii))
+    assert len(history) == 8
+    assert list(history.last(8).east_count) == range(12,20)
+    assert list(history.last(3).time) == [17.0,18.0,19.0]
+    assert list(history.last(100).west_count) == range(24,40,2)
+
+def test_window_and_velocity():
+    history = PositionHistory(size=64)
+    for ii in range(50):
+        history.append(0.5*ii,_status(ii))
+    window = history.window(5.0,now=24.5)
+    assert window.time[0] == 19.5
+    assert len(window) == 11
+    assert np.isclose(history.velocity(5.0,"east","count",now=24.5),2.0)
+    assert np.isclose(history.velocity(5.0,"west","tilt",now=24.5),0.004)
+    assert np.isnan(history.velocity(0.1,now=24.5))
+
+if __name__ == "__main__":
+    test_ring_buffer_wraps()
+    test_window_and_velocity()
@@ -0,0 +1,70 @@
+import copy
+import logging
+from anansi.config import config
+from anansi.tcc import position_log
+from anansi.tcc import drives
+
+def _status(east,west=0,status=112):
+    return {"east_count":east,"west_count":west,"east_status":status,"west_status":status,
+            "east_tilt":0.0,"west_tilt":0.0}
+
+def _run(policy,frames):
+    return [record["east_count"] for t,status in frames for record in policy.select(t,status)]
+
+def test_change_and_interval():
+    frames = [(0.1*ii,_status(ii//2)) for ii in range(40)]
+    assert _run(position_log.ChangePolicy(),frames) == range(20)
+    assert _run(position_log.IntervalPolicy(1.0),frames) == [0,5,10,15]
+
+def test_threshold():
+    frames = [(ii,_status(ii)) for ii in range(50)] + [(50,_status(49,status=113))]
+    policy = position_log.ThresholdPolicy(10)
+    assert _run(policy,frames) == [0,10,20,30,40,49]
+    assert policy.seen == 51 and policy.emitted == 6
+
+def test_minmax():
+    counts = [5,9,1,4, 3,3,3,3, 7]
+    frames = [(ii,_status(count,west=-count)) for ii,count in enumerate(counts)]
+    assert _run(position_log.position_log_policy("minmax",interval=4),frames) == [9,1,3]
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self,level=1)
+        self.records = []
+
+    def emit(self,record):
+        self.records.append(record)
+
+def _frame(drive,t,east):
+    drive.status_dict.update(_status(east))
+    drive.status_time = t
+    drive._log_position()
+
+def test_dropped_frames_are_not_logged():
+    dc = copy.copy(config.ns_drive)
+    dc.speed_file = ""
+    dc.position_log = "interval"
+    dc.position_log_interval = 1.0
+    drive = drives.NSDriveInterface(dc)
+    handler = RecordingHandler()
+    logger = logging.getLogger('anansi')
+    logger.addHandler(handler)
+    try:
+        _frame(drive,0.0,100)
+        assert len(handler.records) == 1
+        # inside the interval, so not selected and never logged
+        _frame(drive,0.5,101)
+        assert len(handler.records) == 1
+        drive.position_trace = True
+        _frame(drive,0.6,102)
+        assert len(handler.records) == 2
+        assert handler.records[-1].levelno == logging.DEBUG
+    finally:
+        logger.removeHandler(handler)
+        drive.exit_funcs.deregister(drive.clean_up)
+
+if __name__ == "__main__":
+    test_change_and_interval()
+    test_threshold()
+    test_minmax()
+    test_dropped_frames_are_not_logged()
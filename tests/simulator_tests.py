@@ -0,0 +1,302 @@
+import copy
+import socket
+from threading import Event,Thread
+from time import sleep
+import numpy as np
+import ephem as eph
+from anansi.config import config
+from anansi.tcc import drives
+from anansi.tcc.simulator import EZ80Simulator
+from anansi.tcc.coordinates import make_coordinates
+from anansi.tcc.track_table import TrackTable
+from anansi.tcc.telescope_controller import NSTracker
+
+def _simulated_ns_drive(**kwargs):
+    options = dict(east_count=32768,west_count=32768,fast_rate=400.0,slow_rate=200.0,
+                   min_count=10650,max_count=54880,start_lag=0.0,update_interval=0.05)
+    options.update(kwargs)
+    sim = EZ80Simulator("NST_SWIN","127.0.0.1",0,**options)
+    sim.start()
+    dc = copy.copy(config.ns_drive)
+    dc.ip = "127.0.0.1"
+    dc.port = sim.port
+    dc.poll_interval = 0
+    dc.speed_file = ""
+    return sim,drives.NSDriveInterface(dc)
+
+def _idle(drive):
+    return not drive.active()
+
+def test_status_and_slew():
+    sim,drive = _simulated_ns_drive()
+    try:
+        assert drive.get_status()["east_count"] == 32768
+        drive.set_tilts_from_counts(33768,32268)
+        assert drive.wait_for(_idle,timeout=10.0)
+        assert not drive.has_error()
+        status = drive.get_status()
+        assert (status["east_count"],status["west_count"]) == (33768,32268)
+        assert drive.connections.open_count <= 2
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_stop_interrupts_drive():
+    sim,drive = _simulated_ns_drive(fast_rate=100.0)
+    try:
+        drive.set_tilts_from_counts(40000,40000)
+        assert drive.active()
+        drive.stop()
+        assert not drive.active()
+        assert not drive.has_error()
+        assert drive.get_status()["east_count"] < 40000
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_interrupt_cancels_blocked_read():
+    # without a stop command the eZ80 never sends "E" 0, so the
+    # drive thread read has to be cancelled
+    sim,drive = _simulated_ns_drive(fast_rate=100.0,update_interval=5.0)
+    try:
+        drive.set_tilts_from_counts(40000,40000)
+        assert drive.interrupt(timeout=2.0)
+        assert not drive.active()
+        assert drive.interrupt_latency < 1.5
+        assert not drive.has_error()
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_fault_sets_error_state():
+    sim,drive = _simulated_ns_drive(fault_probability=1.0,clock_rate=50.0,fast_rate=10.0)
+    try:
+        drive.set_tilts_from_counts(40000,40000)
+        assert drive.wait_for(lambda d: d.has_error(),timeout=10.0)
+        assert isinstance(drive.error_state,drives.eZ80Error)
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_closed_session_is_retried():
+    sim,drive = _simulated_ns_drive(single_use_sessions=True)
+    try:
+        for ii in range(3):
+            drive.get_status()
+        drive.set_tilts_from_counts(33768,32268)
+        assert drive.wait_for(_idle,timeout=10.0)
+        assert not drive.has_error()
+        status = drive.get_status()
+        assert (status["east_count"],status["west_count"]) == (33768,32268)
+        assert drive.connections.open_count <= 1
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_stuck_drive_thread_refuses_commands():
+    sim,drive = _simulated_ns_drive(fast_rate=100.0)
+    interrupt = drive.interrupt
+    try:
+        drive.set_tilts_from_counts(40000,40000)
+        drive.interrupt = lambda timeout=None: False
+        try:
+            drive.set_tilts_from_counts(30000,30000)
+        except drives.DriveThreadAlive:
+            pass
+        else:
+            assert False, "command accepted while the drive thread was running"
+        assert isinstance(drive.error_state,drives.DriveThreadAlive)
+    finally:
+        drive.interrupt = interrupt
+        drive.clean_up()
+        sim.shutdown()
+
+class BrokenClient(object):
+    reused = False
+    frames_received = 0
+
+    def send(self,code,data=None):
+        raise socket.error("Broken pipe")
+
+    def close(self):
+        pass
+
+def test_failed_send_clears_interrupt():
+    sim,drive = _simulated_ns_drive()
+    acquire = drive.connections.acquire
+    try:
+        drive.get_status()
+        drive.connections.acquire = lambda fresh=False: BrokenClient()
+        for command in [lambda: drive.set_tilts_from_counts(40000,40000),drive.stop]:
+            try:
+                command()
+            except socket.error:
+                pass
+            else:
+                assert False, "command sent on a broken session"
+            assert not drive._interrupt.is_set()
+    finally:
+        drive.connections.acquire = acquire
+        drive.clean_up()
+        sim.shutdown()
+
+class CancelledClient(object):
+    def receive(self):
+        raise socket.error("cancelled")
+
+    def close(self):
+        pass
+
+def test_replaced_drive_thread_keeps_state():
+    sim,drive = _simulated_ns_drive()
+    try:
+        replacement = Thread()
+        drive._active.set()
+        drive._east_active.set()
+        drive._active_drive = replacement
+        drive.connections.open_count += 1
+        drive._interrupt.set()
+        old = Thread(target=drive._drive_thread,args=(CancelledClient(),))
+        old.start()
+        old.join(5.0)
+        drive._interrupt.clear()
+        assert drive._east_active.is_set()
+        assert drive._active_drive is replacement
+        drive._active_drive = None
+        drive._east_active.clear()
+        drive._active.clear()
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_cached_status_max_age():
+    sim,drive = _simulated_ns_drive()
+    try:
+        assert drive.status_age() is None
+        drive.get_status(max_age=60.0)
+        commands = sim.commands
+        assert drive.status_age() < 60.0
+        drive.get_status(max_age=60.0)
+        assert sim.commands == commands
+        drive.get_status(max_age=0.0)
+        assert sim.commands == commands + 1
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_poller_refreshes_status():
+    sim,drive = _simulated_ns_drive()
+    try:
+        drive.start_polling(0.05)
+        commands = sim.commands
+        assert drive.wait_for(lambda d: sim.commands >= commands + 3 and
+                              d.status_age() is not None,timeout=5.0)
+        assert not drive.has_error()
+        drive.stop_polling()
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_poller_tolerates_failures():
+    sim,drive = _simulated_ns_drive()
+    failures = []
+    def on_event(drive,event,value):
+        if event == drives.ERROR_EVENT:
+            failures.append(drive._poller.failures)
+    try:
+        drive.get_status()
+        drive.subscribe(on_event)
+        sim.shutdown()
+        drive.connections.close_all()
+        drive.start_polling(0.05,max_failures=3)
+        assert drive.wait_for(lambda d: d.has_error(),timeout=10.0)
+        # the error is only raised once three polls in a row have failed
+        assert failures == [3]
+    finally:
+        # the simulator is gone, so there is nothing to send a stop to
+        drive.stop_polling()
+        drive.exit_funcs.deregister(drive.clean_up)
+
+def test_streaming_plan():
+    sim,drive = _simulated_ns_drive()
+    try:
+        step = drive.minimum_step(0.0)
+        east,west = drive.tilts_to_counts(step,step)
+        assert min(abs(east-32768),abs(west-32768)) > config.ns_drive.minimum_counts
+        table = TrackTable(make_coordinates("12:30:00","-45:00:00"))
+        tracker = NSTracker(drive,table,True,Event())
+        now = eph.now()
+        plan = tracker._plan(now,4)
+        assert len(plan) == 4
+        step = max(tracker.tolerance,drive.minimum_step(table.value("ns",now)))
+        last_tilt,last_date = table.value("ns",now),float(now)
+        for send,tilt,date in plan:
+            assert abs(abs(tilt-last_tilt) - step) < 1e-3*step
+            assert send < (last_date+date)/2 < date
+            last_tilt,last_date = tilt,date
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+class LinearTable(object):
+    """Source moving along the NS axis at a fixed rate from tilt 0."""
+    def __init__(self,rate):
+        self.rate = rate
+        self.epoch = float(eph.now())
+
+    def value(self,name,dates=None):
+        dates = eph.now() if dates is None else dates
+        scalar = np.ndim(dates) == 0
+        tilts = self.rate*(np.asarray(dates,dtype="float64")-self.epoch)/eph.second
+        return float(tilts) if scalar else tilts
+
+def _stream(table,duration):
+    sim,drive = _simulated_ns_drive()
+    sent = []
+    try:
+        tracker = NSTracker(drive,table,True,Event())
+        set_tilts = tracker.set_tilts
+        def record(tilt):
+            sent.append(tilt)
+            set_tilts(tilt)
+        tracker.set_tilts = record
+        thread = Thread(target=tracker.stream)
+        thread.start()
+        sleep(duration)
+        tracker._stop.set()
+        drive.wake()
+        thread.join(10.0)
+        assert not thread.is_alive()
+        assert not drive.has_error()
+        # no setpoint was refused as too small a move
+        assert tracker._backoff == config.tracking.retry_backoff
+        return drive,sent
+    finally:
+        drive.clean_up()
+        sim.shutdown()
+
+def test_stream_moving_source():
+    drive,sent = _stream(LinearTable(0.002),4.0)
+    assert len(sent) >= 2
+    for last,tilt in zip(sent[:-1],sent[1:]):
+        assert tilt - last >= drive.minimum_step(tilt)
+
+def test_stream_fixed_source():
+    drive,sent = _stream(LinearTable(0.0),1.0)
+    assert sent == []
+
+if __name__ == "__main__":
+    test_status_and_slew()
+    test_stop_interrupts_drive()
+    test_interrupt_cancels_blocked_read()
+    test_fault_sets_error_state()
+    test_closed_session_is_retried()
+    test_stuck_drive_thread_refuses_commands()
+    test_failed_send_clears_interrupt()
+    test_replaced_drive_thread_keeps_state()
+    test_cached_status_max_age()
+    test_poller_refreshes_status()
+    test_poller_tolerates_failures()
+    test_streaming_plan()
+    test_stream_moving_source()
+    test_stream_fixed_source()
@@ -0,0 +1,68 @@
+import copy
+from time import time
+from anansi.comms import UDPSender,UDPReceiver
+from anansi.tcc.status_server import STATUS_DICT_DEFAULTS
+from anansi.tcc.status_broadcast import StatusBroadcaster,StatusListener,compact_status
+
+class CachedStatus(object):
+    def __init__(self):
+        self.status_dict = copy.deepcopy(STATUS_DICT_DEFAULTS)
+        self.updated = time()
+        self.updates = 0
+
+    def snapshot(self):
+        return self.updated,copy.deepcopy(self.status_dict)
+
+    def update(self):
+        self.updates += 1
+        self.updated = time()
+
+def test_udp_loopback():
+    receiver = UDPReceiver("127.0.0.1",0,timeout=2.0)
+    sender = UDPSender("127.0.0.1",receiver.port)
+    try:
+        sender.send("status")
+        assert receiver.receive() == "status"
+    finally:
+        sender.close()
+        receiver.close()
+
+def test_compact_status():
+    status = copy.deepcopy(STATUS_DICT_DEFAULTS)
+    status["ns"]["east"]["tilt"] = 0.5
+    msg = compact_status(status,{"sequence":3})
+    assert len(msg) < 1000
+    assert 'sequence="3"' in msg
+    assert 'tilt="0.5"' in msg
+
+def test_sequence_and_loss():
+    listener = StatusListener("127.0.0.1",0,timeout=2.0)
+    status = CachedStatus()
+    broadcaster = StatusBroadcaster(status,"127.0.0.1",listener._receiver.port)
+    try:
+        broadcaster.broadcast()
+        sequence,xml = listener.receive()
+        assert sequence == 1
+        assert abs(float(xml.attrib["time"]) - status.updated) < 1e-3
+        assert xml.find("md").find("west").attrib["driving"] == "False"
+        # a datagram that never arrives
+        broadcaster.sequence += 1
+        broadcaster.broadcast()
+        sequence,xml = listener.receive()
+        assert sequence == 3
+        assert listener.received == 2
+        assert listener.lost == 1
+        # cached snapshots are published without refreshing them
+        assert status.updates == 0
+        status.updated -= 2*broadcaster.max_age
+        broadcaster.broadcast()
+        listener.receive()
+        assert status.updates == 1
+    finally:
+        broadcaster._sender.close()
+        listener.close()
+
+if __name__ == "__main__":
+    test_udp_loopback()
+    test_compact_status()
+    test_sequence_and_loss()
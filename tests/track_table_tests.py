@@ -0,0 +1,39 @@
+import numpy as np
+import ephem as eph
+from anansi.tcc.coordinates import make_coordinates
+from anansi.tcc.track_table import TrackTable
+
+def _check_against_ephem(coords,columns,tolerance=1e-6):
+    table = TrackTable(coords,duration=7200.0,step=10.0,knot_spacing=600.0,margin=600.0)
+    start = eph.now()
+    for offset in [0.0,1234.5,4321.0,7000.0]:
+        date = eph.Date(start + offset*eph.second)
+        coords.compute(date)
+        for name in columns:
+            expected = float(getattr(coords,name))
+            error = abs(np.angle(np.exp(1j*(table.value(name,date)-expected))))
+            assert error < tolerance,(name,offset,error)
+    return table
+
+def test_radec_table():
+    coords = make_coordinates("12:30:00","-45:00:00",system="equatorial")
+    _check_against_ephem(coords,["ns","ew","ha","dec","lst"])
+
+def test_nsew_table():
+    coords = make_coordinates(0.3,-0.2,system="nsew",units="radians")
+    _check_against_ephem(coords,["ns","ew"],tolerance=1e-9)
+
+def test_table_extends():
+    coords = make_coordinates("12:30:00","-45:00:00",system="equatorial")
+    table = TrackTable(coords,duration=3600.0,step=10.0,knot_spacing=600.0,margin=600.0)
+    assert table.builds == 1
+    later = eph.now() + 3300*eph.second
+    table.value("ns",later)
+    assert table.builds == 2
+    values = table.value("ns",[later,later+10*eph.second])
+    assert len(values) == 2 and table.builds == 2
+
+if __name__ == "__main__":
+    test_radec_table()
+    test_nsew_table()
+    test_table_extends()